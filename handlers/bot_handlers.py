@@ -1,25 +1,40 @@
 # handlers/bot_handlers.py
 from __future__ import annotations
+import asyncio
 import logging
-from typing import Dict, Any, List, Callable, Awaitable
+from typing import List
 
 from telethon import events, types, TelegramClient
 from telethon.events import NewMessage, CallbackQuery
-from telethon.tl.types import User, Message
+from telethon.tl.types import User
 from config import settings
 from services import user_service, utilites
-from services.db import insert_many_from_exported, get_invites_by_owner, get_all_invites, upsert_user_basic
+from services.accounts import AccountPool
+from services.dialog_state import Dialog, get_dialogs
+from services.link_batches import LinkBatchError, batch_key, take_batch
+from services.link_jobs import LinkJobQueue
+from services.progress import ProgressReporter
+from services.rate_limiter import get_limiter
+from services.db import (
+    get_invites_by_owner, iter_all_invites, upsert_user_basic, get_owner_stats,
+    add_sync_chat, set_sync_chat_enabled, delete_sync_chat, list_sync_chats,
+)
 
 from decorators.auth import require_role, Role
 
-from locales.kbrds import main_menu, links_inline_menu, back_to_links_btn, stat_inline_menu, back_to_stat_btn
-from locales.texts import get_text, get_all_btns_list, links_list_to_str
+from locales.kbrds import (
+    main_menu, links_inline_menu, back_to_links_btn, stat_inline_menu, back_to_stat_btn, link_job_btn,
+)
+from locales.texts import (
+    get_text, get_all_btns_list, links_list_to_str, owner_summary_to_str, sync_chats_to_str, limiter_snapshot_to_str,
+    accounts_snapshot_to_str, link_jobs_snapshot_to_str, progress_to_str,
+)
 
 log = logging.getLogger("app")
 
 
-# Простейшее хранилище состояний диалога (по user_id)
-STATE: Dict[int, Dict[str, Any]] = {}
+# Шаги диалогов (по user_id): только id сообщений, с TTL и, по настройке, в БД
+dialogs = get_dialogs()
 
 def private_only(func):
     async def wrapper(event, *args, **kwargs):
@@ -29,35 +44,94 @@ def private_only(func):
     return wrapper
 
 
-async def _create_and_send_links(
+def _job_titles(kind: str, params: dict) -> tuple[List[str | None], bool]:
+    """Названия ссылок задания и нужно ли переименовывать ссылки из запаса."""
+    if kind == "no_title":
+        return user_service.no_title_titles(params["n"]), False
+    if kind == "titles":
+        return user_service.prepare_titles(params["titles"]), True
+    return user_service.mask_titles(params["mask"], params["n"]), True
+
+
+async def _delete_prompt(client: TelegramClient, user_id: int, prompt_id: int | None) -> None:
+    """Снести сообщение бота с вопросом / кнопкой «Назад» из лички оператора."""
+    if prompt_id:
+        try:
+            await client.delete_messages(user_id, prompt_id)
+        except Exception as e:
+            log.debug(f"delete prompt {prompt_id}: {e}")
+
+
+async def _enqueue_links(
                 client: TelegramClient,
-                user_client: TelegramClient,
+                jobs: LinkJobQueue,
                 user_id: int,
-                prompt_msg: Message | None,
-                create_coro_factory: Callable[[], Awaitable[List[types.ChatInviteExported]]],
+                prompt_id: int | None,
+                kind: str,
+                params: dict,
+                ) -> None:
+    """
+    Удаляет предыдущее бот-сообщение с кнопкой «Назад», показывает статус с кнопкой
+    отмены и ставит задание в очередь (services/link_jobs.py) — ответ оператору сразу,
+    ссылки пришлёт _run_link_job.
+    """
+    await dialogs.pop(user_id)
+    await _delete_prompt(client, user_id, prompt_id)
+
+    status = await client.send_message(
+        user_id, get_text('LINK_JOB_QUEUED').format(ahead=jobs.ahead()), buttons=link_job_btn(),
+    )
+    key = batch_key(user_id, settings.target_chat_id, kind, *params.values())
+    if jobs.busy(key):
+        # такой же запрос ещё в очереди или в работе — своя пачка, а не продолжение чужой:
+        # продолжается только повтор после сбоя, когда прежнего задания уже нет
+        key = batch_key(user_id, settings.target_chat_id, kind, *params.values(), status.id)
+    await jobs.submit(user_id, settings.target_chat_id, kind, params, key, status.id)
+
+
+async def _run_link_job(
+                client: TelegramClient,
+                user_client: TelegramClient | AccountPool,
+                jobs: LinkJobQueue,
+                job: dict,
                 ) -> None:
     """
-    Удаляет предыдущее бот-сообщение с кнопкой «Назад», показывает статус,
-    создаёт ссылки, сохраняет в БД и отправляет результат одним местом.
+    Выполняет задание очереди: получает ссылки (из запаса или новые; пачка
+    services/link_batches.py, каждая ссылка сразу пишется в БД с владельцем)
+    и отправляет результат одним местом, обновляя статусное сообщение задания.
+    Пока ссылки создаются, статус показывает прогресс (services/progress.py).
     """
-    # 1) снести предыдущее "вопрос/назад"
-    if prompt_msg:
+    user_id = job["owner_tg_id"]
+
+    async def _edit(text: str, **kwargs) -> None:
+        if job["message_id"]:
+            await client.edit_message(user_id, job["message_id"], text, **kwargs)
+        else:
+            await client.send_message(user_id, text, **kwargs)
+
+    async def _status(text: str, **kwargs) -> None:
         try:
-            await prompt_msg.delete()
+            await _edit(text, **kwargs)
         except Exception:
             pass
 
-    # 2) статус
-    status = await client.send_message(user_id, get_text('CREATING_LINKS'))
-
+    await _status(get_text('CREATING_LINKS'), buttons=link_job_btn())
+    titles, rename = _job_titles(job["kind"], job["params"])
+    limiter = user_client if isinstance(user_client, AccountPool) else get_limiter()
+    reporter = ProgressReporter(
+        lambda text: _edit(text, buttons=link_job_btn()),
+        lambda *state: progress_to_str("PROGRESS_LINKS", *state),
+        flood=lambda: limiter.parked_for("create"),
+    )
     try:
-        # 3) создать ссылки
-        links = await create_coro_factory()
-
-        # 4) сохранить в БД
-        await insert_many_from_exported(links, settings.target_chat_id, user_id)
+        # взять ссылки из запаса / создать — с интерактивным приоритетом: фоновый синк уступает
+        async with get_limiter().interactive(), reporter:
+            links = await take_batch(
+                user_client, user_id, int(job["chat_id"]), job["batch_key"], titles, rename=rename,
+                progress=reporter.update,
+            )
 
-        # 5) ответ с результатом
+        # ответ с результатом
         try:
             to_answer = await client.send_message(user_id, links_list_to_str(links), buttons=main_menu())
         except Exception as e:
@@ -65,26 +139,31 @@ async def _create_and_send_links(
         if links:
             file = await utilites.create_excel_from_(links)
             await client.send_file(entity=user_id, file=file, reply_to=to_answer, buttons=main_menu())
-        # 6) обновить статус
-        await status.edit(get_text('READY_LINKS'))
-
+        await _status(get_text('READY_LINKS'))
+
+    except asyncio.CancelledError:
+        # при остановке бота задание продолжится после рестарта — статус не трогаем
+        if not jobs.stopping:
+            await _status(get_text('LINK_JOB_CANCELLED'))
+        raise
+    except LinkBatchError as e:
+        # готовые ссылки уже в БД; тот же запрос ещё раз продолжит пачку, а не начнёт заново
+        log.exception("links_creation_interrupted")
+        await _status(get_text('CREATING_LINKS_PARTIAL').format(done=e.done, total=e.total, error=e))
     except Exception as e:
         log.exception("links_creation_failed")
-        try:
-            await status.edit(f"{get_text('CREATING_LINKS_ERROR')}: {e}")
-        except Exception:
-            pass
-    finally:
-        STATE.pop(user_id, None)
-
+        await _status(f"{get_text('CREATING_LINKS_ERROR')}: {e}")
 
 
-def setup_bot_handlers(client: TelegramClient, user_client: TelegramClient) -> None:
+def setup_bot_handlers(client: TelegramClient, user_client: TelegramClient | AccountPool) -> LinkJobQueue:
     """
     Регистрирует хендлеры команд и меню.
     client      — Bot API клиент (бот)
     user_client — пользовательский клиент (юзербот с правами администратора канала)
+                  или пул таких аккаунтов (services/accounts.py)
+    Возвращает очередь заданий на ссылки: её start()/stop() зовёт main.py.
     """
+    jobs = LinkJobQueue(lambda job: _run_link_job(client, user_client, jobs, job))
 
     # ---------------------- БАЗОВЫЕ КОМАНДЫ ----------------------
 
@@ -110,14 +189,58 @@ def setup_bot_handlers(client: TelegramClient, user_client: TelegramClient) -> N
     async def super_only(event: NewMessage) -> None:
         # пример использования ранее написанной логики получения ссылок
         user_id = event.sender_id
-        data = await get_all_invites()
-        if data:
-            file = await utilites.create_excel(data, owners=True)
+        status = await event.respond(get_text("PROGRESS_EXPORT").format(done=0))
+        async with ProgressReporter(status.edit, lambda *state: progress_to_str("PROGRESS_EXPORT", *state)) as reporter:
+            file = await utilites.create_excel_stream(
+                iter_all_invites(group_by_owner=True), owners=True, progress=reporter.update,
+            )
+        try:
+            await status.delete()
+        except Exception:
+            pass
+        if file:
             await client.send_file(entity=user_id, caption=get_text("TOTAL_STAT_TEXT"), file=file)
         else:
             await event.respond(get_text("NO_STAT_TEXT"))
         return
 
+    # Реестр чатов синхронизации: /chats, /chats add|on|off|del <chat_id>
+    @client.on(events.NewMessage(pattern=r"^/chats(?:\s+(add|on|off|del)\s+(-?\d+))?\s*$"))
+    @private_only
+    @require_role({Role.SUPER})
+    async def sync_chats(event: NewMessage) -> None:
+        action, chat_id = event.pattern_match.group(1), event.pattern_match.group(2)
+        if action == "add":
+            await add_sync_chat(int(chat_id), include_revoked=settings.sync_include_revoked)
+            await set_sync_chat_enabled(int(chat_id), True)
+        elif action in ("on", "off", "del"):
+            if action == "del":
+                found = await delete_sync_chat(int(chat_id))
+            else:
+                found = await set_sync_chat_enabled(int(chat_id), action == "on")
+            if not found:
+                await event.respond(get_text("SYNC_CHAT_NOT_FOUND"))
+                return
+        # планировщик подхватит изменения при следующем чтении реестра
+        await event.respond(sync_chats_to_str(await list_sync_chats()))
+
+    # Состояние лимитеров юзербота (с пулом — по каждому аккаунту)
+    @client.on(events.NewMessage(pattern=r"^/limits$"))
+    @private_only
+    @require_role({Role.SUPER})
+    async def limits(event: NewMessage) -> None:
+        if isinstance(user_client, AccountPool):
+            await event.respond(accounts_snapshot_to_str(user_client.snapshot()))
+        else:
+            await event.respond(limiter_snapshot_to_str(get_limiter().snapshot()))
+
+    # Очередь заданий на создание ссылок
+    @client.on(events.NewMessage(pattern=r"^/jobs$"))
+    @private_only
+    @require_role({Role.SUPER})
+    async def link_jobs(event: NewMessage) -> None:
+        await event.respond(link_jobs_snapshot_to_str(jobs.snapshot()))
+
     # ---------------------- КНОПКА: СОЗДАНИЕ ССЫЛОК ----------------------
     # Поскольку тексты локализованы, проверяем raw_text против всех вариантов
     @client.on(events.NewMessage)
@@ -133,18 +256,20 @@ def setup_bot_handlers(client: TelegramClient, user_client: TelegramClient) -> N
         
         # Открыть инлайн-меню статистики
         if text in get_all_btns_list("BTN_STAT"):
-            await event.respond(get_text("MAIN_STAT_TEXT"), buttons=stat_inline_menu())
+            # мгновенная сводка из owner_stats, Excel — по кнопкам ниже
+            summary = owner_summary_to_str(await get_owner_stats(user_id))
+            msg = f"{summary}\n\n{get_text('MAIN_STAT_TEXT')}" if summary else get_text("MAIN_STAT_TEXT")
+            await event.respond(msg, buttons=stat_inline_menu())
             return
 
         # Остальные сообщения обработаем в "шаговом" диалоге (ниже),
         # если есть активное состояние. Иначе выходим.
-        st = STATE.get(user_id)
+        st = dialogs.get(user_id)
         if not st:
             return
 
         # ---------- Шаги диалога после нажатия инлайн-кнопок ----------
-        mode: str = st.get("mode")
-        step: str = st.get("step")
+        mode, step = st.mode, st.step
 
         # 1) Режим: без названия — спрашиваем количество
         if mode == "no_title" and step == "ask_count":
@@ -156,16 +281,7 @@ def setup_bot_handlers(client: TelegramClient, user_client: TelegramClient) -> N
             if not (1 <= n <= 50):
                 await event.reply(get_text("ASK_COUNT"))
                 return
-            prompt: Message = STATE.get(user_id, {}).get("prompt_msg")
-            await _create_and_send_links(
-                client,
-                user_client,
-                user_id,
-                prompt,
-                create_coro_factory=lambda: user_service.create_links_no_title(
-                    user_client, settings.target_chat_id, n
-                ),
-            )
+            await _enqueue_links(client, jobs, user_id, st.prompt_id, "no_title", {"n": n})
             return
 
         # 2) Режим: по списку названий
@@ -177,17 +293,7 @@ def setup_bot_handlers(client: TelegramClient, user_client: TelegramClient) -> N
             if len(titles) > 50:
                 await event.reply(get_text("ASK_TITLES"))
                 return
-            # стало:
-            prompt: Message = STATE.get(user_id, {}).get("prompt_msg")
-            await _create_and_send_links(
-                    client,
-                    user_client,
-                    user_id,
-                    prompt,
-                    create_coro_factory=lambda: user_service.create_links_with_titles(
-                        user_client, settings.target_chat_id, titles
-                    ),
-                )
+            await _enqueue_links(client, jobs, user_id, st.prompt_id, "titles", {"titles": titles})
             return
 
         # 3) Режим: по маске
@@ -196,16 +302,10 @@ def setup_bot_handlers(client: TelegramClient, user_client: TelegramClient) -> N
                 if not text:
                     await event.reply(get_text("ASK_MASK"))
                     return
-                st["mask"] = text
-                st["step"] = "ask_count"
                 ask_msg = await event.reply(get_text("ASK_COUNT"), buttons=back_to_links_btn())
-                prompt: Message = STATE.get(user_id, {}).get("prompt_msg")
-                if prompt:
-                    try:
-                        await prompt.delete()
-                    except Exception:
-                        pass
-                st["prompt_msg"] = ask_msg  # теперь удалим именно это сообщение перед генерацией
+                await _delete_prompt(client, user_id, st.prompt_id)
+                # теперь удалим именно это сообщение перед генерацией
+                await dialogs.set(user_id, Dialog("mask", "ask_count", prompt_id=ask_msg.id, mask=text))
                 return
 
             if step == "ask_count":
@@ -218,17 +318,7 @@ def setup_bot_handlers(client: TelegramClient, user_client: TelegramClient) -> N
                     await event.reply(get_text("ASK_COUNT"))
                     return
 
-                mask: str = st.get("mask", "")
-                prompt: Message = STATE.get(user_id, {}).get("prompt_msg")
-                await _create_and_send_links(
-                    client,
-                    user_client,
-                    user_id,
-                    prompt,
-                    create_coro_factory=lambda: user_service.create_links_with_mask(
-                        user_client, settings.target_chat_id, mask, n
-                    ),
-                )
+                await _enqueue_links(client, jobs, user_id, st.prompt_id, "mask", {"mask": st.mask or "", "n": n})
                 return
         # 4) Режим: статистика по списку ссылок
         if mode == "stat" and step == "ask_links":
@@ -236,14 +326,8 @@ def setup_bot_handlers(client: TelegramClient, user_client: TelegramClient) -> N
             if not links:
                 await event.reply(get_text("ASK_STAT_LINKS"))
                 return
-            # стало:
-            prompt: Message = STATE.get(user_id, {}).get("prompt_msg")
-            STATE.pop(user_id, None)
-            if prompt:
-                try:
-                    prompt.delete()
-                except Exception as e:
-                    log.error(f"prompt.delete(): {e}")
+            await dialogs.pop(user_id)
+            await _delete_prompt(client, user_id, st.prompt_id)
             data = await get_invites_by_owner(user_id)
             if data:
                 file = await utilites.create_excel(data, include=links)
@@ -259,42 +343,59 @@ def setup_bot_handlers(client: TelegramClient, user_client: TelegramClient) -> N
     @private_only
     @require_role({Role.SUPER, Role.BUYER})
     async def cb_no_title(event: CallbackQuery) -> None:
-        msg = await event.edit(get_text("ASK_COUNT"), buttons=back_to_links_btn())
-        STATE[event.sender_id] = {"mode": "no_title", "step": "ask_count", "prompt_msg": msg}
+        await event.edit(get_text("ASK_COUNT"), buttons=back_to_links_btn())
+        await dialogs.set(event.sender_id, Dialog("no_title", "ask_count", prompt_id=event.message_id))
 
     @client.on(events.CallbackQuery(pattern=b"gen:titles"))
     @private_only
     @require_role({Role.SUPER, Role.BUYER})
     async def cb_titles(event: CallbackQuery) -> None:
-        msg = await event.edit(get_text("ASK_TITLES"), buttons=back_to_links_btn())
-        STATE[event.sender_id] = {"mode": "titles", "step": "ask_list", "prompt_msg": msg}
+        await event.edit(get_text("ASK_TITLES"), buttons=back_to_links_btn())
+        await dialogs.set(event.sender_id, Dialog("titles", "ask_list", prompt_id=event.message_id))
 
     @client.on(events.CallbackQuery(pattern=b"gen:mask"))
     @private_only
     @require_role({Role.SUPER, Role.BUYER})
     async def cb_mask(event: CallbackQuery) -> None:
         
-        msg = await event.edit(get_text("ASK_MASK"), buttons=back_to_links_btn())
-        STATE[event.sender_id] = {"mode": "mask", "step": "ask_mask", "prompt_msg": msg}
+        await event.edit(get_text("ASK_MASK"), buttons=back_to_links_btn())
+        await dialogs.set(event.sender_id, Dialog("mask", "ask_mask", prompt_id=event.message_id))
 
     @client.on(events.CallbackQuery(pattern=b"(gen|stat):cancel"))
     @private_only
     async def cb_cancel(event: CallbackQuery) -> None:
-        STATE.pop(event.sender_id, None)
+        await dialogs.pop(event.sender_id)
         await event.edit(get_text("MAIN_MENU_TEXT"))
     
 
+    @client.on(events.CallbackQuery(pattern=b"job:cancel"))
+    @private_only
+    async def cb_job_cancel(event: CallbackQuery) -> None:
+        # задание определяется статусным сообщением, под которым нажата кнопка
+        state = await jobs.cancel(event.sender_id, event.message_id)
+        if state is None:
+            await event.answer(get_text("LINK_JOB_GONE"))
+            return
+        await event.answer()
+        # выполнявшееся задание само пишет итог в статус (_run_link_job); ждавшее — некому, пишем здесь
+        if state == "queued":
+            try:
+                await event.edit(get_text("LINK_JOB_CANCELLED"))
+            except Exception:
+                pass
+    
+
     @client.on(events.CallbackQuery(pattern=b"gen:back"))
     @private_only
     async def cb_back(event: CallbackQuery) -> None:
-        STATE.pop(event.sender_id, None)
+        await dialogs.pop(event.sender_id)
         await event.edit(get_text("CREATE_LINK_TEXT"), buttons=links_inline_menu())
     
 
     @client.on(events.CallbackQuery(pattern=b"stat:back"))
     @private_only
     async def stat_back(event: CallbackQuery) -> None:
-        STATE.pop(event.sender_id, None)
+        await dialogs.pop(event.sender_id)
         await event.edit(get_text("MAIN_STAT_TEXT"), buttons=stat_inline_menu())
     
 
@@ -316,6 +417,7 @@ def setup_bot_handlers(client: TelegramClient, user_client: TelegramClient) -> N
     @private_only
     async def stat_links_btn(event: CallbackQuery) -> None:
 
-        msg = await event.edit(get_text("ASK_STAT_LINKS"), buttons=back_to_stat_btn())
-        STATE[event.sender_id] = {"mode": "stat", "step": "ask_links", "prompt_msg": msg}
+        await event.edit(get_text("ASK_STAT_LINKS"), buttons=back_to_stat_btn())
+        await dialogs.set(event.sender_id, Dialog("stat", "ask_links", prompt_id=event.message_id))
 
+    return jobs
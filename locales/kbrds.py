@@ -70,6 +70,20 @@ def back_to_links_btn(user: Any = None) -> types.ReplyInlineMarkup:
     ]
     return types.ReplyInlineMarkup(rows=rows)
 
+def link_job_btn(user: Any = None) -> types.ReplyInlineMarkup:
+    """
+    Кнопка отмены под статусом задания на создание ссылок.
+    """
+    rows = [
+        types.KeyboardButtonRow(buttons=[
+            types.KeyboardButtonCallback(
+                text=get_btn_text("BTN_CANCEL_JOB"),
+                data=b"job:cancel"
+            )
+        ]),
+    ]
+    return types.ReplyInlineMarkup(rows=rows)
+
 def back_to_stat_btn(user: Any = None) -> types.ReplyInlineMarkup:
     """
     """
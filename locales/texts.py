@@ -1,3 +1,5 @@
+import datetime as dt
+import math
 from typing import List
 from telethon import types
 from html import escape
@@ -33,6 +35,31 @@ texts_dict = {
     "CREATING_LINKS_ERROR": {
         "RU": "⚠️ Не удалось создать ссылки: "
     },
+    "CREATING_LINKS_PARTIAL": {
+        "RU": "⚠️ Создано и сохранено {done} из {total} ссылок, дальше ошибка: {error}\n"
+              "Повторите тот же запрос — создание продолжится с того же места."
+    },
+    "PROGRESS_LINKS": {
+        "RU": "⏳ Создаю ссылки: {done} из {total}"
+    },
+    "PROGRESS_EXPORT": {
+        "RU": "⏳ Готовлю выгрузку: строк {done}"
+    },
+    "PROGRESS_ETA": {
+        "RU": ", осталось ~{eta}"
+    },
+    "PROGRESS_FLOOD": {
+        "RU": "\nTelegram просит подождать: {flood} с"
+    },
+    "LINK_JOB_QUEUED": {
+        "RU": "🕓 Запрос принят, заданий в очереди перед ним: {ahead}. Ссылки придут сюда — ботом можно пользоваться дальше."
+    },
+    "LINK_JOB_CANCELLED": {
+        "RU": "Создание ссылок отменено. Уже созданные сохранены — тот же запрос продолжит с того же места."
+    },
+    "LINK_JOB_GONE": {
+        "RU": "Задание уже завершено."
+    },
     "YOUR_STAT_TEXT": {
         "RU": "Статистика по вашим ссылкам: "
     },
@@ -48,6 +75,30 @@ texts_dict = {
     "NO_ACCESS_TEXT": {
         "RU": "⛔ У вас нет доступа к этой команде."
     },
+    "OWNER_SUMMARY_TEXT": {
+        "RU": "Ссылок: <b>{links}</b> (отозвано: {revoked})\nВступлений: <b>{usage}</b>\nОдобрено заявок: <b>{approved}</b>"
+    },
+    "SYNC_CHATS_TEXT": {
+        "RU": "Чаты синхронизации:\n{chats}\n\n<code>/chats add ID</code> · <code>/chats on ID</code> · <code>/chats off ID</code> · <code>/chats del ID</code>"
+    },
+    "SYNC_CHAT_LINE": {
+        "RU": "{icon} <code>{chat_id}</code>: ссылок {links}, стр. {pages}, {duration} с, синк {synced}{error}"
+    },
+    "SYNC_CHATS_EMPTY": {
+        "RU": "Реестр чатов пуст."
+    },
+    "SYNC_CHAT_NOT_FOUND": {
+        "RU": "Чат не найден в реестре."
+    },
+    "LIMITS_TEXT": {
+        "RU": "Лимитер юзербота (запросов/сек):\n{rows}"
+    },
+    "ACCOUNT_LINE": {
+        "RU": "<b>{name}</b> ({user_id}): {status}, запросов {requests}"
+    },
+    "JOBS_TEXT": {
+        "RU": "Очередь ссылок: воркеров {workers}, на оператора {per_user}\nВыполняются: {running}\nЖдут: {pending}"
+    },
     "ASK_STAT_LINKS": {
         "RU": "Напишите список ссылок для статистики (каждая ссылка с новой строки)"
     },
@@ -73,6 +124,9 @@ btns_dict = {
     "BTN_CANCEL": {
         "RU": "Отмена"
     },
+    "BTN_CANCEL_JOB": {
+        "RU": "✖️ Отменить"
+    },
     "BTN_BACK_MAIN": {
         "RU": "⬅️ В главное меню"
     },
@@ -112,3 +166,99 @@ def links_list_to_str(links: List[types.ChatInviteExported], lang: str = "RU") -
     '''
     '''
     return "\n".join(f"<code>{escape(l.link)}</code> {escape(l.title or '')}" for l in links)
+
+
+def owner_summary_to_str(stats: dict | None, lang: str = "RU") -> str:
+    '''
+    Короткая сводка по владельцу из owner_stats (пустая строка, если сводки нет).
+    '''
+    if not stats or not stats.get("links"):
+        return ""
+    return get_text("OWNER_SUMMARY_TEXT", lang).format(
+        links=stats.get("links", 0),
+        revoked=stats.get("revoked", 0),
+        usage=stats.get("usage", 0),
+        approved=stats.get("approved", 0),
+    )
+
+
+def sync_chats_to_str(chats: List[dict], lang: str = "RU") -> str:
+    '''
+    Реестр чатов синхронизации со статусом последнего прохода.
+    '''
+    if not chats:
+        return get_text("SYNC_CHATS_EMPTY", lang)
+    lines = []
+    for c in chats:
+        if not c.get("enabled"):
+            icon = "⏸"
+        elif c.get("errors"):
+            icon = "⚠️"
+        else:
+            icon = "✅"
+        synced = c.get("last_synced_at")
+        lines.append(get_text("SYNC_CHAT_LINE", lang).format(
+            icon=icon,
+            chat_id=c["chat_id"],
+            links=c.get("last_links") if c.get("last_links") is not None else "—",
+            pages=c.get("last_pages") if c.get("last_pages") is not None else "—",
+            duration=f"{(c.get('last_duration_ms') or 0) / 1000:.1f}",
+            synced=dt.datetime.fromtimestamp(synced).strftime("%d.%m %H:%M") if synced else "—",
+            error=f"\n    {escape(c['last_error'])} (×{c['errors']})" if c.get("errors") and c.get("last_error") else "",
+        ))
+    return get_text("SYNC_CHATS_TEXT", lang).format(chats="\n".join(lines))
+
+
+def _limiter_rows(snapshot: dict) -> str:
+    return "\n".join(
+        f"<code>{escape(kind)}</code>: {s['rate']}/с, токенов {s['tokens']}, "
+        f"ок {s['successes']}, flood {s['floods']}, ждали {s['waited_sec']} с"
+        + (f", стоит ещё {s['parked_for']} с" if s["parked_for"] else "")
+        for kind, s in snapshot.items()
+    )
+
+
+def limiter_snapshot_to_str(snapshot: dict, lang: str = "RU") -> str:
+    '''
+    Состояние лимитера юзербота по классам запросов (RateLimiter.snapshot()).
+    '''
+    return get_text("LIMITS_TEXT", lang).format(rows=_limiter_rows(snapshot))
+
+
+def accounts_snapshot_to_str(snapshot: list[dict], lang: str = "RU") -> str:
+    '''
+    Состояние пула аккаунтов (AccountPool.snapshot()): статус и лимитер каждого аккаунта.
+    '''
+    blocks = []
+    for a in snapshot:
+        head = get_text("ACCOUNT_LINE", lang).format(
+            name=escape(a["name"]), user_id=a["user_id"], status=escape(a["status"]), requests=a["requests"],
+        )
+        blocks.append(f"{head}\n{_limiter_rows(a['limiter'])}")
+    return get_text("LIMITS_TEXT", lang).format(rows="\n\n".join(blocks))
+
+
+def link_jobs_snapshot_to_str(snapshot: dict, lang: str = "RU") -> str:
+    '''
+    Состояние очереди заданий на ссылки (LinkJobQueue.snapshot()): задания по операторам.
+    '''
+    def _owners(counts: dict) -> str:
+        return ", ".join(f"<code>{owner}</code> ×{n}" for owner, n in counts.items()) or "—"
+
+    return get_text("JOBS_TEXT", lang).format(
+        workers=snapshot["workers"], per_user=snapshot["per_user"],
+        running=_owners(snapshot["running"]), pending=_owners(snapshot["pending"]),
+    )
+
+
+def progress_to_str(key: str, done: int, total: int | None, eta: float | None, flood: float, lang: str = "RU") -> str:
+    '''
+    Статус долгого задания (services/progress.py): сделано, сколько осталось по времени, текущий FloodWait.
+    '''
+    text = get_text(key, lang).format(done=done, total=total if total is not None else "?")
+    if eta is not None and total is not None and done < total:
+        eta = int(eta)
+        text += get_text("PROGRESS_ETA", lang).format(eta=f"{eta // 60} мин {eta % 60} с" if eta >= 60 else f"{eta} с")
+    if flood >= 1:
+        text += get_text("PROGRESS_FLOOD", lang).format(flood=math.ceil(flood))
+    return text
@@ -5,8 +5,12 @@ import signal
 from telethon import TelegramClient
 from config import settings
 from handlers.bot_handlers import setup_bot_handlers
-from services.db import init_db, close_db
-from services.scheduler import sync_invites_job
+from services.db import init_db, close_db, add_sync_chat
+from services.scheduler import sync_chats_job
+from services.invite_pool import invite_pool_job
+from services.join_tracker import setup_join_tracking
+from services.accounts import AccountPool
+from services.dialog_state import get_dialogs
 import contextlib
 
 
@@ -36,19 +40,26 @@ async def run():
 
     # нужно вызвать init_db()
     await init_db()
-    # Юзербот (аккаунт)
-    user_client = TelegramClient(settings.user_session, settings.api_id, settings.api_hash)
+    # шаги диалогов с ботом, если они хранятся в БД (DIALOG_STATE_PERSIST=1)
+    await get_dialogs().load()
+    # Юзерботы: основной (USER_SESSION) и дополнительные (USER_SESSIONS) — работа делится между ними
+    accounts = AccountPool.from_sessions(settings.user_sessions, settings.api_id, settings.api_hash)
 
     # Обычный бот (Bot API)
     bot_client = TelegramClient(settings.bot_session, settings.api_id, settings.api_hash)
     bot_client.parse_mode = 'html'  # короткая запись
-    setup_bot_handlers(bot_client, user_client)
+    link_jobs = setup_bot_handlers(bot_client, accounts)
+    if settings.realtime_joins:
+        setup_join_tracking(accounts.clients)
 
     # Старт клиентов
-    await user_client.start(phone=settings.user_phone, password=settings.user_pass)  # При первом запуске запросит код/2FA в консоли
+    await accounts.start(phone=settings.user_phone, password=settings.user_pass)  # При первом запуске запросит код/2FA в консоли
     await bot_client.start(bot_token=settings.bot_token)
 
-    log.info("Both clients started: userbot + bot")
+    log.info("Clients started: %d userbot(s) + bot", len(accounts.active()))
+
+    # очередь заданий на ссылки: незаконченные до рестарта задания продолжаются
+    await link_jobs.start()
 
     # Грейсфул-шатдаун
     stop_event = asyncio.Event()
@@ -64,19 +75,31 @@ async def run():
         except NotImplementedError:
             # Windows
             pass
-    # Можно вынести период в settings.sync_interval_sec (секунды)
+    # Можно вынести период в settings.sync_interval_sec (секунды);
+    # при вступлениях из апдейтов полный проход нужен только для сверки
     sync_interval = getattr(settings, "sync_interval_sec", 300)
+    if settings.realtime_joins:
+        sync_interval = max(sync_interval, settings.sync_reconcile_sec)
     include_revoked = getattr(settings, "sync_include_revoked", False)
 
+    # реестр чатов: target_chat_id и SYNC_CHAT_IDS добавляются при старте,
+    # остальные — командой /chats; уже известные чаты (в т.ч. выключенные) не трогаем
+    for chat_id in dict.fromkeys([settings.target_chat_id, *settings.sync_chat_ids]):
+        if await add_sync_chat(chat_id, include_revoked=include_revoked):
+            log.info("Chat %s added to sync registry", chat_id)
+
     scheduler_task = asyncio.create_task(
-        sync_invites_job(
-            user_client=user_client,
-            chat_id=settings.target_chat_id,
+        sync_chats_job(
+            user_client=accounts,
             interval_sec=sync_interval,
             stop_event=stop_event,
-            include_revoked=include_revoked,
+            realtime=settings.realtime_joins,
         ),
-        name="sync_invites_job",
+        name="sync_chats_job",
+    )
+    pool_task = asyncio.create_task(
+        invite_pool_job(accounts, settings.target_chat_id, stop_event=stop_event),
+        name="invite_pool_job",
     )
 
     # Параллельная работа двух клиентов
@@ -90,11 +113,13 @@ async def run():
         await wait_disconnected()
     finally:
         log.info("Disconnecting clients...")
-        scheduler_task.cancel()
-        with contextlib.suppress(asyncio.CancelledError):
-            await scheduler_task
+        await link_jobs.stop()
+        for task in (scheduler_task, pool_task):
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
         await asyncio.gather(
-            user_client.disconnect(),
+            accounts.disconnect(),
             bot_client.disconnect(),
             close_db(),
             return_exceptions=True,
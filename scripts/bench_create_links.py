@@ -0,0 +1,105 @@
+# scripts/bench_create_links.py
+"""
+Бенчмарк: создание пачки ссылок при разном окне параллельных запросов.
+
+Запуск (из корня проекта):
+    python scripts/bench_create_links.py --count 50 --windows 1,2,4,8 --rtt 0.4 --server-rps 8
+
+Вместо Telegram — симулированный клиент: каждый ExportChatInviteRequest отвечает
+через --rtt секунд (± джиттер), а «сервер» держит свой лимит --server-rps и на
+превышение отвечает FloodWaitError. Через общий лимитер (services/rate_limiter.py)
+гоняется create_links_no_title; печатаются время, ссылок/сек, число FloodWait,
+итоговая скорость лимитера и то, что порядок результата совпал с порядком запросов.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("TARGET_CHAT_ID", "-100")
+
+
+class _SimulatedClient:
+    """Ответ через rtt; серверный token bucket на server_rps, сверх него — FloodWait."""
+
+    def __init__(self, rtt: float, server_rps: float, flood_sec: int) -> None:
+        from telethon.errors import FloodWaitError
+
+        self._flood_error = FloodWaitError
+        self.rtt = rtt
+        self.server_rps = server_rps
+        self.flood_sec = flood_sec
+        self._tokens = server_rps
+        self._updated = time.monotonic()
+        self._n = 0
+        self.floods = 0
+
+    async def get_me(self, input_peer: bool = False):
+        return SimpleNamespace(user_id=1, access_hash=0)
+
+    async def get_input_entity(self, peer):
+        return peer
+
+    async def __call__(self, request):
+        # запрос «доходит» до сервера через половину RTT
+        await asyncio.sleep(self.rtt / 2 * random.uniform(0.8, 1.2))
+        now = time.monotonic()
+        self._tokens = min(self.server_rps, self._tokens + (now - self._updated) * self.server_rps)
+        self._updated = now
+        if self._tokens < 1:
+            self.floods += 1
+            raise self._flood_error(request=request, capture=self.flood_sec)
+        self._tokens -= 1
+        self._n += 1
+        await asyncio.sleep(self.rtt / 2 * random.uniform(0.8, 1.2))
+        return SimpleNamespace(
+            link=f"https://t.me/+sim{self._n:06d}",
+            title=request.title,
+            date=dt.datetime.now(dt.timezone.utc),
+        )
+
+
+async def _run(count: int, window: int, args: argparse.Namespace) -> None:
+    from services import rate_limiter, user_service
+
+    # у каждого прогона свой лимитер: AIMD-подстройка не переносится между окнами
+    rate_limiter._limiter = rate_limiter.RateLimiter({"create": args.limiter_rps})
+    client = _SimulatedClient(args.rtt, args.server_rps, args.flood_sec)
+
+    t0 = time.perf_counter()
+    links = await user_service.create_links_no_title(client, -100, count, window=window)
+    elapsed = time.perf_counter() - t0
+
+    ordered = [inv.title.rsplit("-", 1)[-1] for inv in links] == [str(i) for i in range(1, count + 1)]
+    state = rate_limiter.get_limiter().snapshot()["create"]
+    print(
+        f"window={window:<3} {elapsed:7.2f} s  {count / elapsed:6.2f} ссылок/с  "
+        f"flood={client.floods:<3} rate={state['rate']:<6} порядок={'ok' if ordered else 'НАРУШЕН'}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--windows", default="1,2,4,8")
+    parser.add_argument("--rtt", type=float, default=0.4, help="время ответа сервера, сек")
+    parser.add_argument("--server-rps", type=float, default=8.0, help="реальный лимит «сервера», запросов/сек")
+    parser.add_argument("--flood-sec", type=int, default=1, help="сколько сервер просит ждать при FloodWait")
+    parser.add_argument("--limiter-rps", type=float, default=5.0, help="стартовая скорость лимитера для create")
+    args = parser.parse_args()
+
+    random.seed(1)
+    for window in (int(w) for w in args.windows.split(",") if w):
+        asyncio.run(_run(args.count, window, args))
+
+
+if __name__ == "__main__":
+    main()
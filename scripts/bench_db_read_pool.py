@@ -0,0 +1,125 @@
+# scripts/bench_db_read_pool.py
+"""
+Бенчмарк: задержка чтения, пока идёт большой sync-апсерт.
+
+Запуск (из корня проекта):
+    python scripts/bench_db_read_pool.py --rows 100000 --pool 4
+
+Создаёт временную базу, заливает в неё --rows ссылок и параллельно
+с повторной заливкой (как делает sync_invites_job) меряет время
+get_link / get_invites_by_owner / upsert_user_basic.
+
+Меряются пул читателей и писатель, а не кэши поверх них: кэш get_invites_by_owner
+выключен (DB_OWNER_CACHE_SIZE=0), отложенная запись upsert_user_basic сбрасывается
+в базу (flush_writes) внутри замера.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def _fake_invites(n: int, usage_shift: int = 0) -> list[SimpleNamespace]:
+    base = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    return [
+        SimpleNamespace(
+            link=f"https://t.me/+bench{i:08d}",
+            title=f"Link {i}",
+            date=base + dt.timedelta(seconds=i),
+            expire_date=None,
+            usage_limit=None,
+            request_needed=False,
+            revoked=False,
+            usage=i % 50 + usage_shift,
+            approved_request_count=0,
+        )
+        for i in range(n)
+    ]
+
+
+def _report(name: str, samples: list[float]) -> None:
+    if not samples:
+        print(f"{name:<24} нет замеров")
+        return
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    print(
+        f"{name:<24} n={len(samples):<5} "
+        f"p50={statistics.median(samples) * 1000:8.2f} ms  "
+        f"p95={p95 * 1000:8.2f} ms  "
+        f"max={samples[-1] * 1000:8.2f} ms"
+    )
+
+
+async def _bench(rows: int, owners: int) -> None:
+    from services import db
+
+    await db.init_db()
+    invites = _fake_invites(rows)
+    for o in range(owners):
+        chunk = invites[o::owners]
+        await db.insert_many_from_exported(chunk, -100, owner_tg_id=o + 1)
+
+    timings: dict[str, list[float]] = {"get_link": [], "get_invites_by_owner": [], "upsert_user_basic": []}
+    done = asyncio.Event()
+
+    async def _upsert_user(i: int) -> None:
+        await db.upsert_user_basic(SimpleNamespace(id=10_000 + i, username=f"u{i}", first_name="Bench"))
+        await db.flush_writes()
+
+    async def _probe(name: str, call) -> None:
+        i = 0
+        while not done.is_set():
+            t0 = time.perf_counter()
+            await call(i)
+            timings[name].append(time.perf_counter() - t0)
+            i += 1
+            await asyncio.sleep(0.005)
+
+    probes = [
+        asyncio.create_task(_probe("get_link", lambda i: db.get_link(invites[i % rows].link))),
+        asyncio.create_task(_probe("get_invites_by_owner", lambda i: db.get_invites_by_owner(i % owners + 1))),
+        asyncio.create_task(_probe("upsert_user_basic", _upsert_user)),
+    ]
+
+    t0 = time.perf_counter()
+    await db.insert_many_from_exported(_fake_invites(rows, usage_shift=1), -100, owner_tg_id=None)
+    sync_sec = time.perf_counter() - t0
+    done.set()
+    await asyncio.gather(*probes)
+
+    print(f"sync-апсерт {rows} строк: {sync_sec:.2f} s (пул читателей: {db.settings.db_read_pool_size})")
+    for name, samples in timings.items():
+        _report(name, samples)
+
+    await db.close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--owners", type=int, default=20)
+    parser.add_argument("--pool", type=int, default=4)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_db_")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.sqlite")
+    os.environ["DB_READ_POOL_SIZE"] = str(args.pool)
+    os.environ["DB_OWNER_CACHE_SIZE"] = "0"
+    os.environ.setdefault("TARGET_CHAT_ID", "-100")
+
+    asyncio.run(_bench(args.rows, args.owners))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# scripts/check_query_plans.py
+"""
+Регрессия планов запросов services/db.py.
+
+Строит синтетическую базу (по умолчанию 1M ссылок), вызывает публичные функции
+services.db, перехватывает каждый выполненный SQL (trace callback на всех соединениях)
+и прогоняет его через EXPLAIN QUERY PLAN. Падает (exit 1), если где-то есть
+полный проход по таблице без индекса или сортировка всей выборки во временном B-tree —
+кроме функций, которым это положено по смыслу (FULL_SCAN_ALLOWED).
+
+    python scripts/check_query_plans.py               # 1M строк
+    python scripts/check_query_plans.py --rows 50000  # быстро
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# функции, которым полный проход разрешён:
+# сверка/пересборка сводки читают всё по смыслу, list_users идёт по rowid с LIMIT/OFFSET,
+# реестр чатов и очередь заданий — десятки строк
+FULL_SCAN_ALLOWED = {
+    "check_owner_stats", "rebuild_owner_stats", "list_users", "list_sync_chats", "list_link_jobs", "init_db",
+}
+
+# проход по таблице без индекса (SCAN t USING INDEX ... — упорядоченный проход по индексу, он допустим;
+# SCAN CONSTANT ROW — INSERT ... SELECT без FROM)
+_TABLE_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)(\w+)\b(?! USING)")
+# сортировка всей выборки; сортировку уже сгруппированного результата не считаем
+_TEMP_SORT = "USE TEMP B-TREE FOR ORDER BY"
+# "-- ..." — вложенные запросы PRAGMA optimize (ANALYZE новой таблицы и т.п.), как их отдаёт trace
+_SKIP_SQL = re.compile(r"^\s*(PRAGMA|BEGIN|COMMIT|ROLLBACK|CREATE|DROP|ANALYZE|--)", re.I)
+
+
+def _build(path: str, rows: int, owners: int, chats: int) -> None:
+    """Залить синтетику напрямую через sqlite3 (быстрее, чем через апсерты)."""
+    conn = sqlite3.connect(path)
+    rnd = random.Random(42)
+    now = int(time.time())
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (tg_id, username, first_name) VALUES (?, ?, ?)",
+        [(o, f"user{o}", "Synthetic") for o in range(1, owners + 1)],
+    )
+
+    def _invites():
+        for i in range(rows):
+            owner = rnd.randint(1, owners) if rnd.random() < 0.7 else None
+            yield (
+                f"https://t.me/+plan{i:08d}", str(-1000 - i % chats), owner, f"Link {i}",
+                now - rows + i, None, None, 0, rnd.randint(0, 500), 0, int(rnd.random() < 0.05), now,
+            )
+
+    conn.executemany(
+        """
+        INSERT INTO invites (
+          link, chat_id, owner_tg_id, title, date_created, expire_date,
+          usage_limit, request_needed, usage, approved_request_count, revoked, last_synced_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        _invites(),
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO invite_stats_history (link, ts, granularity, d_usage, d_approved) VALUES (?, ?, ?, ?, 0)",
+        (
+            (f"https://t.me/+plan{rnd.randrange(rows):08d}", now - rnd.randrange(90 * 86400), g, rnd.randint(1, 5))
+            for g in (0, 3600, 86400)
+            for _ in range(max(1, rows // 10))
+        ),
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+async def _exercise(db, rows: int) -> list[tuple[str, str]]:
+    """Вызвать все публичные функции db, вернуть [(функция, выполненный SQL)]."""
+    captured: list[tuple[str, str]] = []
+    current = {"fn": "init_db"}
+
+    def _trace(sql: str) -> None:
+        captured.append((current["fn"], sql))
+
+    writer = await db.connect()
+    await writer.set_trace_callback(_trace)
+    await db._init_readers()
+    for reader in db._readers_all:
+        await reader.set_trace_callback(_trace)
+
+    link = f"https://t.me/+plan{rows // 2:08d}"
+    exported = SimpleNamespace(
+        link=link, title="x", date=None, expire_date=None, usage_limit=None,
+        request_needed=False, revoked=False, usage=999, approved_request_count=1,
+    )
+    user = SimpleNamespace(id=7, username="u7", first_name="Seven")
+    since = int(time.time()) - 7 * 86400
+
+    async def _first_page(agen):
+        async for _ in agen:
+            break
+        await agen.aclose()
+
+    async def _two_pages(agen):
+        n = 0
+        async for _ in agen:
+            n += 1
+            if n == 2:
+                break
+        await agen.aclose()
+
+    calls = [
+        ("get_invites_by_owner", lambda: db.get_invites_by_owner(3)),
+        ("iter_invites_by_owner", lambda: _two_pages(db.iter_invites_by_owner(3, chunk_size=50))),
+        ("iter_invites_by_owner_null", lambda: _two_pages(db.iter_invites_by_owner(None, chunk_size=50))),
+        ("iter_all_invites", lambda: _two_pages(db.iter_all_invites(chunk_size=500))),
+        ("iter_all_invites_grouped", lambda: _first_page(db.iter_all_invites(chunk_size=500, group_by_owner=True))),
+        ("get_link", lambda: db.get_link(link)),
+        ("get_user", lambda: db.get_user(7)),
+        ("list_users", lambda: db.list_users(limit=100)),
+        ("get_invite_fingerprints", lambda: db.get_invite_fingerprints(-1001)),
+        ("save_sync_delta", lambda: db.save_sync_delta([exported], -1000)),
+        ("save_sync_delta_page", lambda: db.save_sync_delta([exported], -1000, chat_synced=False, cursor=(False, 1, link, 7))),
+        ("get_sync_cursor", lambda: db.get_sync_cursor(-1000)),
+        ("start_link_batch", lambda: db.start_link_batch("plan", 7, -1000, ["a", "b"])),
+        ("add_link_batch_item", lambda: db.add_link_batch_item("plan", 0, exported, -1000, 7)),
+        ("get_link_batch", lambda: db.get_link_batch("plan")),
+        ("finish_link_batch", lambda: db.finish_link_batch("plan")),
+        ("add_link_job", lambda: db.add_link_job(7, -1000, "no_title", {"n": 3}, "plan", 11)),
+        ("start_link_job", lambda: db.start_link_job(1)),
+        ("list_link_jobs", lambda: db.list_link_jobs()),
+        ("save_dialog_state", lambda: db.save_dialog_state(7, {"mode": "mask", "step": "ask_mask"}, 1_700_000_000)),
+        ("load_dialog_states", lambda: db.load_dialog_states(1_700_000_000)),
+        ("purge_dialog_states", lambda: db.purge_dialog_states(1_700_000_000)),
+        ("delete_dialog_state", lambda: db.delete_dialog_state(7)),
+        ("finish_link_job", lambda: db.finish_link_job(1)),
+        ("insert_many_from_exported", lambda: db.insert_many_from_exported([exported], -1000, 7)),
+        ("update_invite_counters", lambda: db.update_invite_counters(link, 1000, 2, False)),
+        ("upsert_user_basic", lambda: db.upsert_user_basic(user)),
+        ("add_invite_joins", lambda: db.add_invite_joins(link, d_usage=1)),
+        ("flush_writes", lambda: db.flush_writes()),
+        ("get_link_growth", lambda: db.get_link_growth(link, since)),
+        ("get_link_growth_series", lambda: db.get_link_growth_series(link, since)),
+        ("get_owner_growth", lambda: db.get_owner_growth(3, since)),
+        ("get_top_growing_links", lambda: db.get_top_growing_links(-1000, since)),
+        ("add_sync_chat", lambda: db.add_sync_chat(-1000)),
+        ("set_sync_chat_enabled", lambda: db.set_sync_chat_enabled(-1000, True)),
+        ("record_sync_run", lambda: db.record_sync_run(-1000, duration_ms=1, pages=1, links=1, changed=1)),
+        ("list_sync_chats", lambda: db.list_sync_chats(enabled_only=True)),
+        ("delete_sync_chat", lambda: db.delete_sync_chat(-1000)),
+        ("add_pool_invites", lambda: db.add_pool_invites([exported], -1000)),
+        ("count_pool_invites", lambda: db.count_pool_invites(-1000)),
+        ("claim_pool_invites", lambda: db.claim_pool_invites(-1000, 5)),
+        ("get_owner_stats", lambda: db.get_owner_stats(3)),
+        ("compact_stats_history", lambda: db.compact_stats_history()),
+        ("check_owner_stats", lambda: db.check_owner_stats()),
+        ("rebuild_owner_stats", lambda: db.rebuild_owner_stats()),
+        ("delete_invite", lambda: db.delete_invite(link)),
+        ("delete_user", lambda: db.delete_user(7)),
+    ]
+    for name, call in calls:
+        current["fn"] = name
+        await call()
+    # отложенные записи, дошедшие до базы уже после вызовов
+    current["fn"] = "flush_writes"
+    await db.flush_writes()
+    return captured
+
+
+def _check(path: str, captured: list[tuple[str, str]]) -> list[str]:
+    conn = sqlite3.connect(path)
+    problems: list[str] = []
+    seen: set[tuple[str, str]] = set()
+    for fn, sql in captured:
+        if _SKIP_SQL.match(sql) or (fn, sql) in seen:
+            continue
+        seen.add((fn, sql))
+        try:
+            plan = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+        except sqlite3.Error as e:
+            problems.append(f"{fn}: не удалось получить план ({e}): {sql.strip()[:120]}")
+            continue
+        details = [row[3] for row in plan]
+        flat = " ".join(sql.split())
+        grouped = "GROUP BY" in flat.upper()
+        bad = [d for d in details if _TABLE_SCAN.search(d) or (d == _TEMP_SORT and not grouped)]
+        print(f"[{fn}] {flat[:100]}")
+        for d in details:
+            print(f"    {'!!' if d in bad else '  '} {d}")
+        if bad and fn not in FULL_SCAN_ALLOWED:
+            problems.append(f"{fn}: {'; '.join(bad)} :: {flat[:160]}")
+    conn.close()
+    return problems
+
+
+async def _run(path: str, rows: int) -> int:
+    from services import db
+
+    await db.init_db()
+    await db.close_db()
+
+    t0 = time.perf_counter()
+    _build(path, rows, owners=max(10, rows // 500), chats=5)
+    print(f"синтетика: {rows} ссылок за {time.perf_counter() - t0:.1f} s")
+
+    await db.init_db()
+    try:
+        captured = await _exercise(db, rows)
+    finally:
+        await db.close_db()
+
+    problems = _check(path, captured)
+    if problems:
+        print(f"\nFAIL: {len(problems)} запросов с полным проходом / сортировкой всей выборки:")
+        for p in problems:
+            print(f"  - {p}")
+        return 1
+    print(f"\nOK: {len({s for _, s in captured})} запросов, полных проходов нет")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--db-path", default=None, help="куда класть синтетическую базу (по умолчанию временная папка)")
+    args = parser.parse_args()
+
+    path = args.db_path or os.path.join(tempfile.mkdtemp(prefix="plans_db_"), "plans.sqlite")
+    os.environ["DB_PATH"] = path
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ.setdefault("TARGET_CHAT_ID", "-100")
+    sys.exit(asyncio.run(_run(path, args.rows)))
+
+
+if __name__ == "__main__":
+    main()
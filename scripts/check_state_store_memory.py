@@ -0,0 +1,139 @@
+# scripts/check_state_store_memory.py
+"""
+Проверка хранилища шагов диалогов (services/dialog_state.py) на --users операторах.
+
+    python scripts/check_state_store_memory.py                     # 100k операторов, только память
+    python scripts/check_state_store_memory.py --persist           # плюс запись/подъём из SQLite
+
+Заводит каждому оператору шаг диалога и меряет через tracemalloc, сколько памяти
+заняло хранилище. Для сравнения меряется прежний вариант: словарь с объектом
+Telethon Message на каждого. Потом часы сдвигаются на TTL, и проверяется, что
+брошенные диалоги вытеснены. С --persist шаги пишутся в базу во временном файле
+и поднимаются оттуда новым хранилищем, как после рестарта. Код выхода 1 — если
+превышен бюджет --max-bytes или что-то не сошлось.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = time.time()
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _measure(build) -> tuple[object, int]:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return obj, size
+
+
+async def _run(args: argparse.Namespace) -> int:
+    from telethon.tl import types
+
+    from services import db
+    from services.dialog_state import Dialog, DialogStore
+
+    users = range(1_000_000, 1_000_000 + args.users)
+    modes = [("no_title", "ask_count"), ("titles", "ask_list"), ("mask", "ask_count"), ("stat", "ask_links")]
+    failed = False
+
+    # прежний STATE: dict на оператора с целым Message
+    def _legacy() -> dict:
+        date = dt.datetime.now(dt.timezone.utc)
+        return {
+            uid: {"mode": "mask", "step": "ask_count", "mask": f"promo {uid % 100} {{n}}",
+                  "prompt_msg": types.Message(id=uid % 100_000, peer_id=types.PeerUser(uid), date=date,
+                                              message="Укажите количество (1-50):", out=True)}
+            for uid in users
+        }
+
+    _, legacy_size = _measure(_legacy)
+
+    clock = _Clock()
+    store = DialogStore(ttl=args.ttl, persist=False, clock=clock)
+
+    async def _fill(s: DialogStore) -> None:
+        for uid in users:
+            mode, step = modes[uid % len(modes)]
+            mask = f"promo {uid % 100} {{n}}" if mode == "mask" else None
+            await s.set(uid, Dialog(mode, step, prompt_id=uid % 100_000, mask=mask))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await _fill(store)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    per_user = size / args.users
+    print(f"операторов:        {args.users}")
+    print(f"прежний STATE:     {legacy_size / 2**20:7.1f} МиБ ({legacy_size / args.users:6.0f} Б на оператора)")
+    print(f"DialogStore:       {size / 2**20:7.1f} МиБ ({per_user:6.0f} Б на оператора)")
+    if per_user > args.max_bytes:
+        print(f"FAIL: больше бюджета {args.max_bytes} Б на оператора")
+        failed = True
+
+    # брошенные диалоги вытесняются по TTL
+    last = users[-1]
+    clock.now += args.ttl + 1
+    await store.set(last, Dialog("no_title", "ask_count"))
+    if len(store) != 1 or store.get(users[0]) is not None:
+        print(f"FAIL: после TTL в хранилище осталось {len(store)}")
+        failed = True
+    else:
+        print("TTL:               брошенные диалоги вытеснены")
+
+    if args.persist:
+        await db.init_db()
+        try:
+            clock = _Clock()
+            persisted = DialogStore(ttl=args.ttl, persist=True, clock=clock)
+            t0 = time.perf_counter()
+            await _fill(persisted)
+            took = time.perf_counter() - t0
+            restored = DialogStore(ttl=args.ttl, persist=True, clock=clock)
+            await restored.load()
+            sample = users[len(users) // 2]
+            ok = len(restored) == args.users and restored.get(sample) == persisted.get(sample)
+            print(f"SQLite:            запись {args.users / took:7.0f} шагов/с, после рестарта "
+                  f"{len(restored)} {'ок' if ok else 'НЕ СОШЛОСЬ'}")
+            failed = failed or not ok
+        finally:
+            await db.close_db()
+
+    print("FAIL" if failed else "OK")
+    return 1 if failed else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--ttl", type=int, default=1800, help="TTL шага диалога, сек")
+    parser.add_argument("--max-bytes", type=int, default=400, help="бюджет памяти на оператора, байт")
+    parser.add_argument("--persist", action="store_true", help="проверить и запись в SQLite с подъёмом")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TARGET_CHAT_ID", "-100")
+    # settings читается при импорте: база задаётся до него
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="state_db_"), "state.sqlite")
+    sys.exit(asyncio.run(_run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# services/accounts.py
+"""
+Пул аккаунтов-юзерботов: создание ссылок и синк упираются в лимиты одного
+аккаунта, поэтому работу можно делить между несколькими сессиями
+(settings.user_sessions; каждый аккаунт — админ целевых чатов).
+
+У каждого аккаунта свой ограничитель (services/rate_limiter.py) со своим
+состоянием FloodWait. Запрос, не привязанный к конкретному админу (создание
+ссылки, чтение ссылки по адресу), уходит аккаунту, который обслужит его раньше
+всех (RateLimiter.eta). Если аккаунт словил FloodWait, следующая попытка
+уходит другому, а не ждёт. Запросы, привязанные к своему админу (список его
+ссылок, переименование его ссылки), идут через pool.only(account).
+
+Сессия, которую Telegram больше не принимает (UnauthorizedError,
+AuthKeyError), выводится из ротации насовсем. После settings.account_max_errors
+сетевых сбоев подряд аккаунт отдыхает settings.account_retry_sec. Бот при этом
+не перезапускается.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from telethon import TelegramClient
+from telethon.errors import AuthKeyError, UnauthorizedError
+
+from config import settings
+from services.rate_limiter import RateLimiter, get_limiter
+
+log = logging.getLogger("app")
+
+# сессия мертва: повторять на этом аккаунте бессмысленно
+SESSION_ERRORS = (UnauthorizedError, AuthKeyError)
+# сеть / соединение аккаунта: временно
+CONNECTION_ERRORS = (ConnectionError, OSError)
+
+
+class NoAccountsError(RuntimeError):
+    """В ротации не осталось ни одного рабочего аккаунта."""
+
+
+@dataclass(eq=False)
+class Account:
+    name: str
+    client: TelegramClient
+    limiter: RateLimiter
+    user_id: Optional[int] = None
+    disabled: Optional[str] = None                   # причина вывода из ротации насовсем
+    resting_until: float = 0.0
+    errors: int = 0                                  # сбоев подряд
+    requests: int = 0
+
+    def available(self, now: Optional[float] = None) -> bool:
+        return self.disabled is None and (now or time.monotonic()) >= self.resting_until
+
+
+class AccountPool:
+    """Аккаунты в порядке settings.user_sessions; первый — основной."""
+
+    def __init__(self, accounts: Iterable[Account]) -> None:
+        self.accounts: list[Account] = list(accounts)
+        if not self.accounts:
+            raise NoAccountsError("пул аккаунтов пуст")
+
+    @classmethod
+    def from_sessions(cls, sessions: Iterable[str], api_id: int, api_hash: str) -> "AccountPool":
+        accounts = []
+        for i, session in enumerate(sessions):
+            # основной аккаунт делит ограничитель с кодом, который зовёт get_limiter() напрямую
+            limiter = get_limiter() if i == 0 else RateLimiter(settings.userbot_rates)
+            accounts.append(Account(name=session, client=TelegramClient(session, api_id, api_hash), limiter=limiter))
+        return cls(accounts)
+
+    @property
+    def primary(self) -> Account:
+        return self.accounts[0]
+
+    @property
+    def clients(self) -> list[TelegramClient]:
+        return [a.client for a in self.accounts]
+
+    def active(self) -> list[Account]:
+        now = time.monotonic()
+        return [a for a in self.accounts if a.available(now)]
+
+    def by_user_id(self, user_id: Optional[int]) -> Optional[Account]:
+        return next((a for a in self.accounts if user_id is not None and a.user_id == user_id), None)
+
+    def only(self, account: Account) -> "AccountPool":
+        """Пул из одного аккаунта (с общим с этим пулом состоянием) — для запросов от его имени."""
+        return AccountPool([account])
+
+    def pick(self, kind: str = "other") -> Account:
+        """Аккаунт, который обслужит запрос класса kind раньше остальных."""
+        active = self.active()
+        if not active:
+            # все отдыхают — берём того, кто вернётся первым; мёртвые сессии не берём никогда
+            alive = [a for a in self.accounts if a.disabled is None]
+            if not alive:
+                raise NoAccountsError("все сессии пула выведены из ротации")
+            return min(alive, key=lambda a: a.resting_until)
+        return min(active, key=lambda a: (a.limiter.eta(kind), a.requests))
+
+    def parked_for(self, kind: str = "other") -> float:
+        """Сколько ещё ждать FloodWait запросу класса kind: стоянка аккаунта, который освободится первым."""
+        alive = [a for a in self.accounts if a.disabled is None]
+        return min((a.limiter.parked_for(kind) for a in alive), default=0.0)
+
+    def report_ok(self, account: Account) -> None:
+        account.errors = 0
+        account.requests += 1
+
+    def report_error(self, account: Account, error: BaseException) -> bool:
+        """
+        Учесть сбой аккаунта. True — стоит повторить запрос (на другом аккаунте
+        или на этом после отдыха), False — пробросить ошибку.
+        """
+        if isinstance(error, SESSION_ERRORS):
+            if account.disabled is None:    # запросы в полёте словят ту же ошибку — выводим один раз
+                account.disabled = f"{type(error).__name__}: {error}"[:200]
+                log.error(f"[accounts] {account.name}: сессия выведена из ротации — {account.disabled}")
+        elif isinstance(error, CONNECTION_ERRORS):
+            account.errors += 1
+            if account.errors < settings.account_max_errors:
+                return True
+            account.errors = 0
+            account.resting_until = time.monotonic() + settings.account_retry_sec
+            log.warning(f"[accounts] {account.name}: {error!r} — отдыхает {settings.account_retry_sec} сек")
+        else:
+            return False
+        return any(a.disabled is None for a in self.accounts)
+
+    async def start(self, phone: str = "", password: Optional[str] = None) -> None:
+        """
+        Подключить все сессии. Основная при первом запуске спросит код/2FA в консоли;
+        дополнительные должны быть уже авторизованы, иначе выводятся из ротации.
+        """
+        for i, account in enumerate(self.accounts):
+            try:
+                if i == 0:
+                    await account.client.start(phone=phone, password=password)
+                else:
+                    await account.client.connect()
+                    if not await account.client.is_user_authorized():
+                        account.disabled = "сессия не авторизована"
+                        log.error(f"[accounts] {account.name}: сессия не авторизована — пропускаем")
+                        continue
+                me = await account.client.get_me()
+                account.user_id = me.id
+            except Exception as e:
+                if i == 0:
+                    raise
+                account.disabled = f"{type(e).__name__}: {e}"[:200]
+                log.error(f"[accounts] {account.name}: не удалось подключить — {account.disabled}")
+                continue
+            log.info(f"[accounts] {account.name}: подключён как {account.user_id}")
+
+    async def disconnect(self) -> None:
+        for account in self.accounts:
+            try:
+                await account.client.disconnect()
+            except Exception:
+                pass
+
+    def snapshot(self) -> list[dict]:
+        """Состояние аккаунтов: name, user_id, status, requests, limiter (snapshot ограничителя)."""
+        now = time.monotonic()
+        out = []
+        for a in self.accounts:
+            if a.disabled is not None:
+                status = f"off: {a.disabled}"
+            elif now < a.resting_until:
+                status = f"rest {int(a.resting_until - now)}s"
+            else:
+                status = "ok"
+            out.append({
+                "name": a.name, "user_id": a.user_id, "status": status,
+                "requests": a.requests, "limiter": a.limiter.snapshot(),
+            })
+        return out
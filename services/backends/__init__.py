@@ -0,0 +1,26 @@
+# services/backends/__init__.py
+"""
+Хранилища для services.db.
+
+По умолчанию services.db работает со своим SQLite (функции модуля и есть реализация).
+Альтернативный бэкенд включается через DB_BACKEND, и тогда публичные функции
+services.db переадресуют вызовы в него. Тот же SQLite за интерфейсом StorageBackend —
+services/backends/sqlite.py (для кода, который перебирает бэкенды, например проверок).
+"""
+from services.backends.base import StorageBackend
+
+__all__ = ["StorageBackend", "create_backend"]
+
+
+def create_backend(name: str) -> StorageBackend | None:
+    """
+    Бэкенд по имени из settings.db_backend.
+    None — встроенный SQLite (services.db).
+    """
+    name = (name or "sqlite").strip().lower()
+    if name == "sqlite":
+        return None
+    if name in ("postgres", "postgresql", "pg"):
+        from services.backends.postgres import PostgresBackend
+        return PostgresBackend()
+    raise RuntimeError(f"Unknown DB_BACKEND: {name}")
@@ -0,0 +1,226 @@
+# services/backends/base.py
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Iterable, Optional
+
+from telethon.tl import types
+from telethon.tl.types import User
+
+
+class StorageBackend(ABC):
+    """
+    Интерфейс хранилища: ровно те же вызовы (имена, аргументы, формат результата),
+    что и публичные async-функции services.db.
+    Строки ссылок — dict с ключами как у get_invites_by_owner.
+    """
+
+    # ---- жизненный цикл ----
+
+    @abstractmethod
+    async def init(self) -> None: ...
+
+    @abstractmethod
+    async def close(self) -> None: ...
+
+    async def flush_writes(self) -> None:
+        """Бэкенды без отложенной записи ничего не делают."""
+        return None
+
+    # ---- ссылки: запись ----
+
+    @abstractmethod
+    async def insert_invite_from_exported(
+        self, exported: types.ChatInviteExported, chat_id: int | str, owner_tg_id: int
+    ) -> None: ...
+
+    @abstractmethod
+    async def insert_many_from_exported(
+        self, exported_list: Iterable[types.ChatInviteExported], chat_id: int | str, owner_tg_id: int
+    ) -> None: ...
+
+    @abstractmethod
+    async def update_invite_counters(
+        self, link: str, usage: int, approved_request_count: int, revoked: bool
+    ) -> None: ...
+
+    @abstractmethod
+    async def add_invite_joins(self, link: str, d_usage: int = 0, d_approved: int = 0) -> None: ...
+
+    @abstractmethod
+    async def delete_invite(self, link: str) -> None: ...
+
+    # ---- дельта-синк и история ----
+
+    @abstractmethod
+    async def get_invite_fingerprints(self, chat_id: int | str) -> dict[str, tuple]: ...
+
+    @abstractmethod
+    async def save_sync_delta(
+        self,
+        changed: Iterable[types.ChatInviteExported],
+        chat_id: int | str,
+        owner_tg_id: int | None = None,
+        chat_synced: bool = True,
+        cursor: Optional[tuple[bool, Optional[int], Optional[str], Optional[int]]] = None,
+        owners: Optional[dict[str, int]] = None,
+    ) -> int: ...
+
+    @abstractmethod
+    async def get_sync_cursor(self, chat_id: int | str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def compact_stats_history(self, now: Optional[int] = None) -> dict: ...
+
+    @abstractmethod
+    async def get_link_growth(self, link: str, since: int, until: Optional[int] = None) -> dict: ...
+
+    @abstractmethod
+    async def get_link_growth_series(
+        self, link: str, since: int, until: Optional[int] = None, bucket_sec: int = 3600
+    ) -> list[dict]: ...
+
+    @abstractmethod
+    async def get_owner_growth(self, owner_tg_id: int, since: int, until: Optional[int] = None) -> list[dict]: ...
+
+    @abstractmethod
+    async def get_top_growing_links(self, chat_id: int | str, since: int, limit: int = 50) -> list[dict]: ...
+
+    # ---- реестр чатов синхронизации ----
+
+    @abstractmethod
+    async def add_sync_chat(
+        self, chat_id: int | str, title: Optional[str] = None, include_revoked: bool = False
+    ) -> bool: ...
+
+    @abstractmethod
+    async def set_sync_chat_enabled(self, chat_id: int | str, enabled: bool) -> bool: ...
+
+    @abstractmethod
+    async def delete_sync_chat(self, chat_id: int | str) -> bool: ...
+
+    @abstractmethod
+    async def list_sync_chats(self, enabled_only: bool = False) -> list[dict]: ...
+
+    @abstractmethod
+    async def record_sync_run(
+        self,
+        chat_id: int | str,
+        *,
+        duration_ms: int,
+        pages: int,
+        links: int,
+        changed: int,
+        error: Optional[str] = None,
+    ) -> None: ...
+
+    # ---- запас ссылок ----
+
+    @abstractmethod
+    async def add_pool_invites(self, exported_list: Iterable[types.ChatInviteExported], chat_id: int | str) -> int: ...
+
+    @abstractmethod
+    async def claim_pool_invites(self, chat_id: int | str, limit: int) -> list[dict]: ...
+
+    @abstractmethod
+    async def count_pool_invites(self, chat_id: int | str) -> int: ...
+
+    # ---- пачки ссылок ----
+
+    @abstractmethod
+    async def start_link_batch(
+        self, batch_key: str, owner_tg_id: int, chat_id: int | str, titles: list[Optional[str]]
+    ) -> None: ...
+
+    @abstractmethod
+    async def add_link_batch_item(
+        self, batch_key: str, idx: int, exported: types.ChatInviteExported, chat_id: int | str, owner_tg_id: int
+    ) -> None: ...
+
+    @abstractmethod
+    async def get_link_batch(self, batch_key: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def finish_link_batch(self, batch_key: str) -> None: ...
+
+    # ---- очередь заданий ----
+
+    @abstractmethod
+    async def add_link_job(
+        self,
+        owner_tg_id: int,
+        chat_id: int | str,
+        kind: str,
+        params: dict,
+        batch_key: str,
+        message_id: Optional[int] = None,
+    ) -> int: ...
+
+    @abstractmethod
+    async def start_link_job(self, job_id: int) -> None: ...
+
+    @abstractmethod
+    async def finish_link_job(self, job_id: int) -> None: ...
+
+    @abstractmethod
+    async def list_link_jobs(self) -> list[dict]: ...
+
+    # ---- шаги диалогов ----
+
+    @abstractmethod
+    async def save_dialog_state(self, user_id: int, data: dict, expires_at: int) -> None: ...
+
+    @abstractmethod
+    async def delete_dialog_state(self, user_id: int) -> None: ...
+
+    @abstractmethod
+    async def load_dialog_states(self, now: int) -> list[dict]: ...
+
+    @abstractmethod
+    async def purge_dialog_states(self, now: int) -> int: ...
+
+    # ---- сводка по владельцу ----
+
+    @abstractmethod
+    async def get_owner_stats(self, owner_tg_id: int) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def check_owner_stats(self) -> list[dict]: ...
+
+    @abstractmethod
+    async def rebuild_owner_stats(self) -> int: ...
+
+    # ---- ссылки: чтение ----
+
+    @abstractmethod
+    async def get_invites_by_owner(self, owner_tg_id: int) -> list[dict]: ...
+
+    @abstractmethod
+    async def get_all_invites(self) -> list[dict]: ...
+
+    @abstractmethod
+    def iter_invites_by_owner(
+        self, owner_tg_id: int | None, chunk_size: int = 500
+    ) -> AsyncIterator[list[dict]]: ...
+
+    @abstractmethod
+    def iter_all_invites(
+        self, chunk_size: int = 500, *, group_by_owner: bool = False
+    ) -> AsyncIterator[list[dict]]: ...
+
+    @abstractmethod
+    async def get_link(self, link: str) -> Optional[dict]: ...
+
+    # ---- пользователи ----
+
+    @abstractmethod
+    async def upsert_user_basic(self, user: User) -> None: ...
+
+    @abstractmethod
+    async def get_user(self, tg_id: int) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def list_users(self, limit: int = 100, offset: int = 0) -> list[dict]: ...
+
+    @abstractmethod
+    async def delete_user(self, tg_id: int) -> None: ...
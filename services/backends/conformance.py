@@ -0,0 +1,367 @@
+# services/backends/conformance.py
+"""
+Общий набор проверок поведения хранилища.
+
+Гоняется через интерфейс StorageBackend, поэтому один и тот же набор проверяет
+и встроенный SQLite (SqliteBackend), и Postgres (PostgresBackend).
+Работает и на непустой базе: все данные заводятся под случайными chat_id / tg_id
+и в конце удаляются (кроме строк истории).
+
+Запуск: python scripts/check_backend_conformance.py --help
+"""
+from __future__ import annotations
+
+import datetime as dt
+import itertools
+import random
+import re
+import time
+from types import SimpleNamespace
+from typing import Callable
+
+from config import settings
+from services import db
+from services.backends.base import StorageBackend
+from services.backends.sqlite import SqliteBackend
+
+INVITE_KEYS = {
+    "link", "chat_id", "owner_tg_id", "title", "date_created", "expire_date", "usage_limit",
+    "request_needed", "usage", "approved_request_count", "revoked", "last_synced_at",
+    "owner_username", "owner_first_name",
+}
+
+
+def _invite(tag: str, i: int, *, usage: int = 0, approved: int = 0, title: str | None = "",
+            revoked: bool = False) -> SimpleNamespace:
+    base = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    return SimpleNamespace(
+        link=f"https://t.me/+conf{tag}{i:05d}",
+        title=f"conf {i}" if title == "" else title,
+        # по три ссылки на секунду — чтобы keyset-пагинация упиралась в одинаковые даты
+        date=base + dt.timedelta(seconds=i // 3),
+        expire_date=None,
+        usage_limit=None,
+        request_needed=False,
+        revoked=revoked,
+        usage=usage,
+        approved_request_count=approved,
+    )
+
+
+async def _collect(agen) -> list[dict]:
+    return [row async for chunk in agen for row in chunk]
+
+
+async def _execute(backend: StorageBackend, sql: str, *args: object) -> None:
+    """
+    Запрос мимо интерфейса — завести то, что публичные функции не пишут
+    (строки без даты, старая история). Плейсхолдеры — ?, для Postgres заменяются на $n.
+    """
+    if isinstance(backend, SqliteBackend):
+        conn = await db.connect()
+        async with db._lock:
+            await conn.execute(sql, args)
+            await conn.commit()
+        return
+    n = itertools.count(1)
+    await backend.pool.execute(re.sub(r"\?", lambda _: f"${next(n)}", sql), *args)
+
+
+async def run_conformance(backend: StorageBackend, n_links: int = 250) -> list[str]:
+    """
+    Прогнать проверки. Возвращает список провалов (пустой — бэкенд соответствует).
+    """
+    failures: list[str] = []
+
+    def check(cond: bool, msg: str) -> None:
+        if not cond:
+            failures.append(msg)
+
+    tag = f"{random.randrange(16 ** 6):06x}"
+    chat_id = -(10 ** 12) - random.randrange(10 ** 6)
+    owner_a = 9 * 10 ** 11 + random.randrange(10 ** 6)
+    owner_b = owner_a + 1
+    invites = [_invite(tag, i, usage=i % 7) for i in range(n_links)]
+    links_a = [inv.link for inv in invites[: n_links - 10]]
+    links_b = [inv.link for inv in invites[n_links - 10:]]
+
+    try:
+        # ---- пользователи ----
+        await backend.upsert_user_basic(SimpleNamespace(id=owner_a, username="conf_a", first_name="A"))
+        await backend.upsert_user_basic(SimpleNamespace(id=owner_a, username="conf_a2", first_name="A2"))
+        await backend.flush_writes()
+        user = await backend.get_user(owner_a)
+        check(user is not None and user["username"] == "conf_a2", f"upsert_user_basic: последний апсерт не виден: {user}")
+
+        # ---- вставка и чтение ----
+        await backend.insert_many_from_exported(invites[: n_links - 10], chat_id, owner_a)
+        await backend.insert_many_from_exported(invites[n_links - 10:], chat_id, owner_b)
+        rows = await backend.get_invites_by_owner(owner_a)
+        check(len(rows) == len(links_a), f"get_invites_by_owner: {len(rows)} строк вместо {len(links_a)}")
+        check(bool(rows) and set(rows[0]) == INVITE_KEYS, f"get_invites_by_owner: ключи {sorted(rows[0]) if rows else None}")
+        check(
+            all(rows[k]["date_created"] >= rows[k + 1]["date_created"] for k in range(len(rows) - 1)),
+            "get_invites_by_owner: не отсортировано по date_created DESC",
+        )
+        check(bool(rows) and rows[0]["owner_username"] == "conf_a2", "get_invites_by_owner: нет данных владельца")
+
+        streamed = await _collect(backend.iter_invites_by_owner(owner_a, chunk_size=37))
+        check([r["link"] for r in streamed] == sorted(
+            links_a, key=lambda l: (next(r["date_created"] for r in rows if r["link"] == l), l), reverse=True,
+        ), "iter_invites_by_owner: порядок/состав не совпадает с (date_created, link) DESC")
+
+        grouped = await _collect(backend.iter_all_invites(chunk_size=50, group_by_owner=True))
+        ours = [r["owner_tg_id"] for r in grouped if r["link"].startswith(f"https://t.me/+conf{tag}")]
+        check(ours == [owner_a] * len(links_a) + [owner_b] * len(links_b),
+              "iter_all_invites(group_by_owner=True): ссылки не сгруппированы по владельцу")
+
+        # строки без date_created (остались от старых версий) — в конце, по link
+        undated = [invites[30].link, invites[31].link]
+        for link in undated:
+            await _execute(backend, "UPDATE invites SET date_created = NULL WHERE link = ?", link)
+        streamed = [r["link"] for r in await _collect(backend.iter_invites_by_owner(owner_a, chunk_size=37))]
+        check(sorted(streamed) == sorted(links_a) and streamed[-2:] == sorted(undated, reverse=True),
+              f"iter_invites_by_owner: строки без date_created потеряны или не в конце: {streamed[-3:]}")
+        streamed = [r["link"] for r in await _collect(backend.iter_all_invites(chunk_size=50))
+                    if r["link"].startswith(f"https://t.me/+conf{tag}")]
+        check(len(streamed) == n_links and streamed[-2:] == sorted(undated, reverse=True),
+              f"iter_all_invites: строки без date_created потеряны или не в конце: {len(streamed)}")
+
+        # ---- семантика апсерта ----
+        first = invites[5]
+        await backend.insert_many_from_exported([_invite(tag, 5, usage=0, title=None)], chat_id, owner_b)
+        row = await backend.get_link(first.link)
+        check(row is not None and row["usage"] == first.usage, f"апсерт: usage должен остаться MAX, получено {row}")
+        check(row is not None and row["title"] == first.title, "апсерт: пустой title не должен затирать старый")
+        check(row is not None and row["owner_tg_id"] == owner_a, "апсерт: владелец не должен меняться")
+
+        await backend.update_invite_counters(first.link, 100, 3, True)
+        await backend.flush_writes()
+        row = await backend.get_link(first.link)
+        check(row is not None and (row["usage"], row["approved_request_count"], row["revoked"]) == (100, 3, 1),
+              f"update_invite_counters: {row}")
+        # отложенные счётчики старше страницы синка: не должны лечь поверх неё при сбросе
+        await backend.update_invite_counters(invites[6].link, invites[6].usage, 0, True)
+        await backend.save_sync_delta([invites[6]], chat_id, chat_synced=False)
+        await backend.flush_writes()
+        row = await backend.get_link(invites[6].link)
+        check(row is not None and row["revoked"] == 0,
+              f"save_sync_delta: отложенная запись перетёрла более свежую прямую: {row}")
+
+        # ---- дельта-синк, история, сводка ----
+        fps = await backend.get_invite_fingerprints(chat_id)
+        check(len(fps) == n_links, f"get_invite_fingerprints: {len(fps)} вместо {n_links}")
+        check(fps.get(invites[7].link) == db.invite_fingerprint(invites[7]),
+              "get_invite_fingerprints: отпечаток не совпадает с invite_fingerprint")
+
+        bumped = _invite(tag, 7, usage=invites[7].usage + 5, approved=2)
+        since = int(time.time()) - 1
+        written = await backend.save_sync_delta([bumped], chat_id)
+        check(written == 1, f"save_sync_delta: записано {written}")
+        growth = await backend.get_link_growth(bumped.link, since)
+        check(growth == {"d_usage": 5, "d_approved": 2}, f"get_link_growth: {growth}")
+        owner_growth = await backend.get_owner_growth(owner_a, since)
+        check([g["link"] for g in owner_growth] == [bumped.link], f"get_owner_growth: {owner_growth}")
+        top = await backend.get_top_growing_links(chat_id, since)
+        check([t["link"] for t in top] == [bumped.link] and top[0]["growth"] == 7, f"get_top_growing_links: {top}")
+        series = await backend.get_link_growth_series(bumped.link, since, bucket_sec=3600)
+        check(sum(s["d_usage"] for s in series) == 5, f"get_link_growth_series: {series}")
+
+        # ---- прореживание истории ----
+        hour = (int(time.time()) // db.HOUR - settings.history_raw_hours - 2) * db.HOUR
+        for k in range(3):
+            await _execute(
+                backend,
+                "INSERT INTO invite_stats_history (link, ts, granularity, d_usage, d_approved) VALUES (?, ?, 0, ?, 0)",
+                invites[11].link, hour + k * 60, k + 1,
+            )
+        stats = await backend.compact_stats_history()
+        check(stats["raw_to_hourly"] >= 3, f"compact_stats_history: сырые строки не свёрнуты: {stats}")
+        growth = await backend.get_link_growth(invites[11].link, hour, hour + db.HOUR)
+        check(growth == {"d_usage": 6, "d_approved": 0}, f"compact_stats_history: сумма за час изменилась: {growth}")
+
+        # ---- вступления по апдейтам ----
+        joined = invites[9]
+        await backend.add_invite_joins(joined.link, d_usage=2)
+        await backend.add_invite_joins(joined.link, d_approved=1)
+        await backend.add_invite_joins(f"https://t.me/+conf{tag}missing", d_usage=1)
+        await backend.flush_writes()
+        row = await backend.get_link(joined.link)
+        check(row is not None and (row["usage"], row["approved_request_count"]) == (joined.usage + 2, 1),
+              f"add_invite_joins: {row}")
+        check(await backend.get_link_growth(joined.link, int(time.time()) - 5) == {"d_usage": 2, "d_approved": 1},
+              "add_invite_joins: прирост не попал в историю")
+        # сверка синком вперемешку со вступлениями: каждое попадает в счётчик и историю ровно раз
+        since = int(time.time()) - 5
+        # страница запрошена до вступлений по апдейтам — не откатывает их
+        await backend.save_sync_delta([invites[9]], chat_id, chat_synced=False)
+        # вступление ещё в очереди, страница его уже видит
+        await backend.add_invite_joins(joined.link, d_usage=1)
+        await backend.save_sync_delta([_invite(tag, 9, usage=joined.usage + 3, approved=1)], chat_id, chat_synced=False)
+        # вступление записано после запроса страницы, но раньше её записи
+        await backend.add_invite_joins(joined.link, d_usage=1)
+        await backend.flush_writes()
+        await backend.save_sync_delta([_invite(tag, 9, usage=joined.usage + 3, approved=1)], chat_id, chat_synced=False)
+        # вступление, апдейт о котором не пришёл: досчитывает синк
+        await backend.save_sync_delta([_invite(tag, 9, usage=joined.usage + 5, approved=1)], chat_id, chat_synced=False)
+        await backend.flush_writes()
+        row = await backend.get_link(joined.link)
+        check(row is not None and (row["usage"], row["approved_request_count"]) == (joined.usage + 5, 1),
+              f"save_sync_delta: счётчики после сверки со вступлениями: {row}")
+        growth = await backend.get_link_growth(joined.link, since)
+        check(growth == {"d_usage": 5, "d_approved": 1}, f"save_sync_delta: вступления посчитаны дважды: {growth}")
+        # незнакомая ссылка: накопленное за всё время — не прирост
+        fresh = _invite(tag, n_links + 1, usage=40)
+        await backend.save_sync_delta([fresh], chat_id, chat_synced=False)
+        check(await backend.get_link_growth(fresh.link, since) == {"d_usage": 0, "d_approved": 0},
+              "save_sync_delta: первое появление ссылки попало в историю")
+        await backend.delete_invite(fresh.link)
+
+        stats = await backend.get_owner_stats(owner_a)
+        rows = await backend.get_invites_by_owner(owner_a)
+        check(stats is not None and stats["links"] == len(links_a), f"get_owner_stats: {stats}")
+        check(stats is not None and stats["usage"] == sum(r["usage"] for r in rows),
+              "get_owner_stats: usage не совпадает с суммой по ссылкам")
+        check(stats is not None and stats["revoked"] == 1, "get_owner_stats: revoked")
+        check(not [d for d in await backend.check_owner_stats() if d["owner_tg_id"] in (owner_a, owner_b)],
+              "check_owner_stats: расхождение после обычных записей")
+        check(await backend.rebuild_owner_stats() >= 2, "rebuild_owner_stats: владельцев меньше двух")
+        check(await backend.get_owner_stats(owner_a) == stats, "rebuild_owner_stats: сводка изменилась")
+
+        single = _invite(tag, n_links + 2, usage=3)
+        await backend.insert_invite_from_exported(single, chat_id, owner_b)
+        await backend.flush_writes()
+        row = await backend.get_link(single.link)
+        check(row is not None and (row["owner_tg_id"], row["usage"]) == (owner_b, 3), f"insert_invite_from_exported: {row}")
+        everything = {r["link"] for r in await backend.get_all_invites()}
+        check(set(links_a + links_b + [single.link]) <= everything, "get_all_invites: не все ссылки")
+        await backend.delete_invite(single.link)
+        check(any(u["tg_id"] == owner_a for u in await backend.list_users(limit=10 ** 6)), "list_users: нет пользователя")
+
+        # ---- позиция прохода ----
+        check(await backend.get_sync_cursor(chat_id) is None, "get_sync_cursor: позиции не должно быть после полного синка")
+        await backend.save_sync_delta([invites[0]], chat_id, chat_synced=False, cursor=(False, 1704067200, invites[0].link, None))
+        await backend.save_sync_delta([invites[1]], chat_id, chat_synced=False, cursor=(True, None, None, owner_a))
+        cursor = await backend.get_sync_cursor(chat_id)
+        check(cursor is not None
+              and (cursor["revoked"], cursor["offset_date"], cursor["offset_link"], cursor["admin_id"], cursor["pages"])
+              == (1, None, None, owner_a, 2), f"save_sync_delta(cursor=...): {cursor}")
+        await backend.save_sync_delta([], chat_id)
+        check(await backend.get_sync_cursor(chat_id) is None, "save_sync_delta(chat_synced=True): позиция не удалена")
+
+        # ---- реестр чатов ----
+        check(await backend.add_sync_chat(chat_id, title="conf") is True, "add_sync_chat: новый чат не добавлен")
+        check(await backend.add_sync_chat(chat_id) is False, "add_sync_chat: повторное добавление должно вернуть False")
+        check(await backend.set_sync_chat_enabled(chat_id, False), "set_sync_chat_enabled: чат не найден")
+        check(str(chat_id) not in {c["chat_id"] for c in await backend.list_sync_chats(enabled_only=True)},
+              "list_sync_chats(enabled_only=True): выключенный чат в выдаче")
+        await backend.record_sync_run(chat_id, duration_ms=1500, pages=3, links=n_links, changed=4)
+        await backend.record_sync_run(chat_id, duration_ms=10, pages=1, links=0, changed=0, error="boom")
+        chat = next((c for c in await backend.list_sync_chats() if c["chat_id"] == str(chat_id)), None)
+        check(chat is not None and (chat["last_links"], chat["errors"], chat["last_error"]) == (n_links, 1, "boom"),
+              f"record_sync_run: {chat}")
+        check(chat is not None and chat["last_synced_at"] is not None, "list_sync_chats: нет штампа chat_sync")
+        await backend.record_sync_run(chat_id, duration_ms=10, pages=1, links=n_links, changed=0)
+        chat = next((c for c in await backend.list_sync_chats() if c["chat_id"] == str(chat_id)), None)
+        check(chat is not None and chat["errors"] == 0 and chat["last_error"] is None,
+              f"record_sync_run: успешный проход не сбросил ошибки: {chat}")
+        check(await backend.delete_sync_chat(chat_id), "delete_sync_chat: чат не найден")
+
+        # ---- запас ссылок ----
+        pooled = [_invite(tag + "p", i, title=None) for i in range(3)]
+        pooled[0].admin_id = owner_a
+        # ссылка с владельцем в запасе: при выдаче должна выброситься, а не уйти второму оператору
+        check(await backend.add_pool_invites([invites[-1], *pooled], chat_id) == 4, "add_pool_invites: добавлено не 4")
+        check(await backend.add_pool_invites(pooled[:1], chat_id) == 0, "add_pool_invites: повтор добавлен")
+        check(await backend.count_pool_invites(chat_id) == 4, "count_pool_invites: не 4")
+        claimed = await backend.claim_pool_invites(chat_id, 2)
+        check([r["link"] for r in claimed] == [p.link for p in pooled[:2]],
+              f"claim_pool_invites: {[r['link'] for r in claimed]}")
+        check([r["admin_id"] for r in claimed] == [owner_a, None], f"claim_pool_invites: admin_id {claimed}")
+        check(await backend.count_pool_invites(chat_id) == 1, "claim_pool_invites: в запасе не осталась одна ссылка")
+        check([r["link"] for r in await backend.claim_pool_invites(chat_id, 5)] == [pooled[2].link],
+              "claim_pool_invites: остаток")
+        await backend.insert_many_from_exported(pooled[:1], chat_id, None)
+        await backend.insert_many_from_exported(pooled[:1], chat_id, owner_b)
+        row = await backend.get_link(pooled[0].link)
+        check(row is not None and row["owner_tg_id"] == owner_b,
+              f"insert_many_from_exported: ничья ссылка не получила владельца: {row}")
+        await backend.insert_many_from_exported(pooled[:1], chat_id, owner_a)
+        row = await backend.get_link(pooled[0].link)
+        check(row is not None and row["owner_tg_id"] == owner_b, "insert_many_from_exported: владелец перезаписан")
+        # синк ссылки чужого админа: владелец по ссылке (owners), тоже только ничьей
+        await backend.save_sync_delta([pooled[1]], chat_id, chat_synced=False, owners={pooled[1].link: owner_b})
+        await backend.save_sync_delta([pooled[1]], chat_id, chat_synced=False, owners={pooled[1].link: owner_a})
+        row = await backend.get_link(pooled[1].link)
+        check(row is not None and row["owner_tg_id"] == owner_b, f"save_sync_delta(owners=...): {row}")
+
+        # ---- пачки ссылок ----
+        key = f"conf{tag}"
+        await backend.start_link_batch(key, owner_b, chat_id, ["a", None, "c"])
+        await backend.add_link_batch_item(key, 2, pooled[2], chat_id, owner_b)
+        batch = await backend.get_link_batch(key)
+        check(batch is not None and batch["titles"] == ["a", None, "c"] and list(batch["links"]) == [2],
+              f"get_link_batch: {batch}")
+        check(batch is not None and batch["links"][2]["link"] == pooled[2].link, "get_link_batch: ссылка пачки")
+        row = await backend.get_link(pooled[2].link)
+        check(row is not None and row["owner_tg_id"] == owner_b, f"add_link_batch_item: владелец {row}")
+        await backend.start_link_batch(key, owner_b, chat_id, ["x"])
+        batch = await backend.get_link_batch(key)
+        check(batch is not None and batch["titles"] == ["x"] and not batch["links"],
+              f"start_link_batch: пачка с тем же ключом не заменилась: {batch}")
+        await backend.finish_link_batch(key)
+        check(await backend.get_link_batch(key) is None, "finish_link_batch: пачка осталась")
+
+        # ---- очередь заданий ----
+        job_a = await backend.add_link_job(owner_a, chat_id, "mask", {"mask": "m {n}", "n": 3}, f"conf{tag}", 77)
+        job_b = await backend.add_link_job(owner_b, chat_id, "no_title", {"n": 1}, f"conf{tag}b")
+        await backend.start_link_job(job_a)
+        jobs = [j for j in await backend.list_link_jobs() if j["id"] in (job_a, job_b)]
+        check([(j["id"], j["status"], j["params"]) for j in jobs]
+              == [(job_a, "running", {"mask": "m {n}", "n": 3}), (job_b, "queued", {"n": 1})],
+              f"list_link_jobs: {jobs}")
+        check(bool(jobs) and (jobs[0]["owner_tg_id"], jobs[0]["message_id"], jobs[0]["chat_id"])
+              == (owner_a, 77, str(chat_id)), f"add_link_job: {jobs[:1]}")
+        await backend.finish_link_job(job_a)
+        await backend.finish_link_job(job_b)
+        check(not [j for j in await backend.list_link_jobs() if j["id"] in (job_a, job_b)], "finish_link_job: задание осталось")
+
+        # ---- шаги диалогов ----
+        now = int(time.time())
+        await backend.save_dialog_state(owner_a, {"mode": "mask", "step": "ask_mask", "prompt_id": 5}, now + 100)
+        await backend.save_dialog_state(owner_a, {"mode": "mask", "step": "ask_count", "prompt_id": 6}, now + 200)
+        await backend.save_dialog_state(owner_b, {"mode": "stat", "step": "ask_links", "prompt_id": 7}, now - 1)
+        states = {s["user_id"]: s for s in await backend.load_dialog_states(now)}
+        check(owner_a in states and states[owner_a]["data"]["step"] == "ask_count"
+              and states[owner_a]["expires_at"] == now + 200, f"save_dialog_state: {states.get(owner_a)}")
+        check(owner_b not in states, "load_dialog_states: вернулся истёкший шаг")
+        check(await backend.purge_dialog_states(now) >= 1, "purge_dialog_states: истёкший шаг не удалён")
+        await backend.delete_dialog_state(owner_a)
+        check(owner_a not in {s["user_id"] for s in await backend.load_dialog_states(now)}, "delete_dialog_state")
+
+        # ---- удаление ----
+        await backend.delete_invite(first.link)
+        check(await backend.get_link(first.link) is None, "delete_invite: ссылка осталась")
+        stats = await backend.get_owner_stats(owner_a)
+        check(stats is not None and stats["links"] == len(links_a) - 1, f"delete_invite: сводка не обновилась: {stats}")
+        await backend.delete_user(owner_a)
+        check(await backend.get_user(owner_a) is None, "delete_user: пользователь остался")
+
+    finally:
+        for inv in invites + [_invite(tag + "p", i) for i in range(3)]:
+            await backend.delete_invite(inv.link)
+        await backend.claim_pool_invites(chat_id, 10)
+        await backend.delete_user(owner_a)
+        await backend.delete_sync_chat(chat_id)
+        await backend.finish_link_batch(f"conf{tag}")
+
+    return failures
+
+
+def print_report(failures: list[str], echo: Callable[[str], None] = print) -> None:
+    if not failures:
+        echo("OK: бэкенд прошёл все проверки")
+        return
+    echo(f"FAIL: {len(failures)} проверок не прошло")
+    for f in failures:
+        echo(f"  - {f}")
@@ -0,0 +1,963 @@
+# services/backends/postgres.py
+"""
+PostgreSQL-бэкенд (asyncpg) для services.db.
+
+Включается DB_BACKEND=postgres, строка подключения — DB_DSN.
+Пул соединений asyncpg, пакетные апсерты через unnest(),
+большие пачки — через COPY во временную таблицу.
+Сводка по владельцу считается агрегатом по invites (индекс по owner_tg_id),
+поэтому отдельной таблицы и триггеров здесь нет.
+"""
+from __future__ import annotations
+
+import json
+import time
+from typing import AsyncIterator, Iterable, Optional
+
+from telethon.tl import types
+from telethon.tl.types import User
+
+from config import settings
+from services.backends.base import StorageBackend
+from services.db import DAY, HOUR, _I_APPROVED, _I_USAGE, _invite_params, _merge_invite_params
+
+try:
+    import asyncpg
+except ImportError:  # зависимость нужна только для этого бэкенда
+    asyncpg = None
+
+
+# колонки invites в порядке кортежа _invite_params
+_INVITE_COLUMNS = (
+    "link", "chat_id", "owner_tg_id", "title", "date_created", "expire_date",
+    "usage_limit", "request_needed", "usage", "approved_request_count", "revoked", "last_synced_at",
+)
+_INVITE_PG_TYPES = (
+    "text", "text", "bigint", "text", "bigint", "bigint",
+    "integer", "integer", "integer", "integer", "integer", "bigint",
+)
+
+_UPSERT_SET = """
+    ON CONFLICT (link) DO UPDATE SET
+      owner_tg_id             = COALESCE(invites.owner_tg_id, EXCLUDED.owner_tg_id),
+      title                   = COALESCE(EXCLUDED.title, invites.title),
+      expire_date             = COALESCE(EXCLUDED.expire_date, invites.expire_date),
+      usage_limit             = COALESCE(EXCLUDED.usage_limit, invites.usage_limit),
+      request_needed          = EXCLUDED.request_needed,
+      usage                   = GREATEST(invites.usage, EXCLUDED.usage),
+      approved_request_count  = GREATEST(invites.approved_request_count, EXCLUDED.approved_request_count),
+      revoked                 = EXCLUDED.revoked,
+      last_synced_at          = EXCLUDED.last_synced_at
+"""
+
+_UNNEST_INSERT = (
+    f"INSERT INTO invites ({', '.join(_INVITE_COLUMNS)}) SELECT * FROM unnest("
+    + ", ".join(f"${i}::{t}[]" for i, t in enumerate(_INVITE_PG_TYPES, start=1))
+    + ")"
+)
+_UPSERT_UNNEST_SQL = _UNNEST_INSERT + _UPSERT_SET
+
+_INVITES_SELECT = """
+    SELECT
+        i.link,
+        i.chat_id,
+        i.owner_tg_id,
+        i.title,
+        i.date_created,
+        i.expire_date,
+        i.usage_limit,
+        i.request_needed,
+        i.usage,
+        i.approved_request_count,
+        i.revoked,
+        NULLIF(GREATEST(
+            COALESCE(i.last_synced_at, 0),
+            CASE WHEN i.revoked = 0 THEN COALESCE(s.last_synced_at, 0) ELSE 0 END
+        ), 0)         AS last_synced_at,
+        u.username    AS owner_username,
+        u.first_name  AS owner_first_name
+    FROM invites i
+    LEFT JOIN users u
+        ON u.tg_id = i.owner_tg_id
+    LEFT JOIN chat_sync s
+        ON s.chat_id = i.chat_id
+"""
+
+_ADD_HISTORY_SQL = """
+    INSERT INTO invite_stats_history (link, ts, granularity, d_usage, d_approved)
+    SELECT * FROM unnest($1::text[], $2::bigint[], $3::integer[], $4::bigint[], $5::bigint[])
+    ON CONFLICT (link, ts, granularity) DO UPDATE SET
+        d_usage    = invite_stats_history.d_usage    + EXCLUDED.d_usage,
+        d_approved = invite_stats_history.d_approved + EXCLUDED.d_approved
+"""
+
+# прирост по странице синка — от строки в базе (см. _SYNC_HISTORY_SQL в services/db.py);
+# строки блокируются до конца транзакции, чтобы вступление не вклинилось между чтением и апсертом
+_SYNC_HISTORY_SQL = """
+    WITH cur AS (
+        SELECT i.link,
+               GREATEST(p.usage - i.usage, 0)                       AS d_usage,
+               GREATEST(p.approved - i.approved_request_count, 0)   AS d_approved
+        FROM invites i
+        JOIN unnest($2::text[], $3::integer[], $4::integer[]) AS p(link, usage, approved)
+            ON p.link = i.link
+        FOR UPDATE OF i
+    )
+    INSERT INTO invite_stats_history (link, ts, granularity, d_usage, d_approved)
+    SELECT link, $1::bigint, 0, d_usage, d_approved FROM cur
+    WHERE d_usage > 0 OR d_approved > 0
+    ON CONFLICT (link, ts, granularity) DO UPDATE SET
+        d_usage    = invite_stats_history.d_usage    + EXCLUDED.d_usage,
+        d_approved = invite_stats_history.d_approved + EXCLUDED.d_approved
+"""
+
+_OWNER_STATS_SQL = """
+    SELECT
+        owner_tg_id,
+        COUNT(*)                                     AS links,
+        COALESCE(SUM(usage), 0)                      AS usage,
+        COALESCE(SUM(approved_request_count), 0)     AS approved,
+        COALESCE(SUM(revoked), 0)                    AS revoked,
+        MAX(COALESCE(last_synced_at, date_created))  AS last_activity
+    FROM invites
+"""
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        tg_id      BIGINT PRIMARY KEY,
+        username   TEXT,
+        first_name TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)",
+    """
+    CREATE TABLE IF NOT EXISTS invites (
+        link TEXT PRIMARY KEY,
+        chat_id TEXT NOT NULL,
+        owner_tg_id BIGINT,
+        title TEXT,
+        date_created BIGINT,
+        expire_date BIGINT,
+        usage_limit INTEGER,
+        request_needed INTEGER,
+        usage INTEGER DEFAULT 0,
+        approved_request_count INTEGER DEFAULT 0,
+        revoked INTEGER DEFAULT 0,
+        last_synced_at BIGINT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_invites_owner_created ON invites(owner_tg_id, date_created, link)",
+    "CREATE INDEX IF NOT EXISTS idx_invites_created_link  ON invites(date_created, link)",
+    "CREATE INDEX IF NOT EXISTS idx_invites_chat_fp       ON invites(chat_id) "
+    "INCLUDE (link, usage, approved_request_count, revoked, expire_date)",
+    "DROP INDEX IF EXISTS idx_invites_owner",
+    "DROP INDEX IF EXISTS idx_invites_chat",
+    "DROP INDEX IF EXISTS idx_invites_created",
+    "DROP INDEX IF EXISTS idx_invites_synced",
+    """
+    CREATE TABLE IF NOT EXISTS chat_sync (
+        chat_id        TEXT PRIMARY KEY,
+        last_synced_at BIGINT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sync_cursors (
+        chat_id     TEXT PRIMARY KEY,
+        revoked     INTEGER NOT NULL DEFAULT 0,
+        offset_date BIGINT,
+        offset_link TEXT,
+        pages       INTEGER NOT NULL DEFAULT 0,
+        started_at  BIGINT,
+        updated_at  BIGINT,
+        admin_id    BIGINT
+    )
+    """,
+    "ALTER TABLE sync_cursors ADD COLUMN IF NOT EXISTS admin_id BIGINT",
+    """
+    CREATE TABLE IF NOT EXISTS sync_chats (
+        chat_id          TEXT PRIMARY KEY,
+        title            TEXT,
+        enabled          INTEGER NOT NULL DEFAULT 1,
+        include_revoked  INTEGER NOT NULL DEFAULT 0,
+        added_at         BIGINT,
+        last_run_at      BIGINT,
+        last_ok_at       BIGINT,
+        last_duration_ms BIGINT,
+        last_pages       INTEGER,
+        last_links       INTEGER,
+        last_changed     INTEGER,
+        errors           INTEGER NOT NULL DEFAULT 0,
+        last_error       TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS invite_pool (
+        link           TEXT PRIMARY KEY,
+        chat_id        TEXT NOT NULL,
+        title          TEXT,
+        date_created   BIGINT,
+        expire_date    BIGINT,
+        usage_limit    INTEGER,
+        request_needed INTEGER,
+        pooled_at      BIGINT NOT NULL,
+        admin_id       BIGINT
+    )
+    """,
+    "ALTER TABLE invite_pool ADD COLUMN IF NOT EXISTS admin_id BIGINT",
+    "CREATE INDEX IF NOT EXISTS idx_invite_pool_chat ON invite_pool(chat_id, pooled_at, link)",
+    """
+    CREATE TABLE IF NOT EXISTS link_batches (
+        batch_key   TEXT PRIMARY KEY,
+        owner_tg_id BIGINT NOT NULL,
+        chat_id     TEXT NOT NULL,
+        titles      TEXT NOT NULL,
+        created_at  BIGINT NOT NULL,
+        updated_at  BIGINT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_link_batches_updated ON link_batches(updated_at)",
+    """
+    CREATE TABLE IF NOT EXISTS link_jobs (
+        id          BIGSERIAL PRIMARY KEY,
+        owner_tg_id BIGINT NOT NULL,
+        chat_id     TEXT NOT NULL,
+        kind        TEXT NOT NULL,
+        params      TEXT NOT NULL,
+        batch_key   TEXT NOT NULL,
+        message_id  BIGINT,
+        status      TEXT NOT NULL DEFAULT 'queued',
+        created_at  BIGINT NOT NULL,
+        started_at  BIGINT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS dialog_state (
+        user_id    BIGINT PRIMARY KEY,
+        data       TEXT NOT NULL,
+        expires_at BIGINT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_dialog_state_expires ON dialog_state(expires_at)",
+    """
+    CREATE TABLE IF NOT EXISTS link_batch_items (
+        batch_key TEXT    NOT NULL,
+        idx       INTEGER NOT NULL,
+        link      TEXT    NOT NULL,
+        PRIMARY KEY (batch_key, idx)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS invite_stats_history (
+        link        TEXT    NOT NULL,
+        ts          BIGINT  NOT NULL,
+        granularity INTEGER NOT NULL DEFAULT 0,
+        d_usage     BIGINT  NOT NULL DEFAULT 0,
+        d_approved  BIGINT  NOT NULL DEFAULT 0,
+        PRIMARY KEY (link, ts, granularity)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_history_gran_ts ON invite_stats_history(granularity, ts)",
+)
+
+
+def _dedupe_params(params: Iterable[tuple]) -> list[tuple]:
+    """
+    Склеить повторы одной ссылки внутри пачки: Postgres не даёт
+    ON CONFLICT DO UPDATE задеть одну строку дважды за один INSERT.
+    """
+    out: dict[str, tuple] = {}
+    for p in params:
+        prev = out.get(p[0])
+        out[p[0]] = _merge_invite_params(prev, p) if prev is not None else p
+    return list(out.values())
+
+
+class PostgresBackend(StorageBackend):
+
+    def __init__(
+        self,
+        dsn: Optional[str] = None,
+        *,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        copy_threshold: Optional[int] = None,
+    ) -> None:
+        self.dsn = dsn or settings.db_dsn
+        self.min_size = min_size or settings.db_pg_pool_min
+        self.max_size = max_size or settings.db_pg_pool_max
+        # с какого размера пачки апсерт идёт через COPY, а не unnest
+        self.copy_threshold = copy_threshold or settings.db_pg_copy_threshold
+        self._pool: Optional["asyncpg.Pool"] = None
+
+    # ---- жизненный цикл ----
+
+    async def init(self) -> None:
+        if asyncpg is None:
+            raise RuntimeError("DB_BACKEND=postgres requires the asyncpg package")
+        if not self.dsn:
+            raise RuntimeError("Missing env vars: DB_DSN")
+        if self._pool is None:
+            self._pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                for stmt in _SCHEMA:
+                    await conn.execute(stmt)
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    @property
+    def pool(self) -> "asyncpg.Pool":
+        if self._pool is None:
+            raise RuntimeError("PostgresBackend is not initialized: call init_db() first")
+        return self._pool
+
+    # ---- ссылки: запись ----
+
+    async def _upsert_invites(self, conn: "asyncpg.Connection", params: list[tuple]) -> None:
+        params = _dedupe_params(params)
+        if not params:
+            return
+        if len(params) < self.copy_threshold:
+            await conn.execute(_UPSERT_UNNEST_SQL, *map(list, zip(*params)))
+            return
+        # большая пачка: COPY во временную таблицу, затем один INSERT ... SELECT
+        await conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS invites_stage (LIKE invites INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        )
+        await conn.copy_records_to_table("invites_stage", records=params, columns=_INVITE_COLUMNS)
+        await conn.execute(
+            f"INSERT INTO invites ({', '.join(_INVITE_COLUMNS)}) "
+            f"SELECT {', '.join(_INVITE_COLUMNS)} FROM invites_stage"
+            + _UPSERT_SET
+        )
+
+    async def insert_invite_from_exported(
+        self, exported: types.ChatInviteExported, chat_id: int | str, owner_tg_id: int
+    ) -> None:
+        await self.insert_many_from_exported([exported], chat_id, owner_tg_id)
+
+    async def insert_many_from_exported(
+        self, exported_list: Iterable[types.ChatInviteExported], chat_id: int | str, owner_tg_id: int
+    ) -> None:
+        now = int(time.time())
+        params = [
+            p for p in (_invite_params(e, chat_id, owner_tg_id, now) for e in exported_list)
+            if p is not None
+        ]
+        if not params:
+            return
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await self._upsert_invites(conn, params)
+
+    async def update_invite_counters(
+        self, link: str, usage: int, approved_request_count: int, revoked: bool
+    ) -> None:
+        await self.pool.execute(
+            """
+            UPDATE invites
+            SET usage                  = GREATEST(usage, $1),
+                approved_request_count = GREATEST(approved_request_count, $2),
+                revoked                = $3,
+                last_synced_at         = $4
+            WHERE link = $5
+            """,
+            usage, approved_request_count, int(revoked), int(time.time()), link,
+        )
+
+    async def add_invite_joins(self, link: str, d_usage: int = 0, d_approved: int = 0) -> None:
+        if not (d_usage or d_approved):
+            return
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                status = await conn.execute(
+                    """
+                    UPDATE invites
+                    SET usage                  = usage + $1,
+                        approved_request_count = approved_request_count + $2
+                    WHERE link = $3
+                    """,
+                    d_usage, d_approved, link,
+                )
+                if status != "UPDATE 0":
+                    await conn.execute(_ADD_HISTORY_SQL, [link], [int(time.time())], [0], [d_usage], [d_approved])
+
+    async def delete_invite(self, link: str) -> None:
+        await self.pool.execute("DELETE FROM invites WHERE link = $1", link)
+
+    # ---- дельта-синк и история ----
+
+    async def get_invite_fingerprints(self, chat_id: int | str) -> dict[str, tuple]:
+        rows = await self.pool.fetch(
+            """
+            SELECT link, usage, approved_request_count, revoked, expire_date
+            FROM invites
+            WHERE chat_id = $1
+            """,
+            str(chat_id),
+        )
+        return {r[0]: (r[1] or 0, r[2] or 0, r[3] or 0, r[4]) for r in rows}
+
+    async def save_sync_delta(
+        self,
+        changed: Iterable[types.ChatInviteExported],
+        chat_id: int | str,
+        owner_tg_id: int | None = None,
+        chat_synced: bool = True,
+        cursor: Optional[tuple[bool, Optional[int], Optional[str], Optional[int]]] = None,
+        owners: Optional[dict[str, int]] = None,
+    ) -> int:
+        now = int(time.time())
+        owners = owners or {}
+        params = _dedupe_params(
+            p for p in (
+                _invite_params(e, chat_id, owners.get(getattr(e, "link", None), owner_tg_id), now) for e in changed
+            )
+            if p is not None
+        )
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if params:
+                    # история — до апсерта: прирост считается от ещё не перезаписанной строки
+                    await conn.execute(
+                        _SYNC_HISTORY_SQL, now,
+                        [p[0] for p in params], [p[_I_USAGE] for p in params], [p[_I_APPROVED] for p in params],
+                    )
+                await self._upsert_invites(conn, params)
+                if chat_synced:
+                    await conn.execute(
+                        """
+                        INSERT INTO chat_sync (chat_id, last_synced_at) VALUES ($1, $2)
+                        ON CONFLICT (chat_id) DO UPDATE SET last_synced_at = EXCLUDED.last_synced_at
+                        """,
+                        str(chat_id), now,
+                    )
+                    await conn.execute("DELETE FROM sync_cursors WHERE chat_id = $1", str(chat_id))
+                elif cursor is not None:
+                    revoked, offset_date, offset_link, admin_id = cursor
+                    await conn.execute(
+                        """
+                        INSERT INTO sync_cursors
+                            (chat_id, revoked, offset_date, offset_link, admin_id, pages, started_at, updated_at)
+                        VALUES ($1, $2, $3, $4, $6, 1, $5, $5)
+                        ON CONFLICT (chat_id) DO UPDATE SET
+                            revoked     = EXCLUDED.revoked,
+                            offset_date = EXCLUDED.offset_date,
+                            offset_link = EXCLUDED.offset_link,
+                            admin_id    = EXCLUDED.admin_id,
+                            pages       = sync_cursors.pages + 1,
+                            updated_at  = EXCLUDED.updated_at
+                        """,
+                        str(chat_id), 1 if revoked else 0, offset_date, offset_link, now, admin_id,
+                    )
+        return len(params)
+
+    async def get_sync_cursor(self, chat_id: int | str) -> Optional[dict]:
+        row = await self.pool.fetchrow(
+            """
+            SELECT revoked, offset_date, offset_link, admin_id, pages, started_at, updated_at
+            FROM sync_cursors
+            WHERE chat_id = $1
+            """,
+            str(chat_id),
+        )
+        return dict(row) if row else None
+
+    async def compact_stats_history(self, now: Optional[int] = None) -> dict:
+        now = now or int(time.time())
+        stats = {"raw_to_hourly": 0, "hourly_to_daily": 0, "daily_deleted": 0}
+
+        async def _roll_up(conn, from_gran: int, to_gran: int, border: int) -> int:
+            await conn.execute(
+                """
+                INSERT INTO invite_stats_history (link, ts, granularity, d_usage, d_approved)
+                SELECT link, (ts / $1::bigint) * $1::bigint, $1::integer, SUM(d_usage), SUM(d_approved)
+                FROM invite_stats_history
+                WHERE granularity = $2::integer AND ts < $3::bigint
+                GROUP BY link, ts / $1::bigint
+                ON CONFLICT (link, ts, granularity) DO UPDATE SET
+                    d_usage    = invite_stats_history.d_usage    + EXCLUDED.d_usage,
+                    d_approved = invite_stats_history.d_approved + EXCLUDED.d_approved
+                """,
+                to_gran, from_gran, border,
+            )
+            res = await conn.execute(
+                "DELETE FROM invite_stats_history WHERE granularity = $1 AND ts < $2",
+                from_gran, border,
+            )
+            return int(res.split()[-1])     # тег команды: "DELETE <n>"
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                stats["raw_to_hourly"] = await _roll_up(
+                    conn, 0, HOUR, now - settings.history_raw_hours * HOUR
+                )
+                stats["hourly_to_daily"] = await _roll_up(
+                    conn, HOUR, DAY, now - settings.history_hourly_days * DAY
+                )
+                if settings.history_daily_days > 0:
+                    res = await conn.execute(
+                        "DELETE FROM invite_stats_history WHERE granularity = $1 AND ts < $2",
+                        DAY, now - settings.history_daily_days * DAY,
+                    )
+                    stats["daily_deleted"] = int(res.split()[-1])
+        return stats
+
+    async def get_link_growth(self, link: str, since: int, until: Optional[int] = None) -> dict:
+        row = await self.pool.fetchrow(
+            """
+            SELECT COALESCE(SUM(d_usage), 0)::bigint    AS d_usage,
+                   COALESCE(SUM(d_approved), 0)::bigint AS d_approved
+            FROM invite_stats_history
+            WHERE link = $1 AND ts >= $2 AND ts < $3
+            """,
+            link, since, until or int(time.time()) + 1,
+        )
+        return dict(row)
+
+    async def get_link_growth_series(
+        self, link: str, since: int, until: Optional[int] = None, bucket_sec: int = HOUR
+    ) -> list[dict]:
+        rows = await self.pool.fetch(
+            """
+            SELECT (ts / $1) * $1            AS ts,
+                   SUM(d_usage)::bigint      AS d_usage,
+                   SUM(d_approved)::bigint   AS d_approved
+            FROM invite_stats_history
+            WHERE link = $2 AND ts >= $3 AND ts < $4
+            GROUP BY ts / $1
+            ORDER BY 1
+            """,
+            bucket_sec, link, since, until or int(time.time()) + 1,
+        )
+        return [dict(r) for r in rows]
+
+    async def get_owner_growth(self, owner_tg_id: int, since: int, until: Optional[int] = None) -> list[dict]:
+        rows = await self.pool.fetch(
+            """
+            SELECT i.link,
+                   i.title,
+                   SUM(h.d_usage)::bigint    AS d_usage,
+                   SUM(h.d_approved)::bigint AS d_approved
+            FROM invites i
+            JOIN invite_stats_history h
+                ON h.link = i.link AND h.ts >= $1 AND h.ts < $2
+            WHERE i.owner_tg_id = $3
+            GROUP BY i.link, i.title
+            ORDER BY SUM(h.d_usage) + SUM(h.d_approved) DESC
+            """,
+            since, until or int(time.time()) + 1, owner_tg_id,
+        )
+        return [dict(r) for r in rows]
+
+    async def get_top_growing_links(self, chat_id: int | str, since: int, limit: int = 50) -> list[dict]:
+        rows = await self.pool.fetch(
+            """
+            SELECT h.link,
+                   SUM(h.d_usage + h.d_approved)::bigint AS growth
+            FROM invite_stats_history h
+            JOIN invites i
+                ON i.link = h.link
+            WHERE h.granularity IN (0, 3600, 86400)
+              AND h.ts >= $1 AND i.chat_id = $2
+            GROUP BY h.link
+            ORDER BY growth DESC
+            LIMIT $3
+            """,
+            since, str(chat_id), limit,
+        )
+        return [dict(r) for r in rows]
+
+    # ---- реестр чатов синхронизации ----
+
+    async def add_sync_chat(
+        self, chat_id: int | str, title: Optional[str] = None, include_revoked: bool = False
+    ) -> bool:
+        status = await self.pool.execute(
+            """
+            INSERT INTO sync_chats (chat_id, title, include_revoked, added_at) VALUES ($1, $2, $3, $4)
+            ON CONFLICT (chat_id) DO NOTHING
+            """,
+            str(chat_id), title, 1 if include_revoked else 0, int(time.time()),
+        )
+        return status.endswith(" 1")
+
+    async def set_sync_chat_enabled(self, chat_id: int | str, enabled: bool) -> bool:
+        status = await self.pool.execute(
+            "UPDATE sync_chats SET enabled = $1 WHERE chat_id = $2", 1 if enabled else 0, str(chat_id)
+        )
+        return status != "UPDATE 0"
+
+    async def delete_sync_chat(self, chat_id: int | str) -> bool:
+        status = await self.pool.execute("DELETE FROM sync_chats WHERE chat_id = $1", str(chat_id))
+        return status != "DELETE 0"
+
+    async def list_sync_chats(self, enabled_only: bool = False) -> list[dict]:
+        rows = await self.pool.fetch(
+            """
+            SELECT c.*, s.last_synced_at
+            FROM sync_chats c
+            LEFT JOIN chat_sync s ON s.chat_id = c.chat_id
+            WHERE c.enabled = 1 OR NOT $1
+            ORDER BY c.added_at, c.chat_id
+            """,
+            enabled_only,
+        )
+        return [dict(r) for r in rows]
+
+    async def record_sync_run(
+        self,
+        chat_id: int | str,
+        *,
+        duration_ms: int,
+        pages: int,
+        links: int,
+        changed: int,
+        error: Optional[str] = None,
+    ) -> None:
+        ok = error is None
+        await self.pool.execute(
+            """
+            UPDATE sync_chats SET
+                last_run_at      = $2,
+                last_duration_ms = $3,
+                last_pages       = $4,
+                last_links       = CASE WHEN $5 THEN $6 ELSE last_links END,
+                last_changed     = CASE WHEN $5 THEN $7 ELSE last_changed END,
+                last_ok_at       = CASE WHEN $5 THEN $2 ELSE last_ok_at END,
+                errors           = CASE WHEN $5 THEN 0 ELSE errors + 1 END,
+                last_error       = $8
+            WHERE chat_id = $1
+            """,
+            str(chat_id), int(time.time()), duration_ms, pages, ok, links, changed, error,
+        )
+
+    # ---- запас ссылок ----
+
+    async def add_pool_invites(self, exported_list: Iterable[types.ChatInviteExported], chat_id: int | str) -> int:
+        now = int(time.time())
+        params = [(e.link, str(chat_id), *_invite_params(e, chat_id, None, now)[3:8], now, getattr(e, "admin_id", None))
+                  for e in exported_list if getattr(e, "link", None)]
+        if not params:
+            return 0
+        status = await self.pool.execute(
+            """
+            INSERT INTO invite_pool (
+              link, chat_id, title, date_created, expire_date, usage_limit, request_needed, pooled_at, admin_id
+            )
+            SELECT * FROM unnest($1::text[], $2::text[], $3::text[], $4::bigint[], $5::bigint[],
+                                 $6::integer[], $7::integer[], $8::bigint[], $9::bigint[])
+            ON CONFLICT (link) DO NOTHING
+            """,
+            *map(list, zip(*params)),
+        )
+        return int(status.rsplit(" ", 1)[-1])
+
+    async def claim_pool_invites(self, chat_id: int | str, limit: int) -> list[dict]:
+        if limit <= 0:
+            return []
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    DELETE FROM invite_pool p
+                    USING invites i
+                    WHERE p.chat_id = $1 AND i.link = p.link
+                      AND (i.revoked = 1 OR i.owner_tg_id IS NOT NULL)
+                    """,
+                    str(chat_id),
+                )
+                # SKIP LOCKED: параллельные выдачи не получат одну ссылку дважды и не ждут друг друга
+                rows = await conn.fetch(
+                    """
+                    DELETE FROM invite_pool
+                    WHERE link IN (
+                        SELECT link FROM invite_pool
+                        WHERE chat_id = $1
+                        ORDER BY pooled_at, link
+                        LIMIT $2
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING link, title, date_created, expire_date, usage_limit, request_needed, admin_id, pooled_at
+                    """,
+                    str(chat_id), limit,
+                )
+        rows = sorted((dict(r) for r in rows), key=lambda r: (r["pooled_at"], r["link"]))
+        for r in rows:
+            del r["pooled_at"]
+        return rows
+
+    async def count_pool_invites(self, chat_id: int | str) -> int:
+        return await self.pool.fetchval("SELECT COUNT(*) FROM invite_pool WHERE chat_id = $1", str(chat_id))
+
+    # ---- пачки ссылок ----
+
+    async def start_link_batch(
+        self, batch_key: str, owner_tg_id: int, chat_id: int | str, titles: list[Optional[str]]
+    ) -> None:
+        now = int(time.time())
+        expired = now - settings.link_batch_resume_sec
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    DELETE FROM link_batch_items
+                    WHERE batch_key = $1 OR batch_key IN (SELECT batch_key FROM link_batches WHERE updated_at < $2)
+                    """,
+                    batch_key, expired,
+                )
+                await conn.execute("DELETE FROM link_batches WHERE updated_at < $1", expired)
+                await conn.execute(
+                    """
+                    INSERT INTO link_batches (batch_key, owner_tg_id, chat_id, titles, created_at, updated_at)
+                    VALUES ($1, $2, $3, $4, $5, $5)
+                    ON CONFLICT (batch_key) DO UPDATE SET
+                        owner_tg_id = EXCLUDED.owner_tg_id,
+                        chat_id     = EXCLUDED.chat_id,
+                        titles      = EXCLUDED.titles,
+                        created_at  = EXCLUDED.created_at,
+                        updated_at  = EXCLUDED.updated_at
+                    """,
+                    batch_key, owner_tg_id, str(chat_id), json.dumps(titles, ensure_ascii=False), now,
+                )
+
+    async def add_link_batch_item(
+        self, batch_key: str, idx: int, exported: types.ChatInviteExported, chat_id: int | str, owner_tg_id: int
+    ) -> None:
+        now = int(time.time())
+        params = _invite_params(exported, chat_id, owner_tg_id, now)
+        if params is None:
+            return
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await self._upsert_invites(conn, [params])
+                await conn.execute(
+                    """
+                    INSERT INTO link_batch_items (batch_key, idx, link) VALUES ($1, $2, $3)
+                    ON CONFLICT (batch_key, idx) DO UPDATE SET link = EXCLUDED.link
+                    """,
+                    batch_key, idx, params[0],
+                )
+                await conn.execute("UPDATE link_batches SET updated_at = $2 WHERE batch_key = $1", batch_key, now)
+
+    async def get_link_batch(self, batch_key: str) -> Optional[dict]:
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT owner_tg_id, chat_id, titles, created_at, updated_at FROM link_batches WHERE batch_key = $1",
+                batch_key,
+            )
+            if row is None:
+                return None
+            items = await conn.fetch(
+                """
+                SELECT b.idx, i.link, i.title, i.date_created, i.expire_date, i.usage_limit, i.request_needed,
+                       i.usage, i.approved_request_count
+                FROM link_batch_items b
+                JOIN invites i ON i.link = b.link
+                WHERE b.batch_key = $1
+                ORDER BY b.idx
+                """,
+                batch_key,
+            )
+        batch = dict(row)
+        batch["titles"] = json.loads(batch["titles"])
+        batch["links"] = {r["idx"]: {k: v for k, v in r.items() if k != "idx"} for r in items}
+        return batch
+
+    async def finish_link_batch(self, batch_key: str) -> None:
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM link_batch_items WHERE batch_key = $1", batch_key)
+                await conn.execute("DELETE FROM link_batches WHERE batch_key = $1", batch_key)
+
+    # ---- очередь заданий ----
+
+    async def add_link_job(
+        self,
+        owner_tg_id: int,
+        chat_id: int | str,
+        kind: str,
+        params: dict,
+        batch_key: str,
+        message_id: Optional[int] = None,
+    ) -> int:
+        return await self.pool.fetchval(
+            """
+            INSERT INTO link_jobs (owner_tg_id, chat_id, kind, params, batch_key, message_id, created_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            RETURNING id
+            """,
+            owner_tg_id, str(chat_id), kind, json.dumps(params, ensure_ascii=False), batch_key, message_id,
+            int(time.time()),
+        )
+
+    async def start_link_job(self, job_id: int) -> None:
+        await self.pool.execute(
+            "UPDATE link_jobs SET status = 'running', started_at = $2 WHERE id = $1", job_id, int(time.time()),
+        )
+
+    async def finish_link_job(self, job_id: int) -> None:
+        await self.pool.execute("DELETE FROM link_jobs WHERE id = $1", job_id)
+
+    async def list_link_jobs(self) -> list[dict]:
+        rows = await self.pool.fetch(
+            """
+            SELECT id, owner_tg_id, chat_id, kind, params, batch_key, message_id, status, created_at, started_at
+            FROM link_jobs
+            ORDER BY id
+            """
+        )
+        out = [dict(r) for r in rows]
+        for r in out:
+            r["params"] = json.loads(r["params"])
+        return out
+
+    # ---- шаги диалогов ----
+
+    async def save_dialog_state(self, user_id: int, data: dict, expires_at: int) -> None:
+        await self.pool.execute(
+            """
+            INSERT INTO dialog_state (user_id, data, expires_at) VALUES ($1, $2, $3)
+            ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at
+            """,
+            user_id, json.dumps(data, ensure_ascii=False), expires_at,
+        )
+
+    async def delete_dialog_state(self, user_id: int) -> None:
+        await self.pool.execute("DELETE FROM dialog_state WHERE user_id = $1", user_id)
+
+    async def load_dialog_states(self, now: int) -> list[dict]:
+        rows = await self.pool.fetch(
+            "SELECT user_id, data, expires_at FROM dialog_state WHERE expires_at > $1 ORDER BY expires_at", now,
+        )
+        return [{"user_id": r["user_id"], "data": json.loads(r["data"]), "expires_at": r["expires_at"]} for r in rows]
+
+    async def purge_dialog_states(self, now: int) -> int:
+        status = await self.pool.execute("DELETE FROM dialog_state WHERE expires_at <= $1", now)
+        return int(status.split()[-1])
+
+    # ---- сводка по владельцу ----
+
+    async def get_owner_stats(self, owner_tg_id: int) -> Optional[dict]:
+        row = await self.pool.fetchrow(
+            _OWNER_STATS_SQL + " WHERE owner_tg_id = $1 GROUP BY owner_tg_id",
+            owner_tg_id,
+        )
+        return dict(row) if row else None
+
+    async def check_owner_stats(self) -> list[dict]:
+        # сводка всегда считается по invites — расходиться нечему
+        return []
+
+    async def rebuild_owner_stats(self) -> int:
+        return await self.pool.fetchval(
+            "SELECT COUNT(DISTINCT owner_tg_id) FROM invites WHERE owner_tg_id IS NOT NULL"
+        )
+
+    # ---- ссылки: чтение ----
+
+    async def get_invites_by_owner(self, owner_tg_id: int) -> list[dict]:
+        rows = await self.pool.fetch(
+            _INVITES_SELECT + " WHERE i.owner_tg_id = $1 ORDER BY i.date_created DESC",
+            owner_tg_id,
+        )
+        return [dict(r) for r in rows]
+
+    async def get_all_invites(self) -> list[dict]:
+        rows = await self.pool.fetch(_INVITES_SELECT + " ORDER BY i.date_created DESC")
+        return [dict(r) for r in rows]
+
+    async def _iter_invites(
+        self, where: str, params: tuple, chunk_size: int
+    ) -> AsyncIterator[list[dict]]:
+        # строки без date_created — отдельным проходом в конце (см. _iter_invites в services/db.py)
+        for dated in (True, False):
+            cursor: Optional[str | tuple[int, str]] = None
+            while True:
+                conds = [where] if where else []
+                args = list(params)
+                if dated:
+                    conds.append("i.date_created IS NOT NULL")
+                    if cursor is not None:
+                        conds.append(f"(i.date_created, i.link) < (${len(args) + 1}, ${len(args) + 2})")
+                        args.extend(cursor)
+                    order = "i.date_created DESC, i.link DESC"
+                else:
+                    conds.append("i.date_created IS NULL")
+                    if cursor is not None:
+                        conds.append(f"i.link < ${len(args) + 1}")
+                        args.append(cursor)
+                    order = "i.link DESC"
+                args.append(chunk_size)
+                sql = _INVITES_SELECT + " WHERE " + " AND ".join(conds) + f" ORDER BY {order} LIMIT ${len(args)}"
+                rows = await self.pool.fetch(sql, *args)
+                if not rows:
+                    break
+                chunk = [dict(r) for r in rows]
+                yield chunk
+                if len(rows) < chunk_size:
+                    break
+                last = chunk[-1]
+                cursor = (last["date_created"], last["link"]) if dated else last["link"]
+
+    async def iter_invites_by_owner(
+        self, owner_tg_id: int | None, chunk_size: int = 500
+    ) -> AsyncIterator[list[dict]]:
+        # IS NOT DISTINCT FROM индекс не использует — NULL разбираем отдельно
+        if owner_tg_id is None:
+            where, params = "i.owner_tg_id IS NULL", ()
+        else:
+            where, params = "i.owner_tg_id = $1", (owner_tg_id,)
+        async for chunk in self._iter_invites(where, params, chunk_size):
+            yield chunk
+
+    async def iter_all_invites(
+        self, chunk_size: int = 500, *, group_by_owner: bool = False
+    ) -> AsyncIterator[list[dict]]:
+        if not group_by_owner:
+            async for chunk in self._iter_invites("", (), chunk_size):
+                yield chunk
+            return
+        owners = [
+            r[0] for r in await self.pool.fetch(
+                "SELECT DISTINCT owner_tg_id FROM invites ORDER BY owner_tg_id NULLS LAST"
+            )
+        ]
+        for owner_tg_id in owners:
+            async for chunk in self.iter_invites_by_owner(owner_tg_id, chunk_size):
+                yield chunk
+
+    async def get_link(self, link: str) -> Optional[dict]:
+        row = await self.pool.fetchrow("SELECT * FROM invites WHERE link = $1", link)
+        return dict(row) if row else None
+
+    # ---- пользователи ----
+
+    async def upsert_user_basic(self, user: User) -> None:
+        await self.pool.execute(
+            """
+            INSERT INTO users (tg_id, username, first_name)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (tg_id) DO UPDATE SET
+                username   = EXCLUDED.username,
+                first_name = EXCLUDED.first_name
+            """,
+            user.id, user.username, user.first_name,
+        )
+
+    async def get_user(self, tg_id: int) -> Optional[dict]:
+        row = await self.pool.fetchrow("SELECT * FROM users WHERE tg_id = $1", tg_id)
+        return dict(row) if row else None
+
+    async def list_users(self, limit: int = 100, offset: int = 0) -> list[dict]:
+        rows = await self.pool.fetch(
+            "SELECT * FROM users ORDER BY tg_id LIMIT $1 OFFSET $2", limit, offset
+        )
+        return [dict(r) for r in rows]
+
+    async def delete_user(self, tg_id: int) -> None:
+        await self.pool.execute("DELETE FROM users WHERE tg_id = $1", tg_id)
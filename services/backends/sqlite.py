@@ -0,0 +1,44 @@
+# services/backends/sqlite.py
+"""
+Встроенный SQLite (функции services.db) за интерфейсом StorageBackend.
+
+services.db работает с SQLite напрямую и этот класс не использует; он нужен там,
+где бэкенды перебираются через один интерфейс — например, в общем наборе проверок
+(services/backends/conformance.py). Методы — те же SQLite-реализации, что стоят
+за публичными функциями services.db, поэтому состояние (соединения, отложенная
+запись, кэш) у них общее с модулем: одновременно живёт один SqliteBackend.
+"""
+from __future__ import annotations
+
+import abc
+import inspect
+
+from services import db
+from services.backends.base import StorageBackend
+
+
+class SqliteBackend(StorageBackend):
+
+    async def init(self) -> None:
+        await db._init_sqlite()
+
+    async def close(self) -> None:
+        await db._close_sqlite()
+
+
+def _delegate(name: str, impl):
+    if inspect.isasyncgenfunction(impl):
+        async def method(self, *args, **kwargs):
+            async for item in impl(*args, **kwargs):
+                yield item
+    else:
+        async def method(self, *args, **kwargs):
+            return await impl(*args, **kwargs)
+    method.__name__ = method.__qualname__ = name
+    method.__doc__ = impl.__doc__
+    return method
+
+
+for _name, _impl in db._sqlite_api.items():
+    setattr(SqliteBackend, _name, _delegate(_name, _impl))
+abc.update_abstractmethods(SqliteBackend)
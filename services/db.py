@@ -2,237 +2,1722 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import functools
+import inspect
+import json
+import logging
 import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Iterable
+from typing import Optional, Iterable, AsyncIterator, TYPE_CHECKING
 from telethon.tl.types import User
 
 import aiosqlite
 from telethon.tl import types
 from config import settings  # путь к базе берём из настроек
 
+if TYPE_CHECKING:
+    from services.backends import StorageBackend
+
 # Путь к БД и подготовка директории
 DB_PATH = Path(settings.db_path)
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
+# Запись идёт через одно соединение и сериализуется этим локом.
+# Чтение — через пул read-only соединений (WAL позволяет читать параллельно с записью).
 _lock = asyncio.Lock()
 _conn: Optional[aiosqlite.Connection] = None
 
+_readers: Optional[asyncio.Queue[aiosqlite.Connection]] = None
+_readers_all: list[aiosqlite.Connection] = []
+_readers_lock = asyncio.Lock()
+
+# Внешний бэкенд (DB_BACKEND != sqlite). None — работаем со встроенным SQLite ниже.
+_backend: Optional["StorageBackend"] = None
+
+# имя -> SQLite-реализация публичной функции (её же отдаёт SqliteBackend)
+_sqlite_api: dict[str, object] = {}
+
+
+def _backend_api(func):
+    """
+    Публичная функция хранилища: если настроен внешний бэкенд,
+    вызов уходит в его одноимённый метод, иначе выполняется SQLite-реализация.
+    """
+    name = func.__name__
+    _sqlite_api[name] = func
+
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def gen_wrapper(*args, **kwargs):
+            impl = getattr(_backend, name) if _backend is not None else func
+            async for item in impl(*args, **kwargs):
+                yield item
+        return gen_wrapper
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if _backend is not None:
+            return await getattr(_backend, name)(*args, **kwargs)
+        return await func(*args, **kwargs)
+    return wrapper
+
 
 # --------------------------- Core ---------------------------
 
 async def connect() -> aiosqlite.Connection:
     """
-    Открыть соединение с базой (singleton).
+    Открыть соединение-писатель (singleton).
+    """
+    global _conn
+    if _conn is None:
+        _conn = await aiosqlite.connect(DB_PATH)
+        _conn.row_factory = aiosqlite.Row   # удобное преобразование в dict
+        await _conn.execute("PRAGMA journal_mode=WAL;")
+        await _conn.execute("PRAGMA synchronous=NORMAL;")
+        await _apply_tuning(_conn)
+    return _conn
+
+
+async def _apply_tuning(conn: aiosqlite.Connection) -> None:
+    """Общие для писателя и читателей настройки кэша страниц / mmap / временных таблиц."""
+    await conn.execute(f"PRAGMA cache_size={int(settings.db_cache_size_kb) * -1};")   # <0 — в KiB
+    await conn.execute(f"PRAGMA mmap_size={int(settings.db_mmap_size)};")
+    await conn.execute(f"PRAGMA temp_store={settings.db_temp_store.upper()};")
+
+
+async def _open_reader() -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(DB_PATH)
+    conn.row_factory = aiosqlite.Row
+    # страховка: через читателя ничего не запишем даже по ошибке
+    await conn.execute("PRAGMA query_only=ON;")
+    await _apply_tuning(conn)
+    return conn
+
+
+async def _init_readers() -> asyncio.Queue[aiosqlite.Connection]:
+    global _readers
+    async with _readers_lock:
+        if _readers is None:
+            # писатель должен открыться первым — он переводит базу в WAL
+            await connect()
+            size = max(1, settings.db_read_pool_size)
+            queue: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+            for _ in range(size):
+                conn = await _open_reader()
+                _readers_all.append(conn)
+                queue.put_nowait(conn)
+            _readers = queue
+    return _readers
+
+
+@contextlib.asynccontextmanager
+async def _reader() -> AsyncIterator[aiosqlite.Connection]:
+    """
+    Взять соединение-читатель из пула (лок писателя не берётся).
+    Если свободных нет — ждём, пока кто-то вернёт.
+    """
+    queue = _readers if _readers is not None else await _init_readers()
+    conn = await queue.get()
+    try:
+        yield conn
+    finally:
+        queue.put_nowait(conn)
+
+
+async def close_db() -> None:
+    """
+    Закрыть соединения (опционально вызывать при завершении приложения).
+    Перед закрытием сбрасывает отложенные записи.
+    """
+    global _backend
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
+        return
+    await _close_sqlite()
+
+
+async def _close_sqlite() -> None:
+    global _conn, _readers
+    await _write_behind.close()
+    async with _readers_lock:
+        for conn in _readers_all:
+            await conn.close()
+        _readers_all.clear()
+        _readers = None
+    if _conn is not None:
+        with contextlib.suppress(Exception):
+            await _conn.execute("PRAGMA optimize;")
+        await _conn.close()
+        _conn = None
+    _owner_cache.clear()
+
+
+async def init_db() -> None:
+    """
+    Подготовить хранилище: выбрать бэкенд по settings.db_backend и создать схему.
+    """
+    global _backend
+    from services.backends import create_backend
+
+    backend = create_backend(settings.db_backend)
+    if backend is not None:
+        await backend.init()
+        _backend = backend
+        return
+    await _init_sqlite()
+
+
+async def _init_sqlite() -> None:
+    conn = await connect()
+    async with _lock:
+        # включим внешние ключи на всякий случай
+        await conn.execute("PRAGMA foreign_keys=ON;")
+
+        # users
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                tg_id      INTEGER PRIMARY KEY,
+                username   TEXT,
+                first_name TEXT
+            )
+        """)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+
+        # invites (как у тебя)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS invites (
+                link TEXT PRIMARY KEY,
+                chat_id TEXT NOT NULL,
+                owner_tg_id INTEGER,
+                title TEXT,
+                date_created INTEGER,
+                expire_date INTEGER,
+                usage_limit INTEGER,
+                request_needed INTEGER,
+                usage INTEGER DEFAULT 0,
+                approved_request_count INTEGER DEFAULT 0,
+                revoked INTEGER DEFAULT 0,
+                last_synced_at INTEGER
+            )
+        """)
+        # индексы под реальные запросы (проверяются scripts/check_query_plans.py):
+        # - владелец + сортировка/keyset по (date_created, link): get_invites_by_owner, iter_invites_by_owner
+        # - общий keyset по (date_created, link): iter_all_invites
+        # - покрывающий по чату для отпечатков дельта-синка: get_invite_fingerprints
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invites_owner_created ON invites(owner_tg_id, date_created, link)"
+        )
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invites_created_link  ON invites(date_created, link)"
+        )
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invites_chat_fp       "
+            "ON invites(chat_id, link, usage, approved_request_count, revoked, expire_date)"
+        )
+        # старые одноколоночные индексы перекрыты составными выше; по last_synced_at никто не ищет,
+        # а индекс переписывался на каждом синке
+        for old in ("idx_invites_owner", "idx_invites_chat", "idx_invites_created", "idx_invites_synced"):
+            await conn.execute(f"DROP INDEX IF EXISTS {old}")
+
+        # штамп последней успешной синхронизации по чату
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_sync (
+                chat_id        TEXT PRIMARY KEY,
+                last_synced_at INTEGER
+            )
+        """)
+
+        # позиция незаконченного полного прохода по чату (для продолжения после сбоя/рестарта)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_cursors (
+                chat_id     TEXT PRIMARY KEY,
+                revoked     INTEGER NOT NULL DEFAULT 0,   -- какой список листаем: активные / отозванные
+                offset_date INTEGER,
+                offset_link TEXT,
+                pages       INTEGER NOT NULL DEFAULT 0,
+                started_at  INTEGER,
+                updated_at  INTEGER,
+                admin_id    INTEGER                        -- чей список листаем (аккаунт пула), NULL — свой
+            )
+        """)
+
+        # реестр чатов для синхронизации и статус последнего прохода по каждому
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_chats (
+                chat_id          TEXT PRIMARY KEY,
+                title            TEXT,
+                enabled          INTEGER NOT NULL DEFAULT 1,
+                include_revoked  INTEGER NOT NULL DEFAULT 0,
+                added_at         INTEGER,
+                last_run_at      INTEGER,
+                last_ok_at       INTEGER,
+                last_duration_ms INTEGER,
+                last_pages       INTEGER,
+                last_links       INTEGER,
+                last_changed     INTEGER,
+                errors           INTEGER NOT NULL DEFAULT 0,   -- ошибок подряд
+                last_error       TEXT
+            )
+        """)
+
+        # запас заранее созданных ссылок: выдаются оператору без ожидания ExportChatInviteRequest
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS invite_pool (
+                link           TEXT PRIMARY KEY,
+                chat_id        TEXT NOT NULL,
+                title          TEXT,
+                date_created   INTEGER,
+                expire_date    INTEGER,
+                usage_limit    INTEGER,
+                request_needed INTEGER,
+                pooled_at      INTEGER NOT NULL,
+                admin_id       INTEGER            -- аккаунт, создавший ссылку (переименовать может только он)
+            )
+        """)
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invite_pool_chat ON invite_pool(chat_id, pooled_at, link)"
+        )
+
+        # пачки ссылок оператору: каждая созданная ссылка пишется сразу, повтор запроса
+        # с тем же ключом продолжает пачку (services/link_batches.py)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS link_batches (
+                batch_key   TEXT PRIMARY KEY,   -- ключ идемпотентности: оператор + параметры запроса
+                owner_tg_id INTEGER NOT NULL,
+                chat_id     TEXT NOT NULL,
+                titles      TEXT NOT NULL,      -- JSON: название на каждую ссылку, в порядке выдачи
+                created_at  INTEGER NOT NULL,
+                updated_at  INTEGER NOT NULL
+            )
+        """)
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_link_batches_updated ON link_batches(updated_at)"
+        )
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS link_batch_items (
+                batch_key TEXT    NOT NULL,
+                idx       INTEGER NOT NULL,
+                link      TEXT    NOT NULL,
+                PRIMARY KEY (batch_key, idx)
+            ) WITHOUT ROWID
+        """)
+
+        # очередь заданий на создание ссылок (services/link_jobs.py): переживает рестарт
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS link_jobs (
+                id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner_tg_id INTEGER NOT NULL,
+                chat_id     TEXT NOT NULL,
+                kind        TEXT NOT NULL,      -- no_title / titles / mask
+                params      TEXT NOT NULL,      -- JSON параметров запроса
+                batch_key   TEXT NOT NULL,      -- пачка ссылок задания (link_batches)
+                message_id  INTEGER,            -- сообщение бота со статусом задания
+                status      TEXT NOT NULL DEFAULT 'queued',   -- queued / running
+                created_at  INTEGER NOT NULL,
+                started_at  INTEGER
+            )
+        """)
+
+        # шаги диалогов с ботом (services/dialog_state.py), если их надо пережить рестарт
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS dialog_state (
+                user_id    INTEGER PRIMARY KEY,
+                data       TEXT NOT NULL,       -- JSON: режим, шаг, id сообщений
+                expires_at INTEGER NOT NULL
+            )
+        """)
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_dialog_state_expires ON dialog_state(expires_at)"
+        )
+
+        # колонки, появившиеся позже своих таблиц: CREATE TABLE IF NOT EXISTS в старую базу их не добавит
+        for table, column, decl in (("sync_cursors", "admin_id", "INTEGER"), ("invite_pool", "admin_id", "INTEGER")):
+            cur = await conn.execute(f"PRAGMA table_info({table})")
+            if column not in {row[1] for row in await cur.fetchall()}:
+                await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+        # история приростов счётчиков (только изменения, целые дельты).
+        # granularity: 0 — сырая точка, 3600 — часовая корзина, 86400 — суточная; ts — начало корзины
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS invite_stats_history (
+                link        TEXT    NOT NULL,
+                ts          INTEGER NOT NULL,
+                granularity INTEGER NOT NULL DEFAULT 0,
+                d_usage     INTEGER NOT NULL DEFAULT 0,
+                d_approved  INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (link, ts, granularity)
+            ) WITHOUT ROWID
+        """)
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_history_gran_ts ON invite_stats_history(granularity, ts)"
+        )
+
+        # сводка по владельцу; поддерживается триггерами на invites
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS owner_stats (
+                owner_tg_id   INTEGER PRIMARY KEY,
+                links         INTEGER NOT NULL DEFAULT 0,
+                usage         INTEGER NOT NULL DEFAULT 0,
+                approved      INTEGER NOT NULL DEFAULT 0,
+                revoked       INTEGER NOT NULL DEFAULT 0,
+                last_activity INTEGER
+            )
+        """)
+        await conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_owner_stats_ins AFTER INSERT ON invites
+            WHEN NEW.owner_tg_id IS NOT NULL
+            BEGIN
+                INSERT INTO owner_stats (owner_tg_id, links, usage, approved, revoked, last_activity)
+                VALUES (
+                    NEW.owner_tg_id, 1, COALESCE(NEW.usage, 0), COALESCE(NEW.approved_request_count, 0),
+                    COALESCE(NEW.revoked, 0), COALESCE(NEW.last_synced_at, NEW.date_created)
+                )
+                ON CONFLICT(owner_tg_id) DO UPDATE SET
+                    links         = links + 1,
+                    usage         = usage + excluded.usage,
+                    approved      = approved + excluded.approved,
+                    revoked       = revoked + excluded.revoked,
+                    last_activity = MAX(COALESCE(last_activity, 0), COALESCE(excluded.last_activity, 0));
+            END
+        """)
+        await conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_owner_stats_del AFTER DELETE ON invites
+            WHEN OLD.owner_tg_id IS NOT NULL
+            BEGIN
+                UPDATE owner_stats SET
+                    links    = links - 1,
+                    usage    = usage - COALESCE(OLD.usage, 0),
+                    approved = approved - COALESCE(OLD.approved_request_count, 0),
+                    revoked  = revoked - COALESCE(OLD.revoked, 0)
+                WHERE owner_tg_id = OLD.owner_tg_id;
+            END
+        """)
+        # на UPDATE: вычесть старую версию строки у старого владельца, прибавить новую — у нового
+        await conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_owner_stats_upd
+            AFTER UPDATE OF owner_tg_id, usage, approved_request_count, revoked ON invites
+            BEGIN
+                UPDATE owner_stats SET
+                    links    = links - 1,
+                    usage    = usage - COALESCE(OLD.usage, 0),
+                    approved = approved - COALESCE(OLD.approved_request_count, 0),
+                    revoked  = revoked - COALESCE(OLD.revoked, 0)
+                WHERE OLD.owner_tg_id IS NOT NULL AND owner_tg_id = OLD.owner_tg_id;
+
+                INSERT INTO owner_stats (owner_tg_id, links, usage, approved, revoked, last_activity)
+                SELECT
+                    NEW.owner_tg_id, 1, COALESCE(NEW.usage, 0), COALESCE(NEW.approved_request_count, 0),
+                    COALESCE(NEW.revoked, 0),
+                    CASE
+                        WHEN NEW.owner_tg_id IS NOT OLD.owner_tg_id
+                          OR NEW.usage IS NOT OLD.usage
+                          OR NEW.approved_request_count IS NOT OLD.approved_request_count
+                        THEN CAST(strftime('%s', 'now') AS INTEGER)
+                    END
+                WHERE NEW.owner_tg_id IS NOT NULL
+                ON CONFLICT(owner_tg_id) DO UPDATE SET
+                    links         = links + 1,
+                    usage         = usage + excluded.usage,
+                    approved      = approved + excluded.approved,
+                    revoked       = revoked + excluded.revoked,
+                    last_activity = MAX(COALESCE(last_activity, 0), COALESCE(excluded.last_activity, 0));
+            END
+        """)
+        await conn.commit()
+
+    # статистики планировщика ещё нет (новая база / новые индексы) — собрать сразу
+    async with _reader() as rconn:
+        cur = await rconn.execute(
+            "SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1')"
+        )
+        has_stat = (await cur.fetchone())[0]
+    if not has_stat:
+        await optimize_db(analyze=True)
+
+    # первая инициализация (или таблица появилась на уже заполненной базе) — посчитать с нуля
+    async with _reader() as rconn:
+        cur = await rconn.execute("SELECT EXISTS(SELECT 1 FROM owner_stats)")
+        has_stats = (await cur.fetchone())[0]
+    if not has_stats:
+        await rebuild_owner_stats()
+
+
+
+async def optimize_db(analyze: bool = False) -> None:
+    """
+    Обновить статистику планировщика: PRAGMA optimize (дёшево, перепроверяет только то,
+    что заметно изменилось) или полный ANALYZE при analyze=True.
+    Вызывается планировщиком периодически и при закрытии базы.
+    """
+    if _backend is not None:
+        return
+    conn = await connect()
+    async with _lock:
+        if analyze:
+            await conn.execute("ANALYZE;")
+        else:
+            await conn.execute("PRAGMA optimize;")
+        await conn.commit()
+
+
+# --------------------------- Helpers ---------------------------
+
+def _ts(dt_obj) -> Optional[int]:
+    """Безопасно конвертировать datetime -> int (unix)."""
+    if not dt_obj:
+        return None
+    try:
+        return int(dt_obj.timestamp())
+    except Exception:
+        return None
+
+
+def _rows_to_dicts(rows: list[aiosqlite.Row]) -> list[dict]:
+    return [dict(r) for r in rows]
+
+
+# --------------------------- Owner cache ---------------------------
+
+class _OwnerCache:
+    """
+    LRU-кэш результатов get_invites_by_owner (ключ — owner_tg_id).
+    Запись считается устаревшей, если:
+    - её сбросила функция записи (по владельцу или по ссылке),
+    - изменилась версия данных любого чата, чьи ссылки в ней лежат (bump_chat_version).
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max(0, max_size)
+        # owner -> (версии чатов на момент чтения, строки)
+        self._data: OrderedDict[int, tuple[dict[str, int], list[dict]]] = OrderedDict()
+        self._link_owner: dict[str, int] = {}   # link -> owner, только для закэшированных строк
+        self._chat_versions: dict[str, int] = {}
+        self._epoch = 0                          # растёт на каждую инвалидацию
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch
+
+    def get(self, owner_tg_id: int) -> Optional[list[dict]]:
+        entry = self._data.get(owner_tg_id)
+        if entry is not None:
+            versions, rows = entry
+            if all(self._chat_versions.get(c, 0) == v for c, v in versions.items()):
+                self._data.move_to_end(owner_tg_id)
+                self.hits += 1
+                return rows
+            self._drop(owner_tg_id)
+        self.misses += 1
+        return None
+
+    def put(self, owner_tg_id: int, rows: list[dict], epoch: int) -> None:
+        # пока читали, что-то записали — такой результат мог уже устареть
+        if self.max_size == 0 or epoch != self._epoch:
+            return
+        self._drop(owner_tg_id)
+        versions = {r["chat_id"]: self._chat_versions.get(r["chat_id"], 0) for r in rows}
+        self._data[owner_tg_id] = (versions, rows)
+        for r in rows:
+            self._link_owner[r["link"]] = owner_tg_id
+        while len(self._data) > self.max_size:
+            oldest = next(iter(self._data))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def invalidate_owners(self, owners: Iterable[Optional[int]]) -> None:
+        self._epoch += 1
+        for owner_tg_id in owners:
+            if owner_tg_id is not None:
+                self._drop(owner_tg_id)
+
+    def invalidate_links(self, links: Iterable[str]) -> None:
+        self._epoch += 1
+        for link in links:
+            owner_tg_id = self._link_owner.get(link)
+            if owner_tg_id is not None:
+                self._drop(owner_tg_id)
+
+    def bump_chat(self, chat_id: int | str) -> None:
+        self._epoch += 1
+        key = str(chat_id)
+        self._chat_versions[key] = self._chat_versions.get(key, 0) + 1
+
+    def clear(self) -> None:
+        self._epoch += 1
+        self._data.clear()
+        self._link_owner.clear()
+
+    def _drop(self, owner_tg_id: int) -> None:
+        entry = self._data.pop(owner_tg_id, None)
+        if entry is not None:
+            for r in entry[1]:
+                if self._link_owner.get(r["link"]) == owner_tg_id:
+                    del self._link_owner[r["link"]]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_owner_cache = _OwnerCache(settings.db_owner_cache_size)
+
+
+def bump_chat_version(chat_id: int | str) -> None:
+    """
+    Отметить, что данные чата изменились (например, после цикла синхронизации):
+    все закэшированные выборки со ссылками этого чата станут невалидными.
+    """
+    _owner_cache.bump_chat(chat_id)
+
+
+def get_owner_cache_stats() -> dict:
+    """Счётчики кэша get_invites_by_owner: size, max_size, hits, misses, hit_rate, evictions."""
+    return _owner_cache.stats()
+
+
+# --------------------------- Write-behind ---------------------------
+
+_UPSERT_INVITE_SQL = """
+    INSERT INTO invites (
+      link, chat_id, owner_tg_id, title, date_created, expire_date,
+      usage_limit, request_needed, usage, approved_request_count, revoked, last_synced_at
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(link) DO UPDATE SET
+      owner_tg_id             = COALESCE(owner_tg_id, excluded.owner_tg_id),   -- ничья ссылка (синк, запас) получает владельца
+      title                   = COALESCE(excluded.title, title),
+      expire_date             = COALESCE(excluded.expire_date, expire_date),
+      usage_limit             = COALESCE(excluded.usage_limit, usage_limit),
+      request_needed          = excluded.request_needed,
+      usage                   = MAX(usage, excluded.usage),
+      approved_request_count  = MAX(approved_request_count, excluded.approved_request_count),
+      revoked                 = excluded.revoked,
+      last_synced_at          = excluded.last_synced_at   -- всегда обновляем штамп синхронизации
+"""
+
+# прирост по странице синка считается от строки в базе в той же транзакции, а не от отпечатка
+# начала прохода: вступления, уже досчитанные по апдейтам (add_invite_joins), второй раз не попадут.
+# Незнакомые ссылки (первое появление) в историю не идут
+_SYNC_HISTORY_SQL = """
+    INSERT INTO invite_stats_history (link, ts, granularity, d_usage, d_approved)
+    SELECT link, ?, 0, MAX(? - usage, 0), MAX(? - approved_request_count, 0)
+    FROM invites
+    WHERE link = ? AND (usage < ? OR approved_request_count < ?)
+    ON CONFLICT(link, ts, granularity) DO UPDATE SET
+        d_usage    = d_usage    + excluded.d_usage,
+        d_approved = d_approved + excluded.d_approved
+"""
+
+_ADD_JOINS_SQL = """
+    UPDATE invites
+    SET usage                  = usage + ?,
+        approved_request_count = approved_request_count + ?
+    WHERE link = ?
+"""
+
+# приросты по апдейтам — в историю только для известных ссылок
+_ADD_JOINS_HISTORY_SQL = """
+    INSERT INTO invite_stats_history (link, ts, granularity, d_usage, d_approved)
+    SELECT ?, ?, 0, ?, ? WHERE EXISTS (SELECT 1 FROM invites WHERE link = ?)
+    ON CONFLICT(link, ts, granularity) DO UPDATE SET
+        d_usage    = d_usage    + excluded.d_usage,
+        d_approved = d_approved + excluded.d_approved
+"""
+
+_UPDATE_COUNTERS_SQL = """
+    UPDATE invites
+    SET usage                  = MAX(usage, ?),
+        approved_request_count = MAX(approved_request_count, ?),
+        revoked                = ?,
+        last_synced_at         = ?
+    WHERE link = ?
+"""
+
+_UPSERT_USER_SQL = """
+    INSERT INTO users (tg_id, username, first_name)
+    VALUES (?, ?, ?)
+    ON CONFLICT(tg_id) DO UPDATE SET
+        username   = excluded.username,
+        first_name = excluded.first_name
+"""
+
+# индексы полей в кортеже _invite_params (порядок как в _UPSERT_INVITE_SQL)
+_I_OWNER, _I_TITLE, _I_DATE, _I_EXPIRE, _I_LIMIT = 2, 3, 4, 5, 6
+_I_USAGE, _I_APPROVED, _I_REVOKED, _I_SYNCED = 8, 9, 10, 11
+
+
+class _WriteBehind:
+    """
+    Очередь отложенной записи: мелкие апсерты (пользователи, ссылки, счётчики,
+    вступления по апдейтам) копятся в памяти, повторы по одному tg_id / link склеиваются
+    (вступления — суммируются),
+    и всё пишется одной транзакцией — когда набралось max_pending ключей
+    или прошло flush_sec с первого несброшенного изменения.
+    """
+
+    def __init__(self, max_pending: int, flush_sec: float) -> None:
+        self.max_pending = max(1, max_pending)
+        self.flush_sec = max(0.0, flush_sec)
+        self.users: dict[int, tuple] = {}
+        self.invites: dict[str, tuple] = {}
+        self.counters: dict[str, tuple] = {}   # link -> (usage, approved, revoked, ts)
+        self.joins: dict[str, tuple] = {}      # link -> (d_usage, d_approved, ts первого)
+        self.queued = 0       # сколько записей пришло
+        self.commits = 0      # сколько транзакций ушло в базу
+        self._pending = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.users) + len(self.invites) + len(self.counters) + len(self.joins)
+
+    # ---- постановка в очередь ----
+
+    def put_user(self, params: tuple) -> None:
+        self.users[params[0]] = params
+        self._touch()
+
+    def put_invite(self, params: tuple) -> None:
+        link = params[0]
+        prev = self.invites.get(link)
+        if prev is not None:
+            params = _merge_invite_params(prev, params)
+        cnt = self.counters.pop(link, None)
+        if cnt is not None:
+            # отложенные счётчики по этой ссылке старше — забираем только максимумы
+            params = list(params)
+            params[_I_USAGE] = max(params[_I_USAGE], cnt[0])
+            params[_I_APPROVED] = max(params[_I_APPROVED], cnt[1])
+            params = tuple(params)
+        self.invites[link] = params
+        self._touch()
+
+    def put_counters(self, link: str, usage: int, approved: int, revoked: int, ts: int) -> None:
+        inv = self.invites.get(link)
+        if inv is not None:
+            # ссылка ещё не записана — вливаем счётчики прямо в её апсерт
+            merged = list(inv)
+            merged[_I_USAGE] = max(merged[_I_USAGE], usage)
+            merged[_I_APPROVED] = max(merged[_I_APPROVED], approved)
+            merged[_I_REVOKED] = revoked
+            merged[_I_SYNCED] = ts
+            self.invites[link] = tuple(merged)
+        else:
+            prev = self.counters.get(link)
+            if prev is not None:
+                usage, approved = max(prev[0], usage), max(prev[1], approved)
+            self.counters[link] = (usage, approved, revoked, ts)
+        self._touch()
+
+    def put_joins(self, link: str, d_usage: int, d_approved: int, ts: int) -> None:
+        prev = self.joins.get(link)
+        if prev is not None:
+            d_usage, d_approved, ts = prev[0] + d_usage, prev[1] + d_approved, prev[2]
+        self.joins[link] = (d_usage, d_approved, ts)
+        self._touch()
+
+    def drop_invite(self, link: str) -> None:
+        self.invites.pop(link, None)
+        self.counters.pop(link, None)
+        self.joins.pop(link, None)
+
+    def drop_user(self, tg_id: int) -> None:
+        self.users.pop(tg_id, None)
+
+    def _touch(self) -> None:
+        self.queued += 1
+        self._pending.set()
+        if len(self) >= self.max_pending:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="db_write_behind")
+
+    # ---- сброс ----
+
+    async def _run(self) -> None:
+        log = logging.getLogger("app")
+        while True:
+            await self._pending.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_sec)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception(f"[db] ошибка отложенной записи: {e}")
+                await asyncio.sleep(self.flush_sec or 1.0)
+
+    async def flush(self) -> None:
+        if not len(self):
+            self._pending.clear()
+            self._full.clear()
+            return
+        conn = await connect()
+        async with _lock:
+            await self.flush_locked(conn)
+
+    async def flush_locked(self, conn: aiosqlite.Connection) -> None:
+        """
+        Сбросить очередь отдельной транзакцией; вызывается под _lock. Прямые записи в invites
+        зовут его перед своей: иначе более старые отложенные значения лягут поверх их свежих.
+        """
+        users, invites, counters, joins = self.users, self.invites, self.counters, self.joins
+        self.users, self.invites, self.counters, self.joins = {}, {}, {}, {}
+        self._pending.clear()
+        self._full.clear()
+        if not (users or invites or counters or joins):
+            return
+        try:
+            if users:
+                await conn.executemany(_UPSERT_USER_SQL, users.values())
+            if invites:
+                await conn.executemany(_UPSERT_INVITE_SQL, invites.values())
+            if counters:
+                await conn.executemany(
+                    _UPDATE_COUNTERS_SQL,
+                    [(u, a, r, ts, link) for link, (u, a, r, ts) in counters.items()],
+                )
+            if joins:
+                # приросты — после апсертов и абсолютных счётчиков: прибавляются к уже записанному
+                await conn.executemany(
+                    _ADD_JOINS_SQL, [(du, da, link) for link, (du, da, _) in joins.items()]
+                )
+                await conn.executemany(
+                    _ADD_JOINS_HISTORY_SQL,
+                    [(link, ts, du, da, link) for link, (du, da, ts) in joins.items()],
+                )
+            await conn.commit()
+        except BaseException:
+            # недописанное откатываем, пока держим замок: иначе его закоммитит следующий писатель,
+            # а повторный сброс прибавит вступления второй раз
+            with contextlib.suppress(Exception):
+                await conn.rollback()
+            # вернуть несохранённое, не перетирая то, что успело прийти новее
+            for k, v in users.items():
+                self.users.setdefault(k, v)
+            for k, v in invites.items():
+                self.invites.setdefault(k, v)
+            for k, v in counters.items():
+                self.counters.setdefault(k, v)
+            for k, (du, da, ts) in joins.items():
+                prev = self.joins.get(k)
+                self.joins[k] = (du + prev[0], da + prev[1], ts) if prev else (du, da, ts)
+            if len(self):
+                self._pending.set()
+            raise
+        self.commits += 1
+        _owner_cache.invalidate_owners(users.keys())
+        _owner_cache.invalidate_links([*invites.keys(), *counters.keys(), *joins.keys()])
+        _owner_cache.invalidate_owners(p[_I_OWNER] for p in invites.values())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.flush()
+
+
+def _merge_invite_params(prev: tuple, new: tuple) -> tuple:
+    """Склеить два отложенных апсерта одной ссылки так же, как это сделал бы ON CONFLICT."""
+    merged = list(new)
+    # владелец и дата создания при конфликте не меняются — остаются от первой вставки
+    if prev[_I_OWNER] is not None:
+        merged[_I_OWNER] = prev[_I_OWNER]
+    merged[_I_DATE] = prev[_I_DATE]
+    for i in (_I_TITLE, _I_EXPIRE, _I_LIMIT):
+        if merged[i] is None:
+            merged[i] = prev[i]
+    merged[_I_USAGE] = max(prev[_I_USAGE], new[_I_USAGE])
+    merged[_I_APPROVED] = max(prev[_I_APPROVED], new[_I_APPROVED])
+    return tuple(merged)
+
+
+_write_behind = _WriteBehind(settings.db_write_batch_size, settings.db_write_flush_sec)
+
+
+@_backend_api
+async def flush_writes() -> None:
+    """Сбросить отложенные записи в базу прямо сейчас (если нужно прочитать только что записанное)."""
+    await _write_behind.flush()
+
+
+def get_write_stats() -> dict:
+    """Счётчики отложенной записи: сколько изменений пришло, сколько коммитов ушло, сколько ждёт."""
+    return {
+        "queued": _write_behind.queued,
+        "commits": _write_behind.commits,
+        "pending": len(_write_behind),
+    }
+
+
+# --------------------------- Insert / Upsert ---------------------------
+
+def _invite_params(
+    exported: types.ChatInviteExported,
+    chat_id: int | str,
+    owner_tg_id: int | None,
+    now: int,
+) -> Optional[tuple]:
+    link = getattr(exported, "link", None)
+    if not link:
+        return None
+    return (
+        link,
+        str(chat_id),
+        owner_tg_id,
+        getattr(exported, "title", None),
+        _ts(getattr(exported, "date", None)) or now,
+        _ts(getattr(exported, "expire_date", None)),
+        getattr(exported, "usage_limit", None),
+        1 if getattr(exported, "request_needed", False) else 0,
+        getattr(exported, "usage", 0) or 0,
+        getattr(exported, "approved_request_count", 0) or 0,
+        1 if getattr(exported, "revoked", False) else 0,
+        now,   # last_synced_at
+    )
+
+
+@_backend_api
+async def insert_invite_from_exported(
+    exported: types.ChatInviteExported,   # или types.ExportedChatInvite в другой версии
+    chat_id: int | str,
+    owner_tg_id: int,
+) -> None:
+    """
+    Сохранить ссылку напрямую из ChatInviteExported.
+    last_synced_at обновляется КАЖДЫЙ раз.
+    ON CONFLICT(link) — обновляем ключевые поля и счётчики.
+    Запись отложенная (см. _WriteBehind): в базе появится при ближайшем сбросе.
+    """
+    params = _invite_params(exported, chat_id, owner_tg_id, int(time.time()))
+    if params is None:
+        return
+    _write_behind.put_invite(params)
+
+
+@_backend_api
+async def insert_many_from_exported(
+    exported_list: Iterable[types.ChatInviteExported],
+    chat_id: int | str,
+    owner_tg_id: int,
+) -> None:
+    """
+    Пакетная вставка ссылок (одной транзакцией) для одного пользователя.
+    last_synced_at обновляется у каждой строки.
+    Пишет сразу, в обход отложенной очереди.
+    """
+    now = int(time.time())
+    params = [
+        p for p in (_invite_params(e, chat_id, owner_tg_id, now) for e in exported_list)
+        if p is not None
+    ]
+    if not params:
+        return
+
+    conn = await connect()
+    async with _lock:
+        await _write_behind.flush_locked(conn)
+        await conn.executemany(_UPSERT_INVITE_SQL, params)
+        await conn.commit()
+    _owner_cache.invalidate_owners([owner_tg_id])
+    _owner_cache.invalidate_links(p[0] for p in params)
+
+
+# --------------------------- Delta sync ---------------------------
+
+def invite_fingerprint(exported: types.ChatInviteExported) -> tuple[int, int, int, int | None]:
+    """
+    Отпечаток ссылки для дельта-синка: (usage, approved_request_count, revoked, expire_date).
+    Совпадает с тем, что get_invite_fingerprints читает из базы.
+    """
+    return (
+        getattr(exported, "usage", 0) or 0,
+        getattr(exported, "approved_request_count", 0) or 0,
+        1 if getattr(exported, "revoked", False) else 0,
+        _ts(getattr(exported, "expire_date", None)),
+    )
+
+
+@_backend_api
+async def get_invite_fingerprints(chat_id: int | str) -> dict[str, tuple[int, int, int, int | None]]:
+    """Отпечатки всех ссылок чата из базы: link -> (usage, approved, revoked, expire_date)."""
+    async with _reader() as conn:
+        cur = await conn.execute(
+            """
+            SELECT link, usage, approved_request_count, revoked, expire_date
+            FROM invites
+            WHERE chat_id = ?
+            """,
+            (str(chat_id),),
+        )
+        rows = await cur.fetchall()
+    return {r[0]: (r[1] or 0, r[2] or 0, r[3] or 0, r[4]) for r in rows}
+
+
+@_backend_api
+async def save_sync_delta(
+    changed: Iterable[types.ChatInviteExported],
+    chat_id: int | str,
+    owner_tg_id: int | None = None,
+    chat_synced: bool = True,
+    cursor: Optional[tuple[bool, Optional[int], Optional[str], Optional[int]]] = None,
+    owners: Optional[dict[str, int]] = None,
+) -> int:
+    """
+    Записать результат цикла синхронизации одной транзакцией:
+    апсерт только изменившихся ссылок
+    + один штамп синхронизации на чат (chat_sync)
+    + приросты счётчиков в invite_stats_history — от значений в базе на момент записи.
+    Счётчики Telegram только растут, поэтому берётся максимум: страница, запрошенная до
+    вступления, уже досчитанного по апдейтам, его не откатит.
+    chat_synced=False — частичное обновление (страница прохода, горячие ссылки): штамп чата не трогаем.
+    cursor=(revoked, offset_date, offset_link, admin_id) — позиция следующей страницы, пишется в той же
+    транзакции (см. get_sync_cursor); chat_synced=True — проход закончен, позиция удаляется.
+    owners — link -> владелец для отдельных ссылок (вместо owner_tg_id); как и owner_tg_id,
+    достаётся только ссылкам, у которых владельца ещё нет.
+    Возвращает число записанных ссылок.
+    """
+    now = int(time.time())
+    owners = owners or {}
+    params = [
+        p for p in (
+            _invite_params(e, chat_id, owners.get(getattr(e, "link", None), owner_tg_id), now) for e in changed
+        )
+        if p is not None
+    ]
+    conn = await connect()
+    async with _lock:
+        # отложенное по этим ссылкам (и вступления) — раньше страницы: прирост считается поверх него
+        await _write_behind.flush_locked(conn)
+        if params:
+            # история — до апсерта: прирост считается от ещё не перезаписанной строки
+            await conn.executemany(
+                _SYNC_HISTORY_SQL,
+                [(now, p[_I_USAGE], p[_I_APPROVED], p[0], p[_I_USAGE], p[_I_APPROVED]) for p in params],
+            )
+            await conn.executemany(_UPSERT_INVITE_SQL, params)
+        if chat_synced:
+            await conn.execute(
+                """
+                INSERT INTO chat_sync (chat_id, last_synced_at) VALUES (?, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET last_synced_at = excluded.last_synced_at
+                """,
+                (str(chat_id), now),
+            )
+            await conn.execute("DELETE FROM sync_cursors WHERE chat_id = ?", (str(chat_id),))
+        elif cursor is not None:
+            revoked, offset_date, offset_link, admin_id = cursor
+            await conn.execute(
+                """
+                INSERT INTO sync_cursors (
+                  chat_id, revoked, offset_date, offset_link, admin_id, pages, started_at, updated_at
+                )
+                VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    revoked     = excluded.revoked,
+                    offset_date = excluded.offset_date,
+                    offset_link = excluded.offset_link,
+                    admin_id    = excluded.admin_id,
+                    pages       = pages + 1,
+                    updated_at  = excluded.updated_at
+                """,
+                (str(chat_id), 1 if revoked else 0, offset_date, offset_link, admin_id, now, now),
+            )
+        await conn.commit()
+    _owner_cache.invalidate_owners(set(owners.values()))
+    _owner_cache.invalidate_links(p[0] for p in params)
+    return len(params)
+
+
+@_backend_api
+async def get_sync_cursor(chat_id: int | str) -> Optional[dict]:
+    """
+    Позиция незаконченного полного прохода по чату:
+    {"revoked", "offset_date", "offset_link", "admin_id", "pages", "started_at", "updated_at"} или None.
+    """
+    async with _reader() as conn:
+        cur = await conn.execute(
+            """
+            SELECT revoked, offset_date, offset_link, admin_id, pages, started_at, updated_at
+            FROM sync_cursors
+            WHERE chat_id = ?
+            """,
+            (str(chat_id),),
+        )
+        row = await cur.fetchone()
+    return dict(row) if row else None
+
+
+# --------------------------- Sync registry ---------------------------
+
+@_backend_api
+async def add_sync_chat(chat_id: int | str, title: Optional[str] = None, include_revoked: bool = False) -> bool:
+    """
+    Добавить чат в реестр синхронизации. Уже известный чат не трогаем
+    (в том числе не включаем обратно выключенный). True — чат добавлен.
+    """
+    conn = await connect()
+    async with _lock:
+        cur = await conn.execute(
+            """
+            INSERT INTO sync_chats (chat_id, title, include_revoked, added_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO NOTHING
+            """,
+            (str(chat_id), title, 1 if include_revoked else 0, int(time.time())),
+        )
+        await conn.commit()
+    return cur.rowcount > 0
+
+
+@_backend_api
+async def set_sync_chat_enabled(chat_id: int | str, enabled: bool) -> bool:
+    """Включить/выключить синк чата. False — такого чата в реестре нет."""
+    conn = await connect()
+    async with _lock:
+        cur = await conn.execute(
+            "UPDATE sync_chats SET enabled = ? WHERE chat_id = ?",
+            (1 if enabled else 0, str(chat_id)),
+        )
+        await conn.commit()
+    return cur.rowcount > 0
+
+
+@_backend_api
+async def delete_sync_chat(chat_id: int | str) -> bool:
+    """Убрать чат из реестра (ссылки и история чата остаются). False — чата не было."""
+    conn = await connect()
+    async with _lock:
+        cur = await conn.execute("DELETE FROM sync_chats WHERE chat_id = ?", (str(chat_id),))
+        await conn.commit()
+    return cur.rowcount > 0
+
+
+@_backend_api
+async def list_sync_chats(enabled_only: bool = False) -> list[dict]:
+    """Реестр чатов со статусом последнего прохода и штампом синхронизации (last_synced_at)."""
+    async with _reader() as conn:
+        cur = await conn.execute(
+            """
+            SELECT c.*, s.last_synced_at
+            FROM sync_chats c
+            LEFT JOIN chat_sync s
+                ON s.chat_id = c.chat_id
+            WHERE c.enabled = 1 OR ? = 0
+            ORDER BY c.added_at, c.chat_id
+            """,
+            (1 if enabled_only else 0,),
+        )
+        rows = await cur.fetchall()
+    return _rows_to_dicts(rows)
+
+
+@_backend_api
+async def record_sync_run(
+    chat_id: int | str,
+    *,
+    duration_ms: int,
+    pages: int,
+    links: int,
+    changed: int,
+    error: Optional[str] = None,
+) -> None:
+    """
+    Записать итог прохода синхронизации по чату. error=None — успешный проход
+    (счётчик ошибок подряд сбрасывается), иначе счётчик растёт, а текст сохраняется.
+    """
+    now = int(time.time())
+    conn = await connect()
+    async with _lock:
+        await conn.execute(
+            """
+            UPDATE sync_chats SET
+                last_run_at      = ?,
+                last_duration_ms = ?,
+                last_pages       = ?,
+                last_links       = CASE WHEN ? IS NULL THEN ? ELSE last_links END,
+                last_changed     = CASE WHEN ? IS NULL THEN ? ELSE last_changed END,
+                last_ok_at       = CASE WHEN ? IS NULL THEN ? ELSE last_ok_at END,
+                errors           = CASE WHEN ? IS NULL THEN 0 ELSE errors + 1 END,
+                last_error       = ?
+            WHERE chat_id = ?
+            """,
+            (
+                now, duration_ms, pages,
+                error, links, error, changed, error, now, error,
+                error, str(chat_id),
+            ),
+        )
+        await conn.commit()
+
+
+# --------------------------- Invite pool ---------------------------
+
+@_backend_api
+async def add_pool_invites(exported_list: Iterable[types.ChatInviteExported], chat_id: int | str) -> int:
+    """Положить созданные ссылки в запас чата. Возвращает, сколько добавлено."""
+    now = int(time.time())
+    # [3:8] — title, date_created, expire_date, usage_limit, request_needed в разборе _invite_params
+    params = [(e.link, str(chat_id), *_invite_params(e, chat_id, None, now)[3:8], now, getattr(e, "admin_id", None))
+              for e in exported_list if getattr(e, "link", None)]
+    if not params:
+        return 0
+    conn = await connect()
+    async with _lock:
+        before = conn.total_changes
+        await conn.executemany(
+            """
+            INSERT INTO invite_pool (
+              link, chat_id, title, date_created, expire_date, usage_limit, request_needed, pooled_at, admin_id
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(link) DO NOTHING
+            """,
+            params,
+        )
+        added = conn.total_changes - before
+        await conn.commit()
+    return added
+
+
+@_backend_api
+async def claim_pool_invites(chat_id: int | str, limit: int) -> list[dict]:
+    """
+    Забрать из запаса чата до limit самых старых ссылок (они удаляются из запаса).
+    Ссылки, которые синк успел увидеть отозванными или уже с владельцем, выбрасываются.
+    [{"link", "title", "date_created", "expire_date", "usage_limit", "request_needed", "admin_id"}]
+    """
+    if limit <= 0:
+        return []
+    conn = await connect()
+    async with _lock:
+        # владелец мог быть ещё в отложенной очереди
+        await _write_behind.flush_locked(conn)
+        await conn.execute(
+            """
+            DELETE FROM invite_pool
+            WHERE chat_id = ?
+              AND EXISTS (
+                SELECT 1 FROM invites i
+                WHERE i.link = invite_pool.link AND (i.revoked = 1 OR i.owner_tg_id IS NOT NULL)
+              )
+            """,
+            (str(chat_id),),
+        )
+        cur = await conn.execute(
+            """
+            DELETE FROM invite_pool
+            WHERE link IN (
+                SELECT link FROM invite_pool
+                WHERE chat_id = ?
+                ORDER BY pooled_at, link
+                LIMIT ?
+            )
+            RETURNING link, title, date_created, expire_date, usage_limit, request_needed, admin_id, pooled_at
+            """,
+            (str(chat_id), limit),
+        )
+        rows = await cur.fetchall()
+        await conn.commit()
+    rows = sorted((dict(r) for r in rows), key=lambda r: (r["pooled_at"], r["link"]))
+    for r in rows:
+        del r["pooled_at"]
+    return rows
+
+
+@_backend_api
+async def count_pool_invites(chat_id: int | str) -> int:
+    """Сколько ссылок сейчас в запасе чата."""
+    async with _reader() as conn:
+        cur = await conn.execute("SELECT COUNT(*) FROM invite_pool WHERE chat_id = ?", (str(chat_id),))
+        return (await cur.fetchone())[0]
+
+
+# --------------------------- Link batches ---------------------------
+
+@_backend_api
+async def start_link_batch(
+    batch_key: str,
+    owner_tg_id: int,
+    chat_id: int | str,
+    titles: list[Optional[str]],
+) -> None:
+    """
+    Завести пачку ссылок под ключом идемпотентности batch_key: titles — название на каждую
+    ссылку, в порядке выдачи. Пачка с тем же ключом заменяется вместе со своими ссылками;
+    заодно удаляются пачки, не обновлявшиеся дольше settings.link_batch_resume_sec.
+    """
+    now = int(time.time())
+    conn = await connect()
+    async with _lock:
+        expired = now - settings.link_batch_resume_sec
+        await conn.execute(
+            """
+            DELETE FROM link_batch_items
+            WHERE batch_key = ? OR batch_key IN (SELECT batch_key FROM link_batches WHERE updated_at < ?)
+            """,
+            (batch_key, expired),
+        )
+        await conn.execute("DELETE FROM link_batches WHERE updated_at < ?", (expired,))
+        await conn.execute(
+            """
+            INSERT INTO link_batches (batch_key, owner_tg_id, chat_id, titles, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(batch_key) DO UPDATE SET
+                owner_tg_id = excluded.owner_tg_id,
+                chat_id     = excluded.chat_id,
+                titles      = excluded.titles,
+                created_at  = excluded.created_at,
+                updated_at  = excluded.updated_at
+            """,
+            (batch_key, owner_tg_id, str(chat_id), json.dumps(titles, ensure_ascii=False), now, now),
+        )
+        await conn.commit()
+
+
+@_backend_api
+async def add_link_batch_item(
+    batch_key: str,
+    idx: int,
+    exported: types.ChatInviteExported,
+    chat_id: int | str,
+    owner_tg_id: int,
+) -> None:
+    """
+    Записать созданную ссылку пачки: в invites (владелец owner_tg_id) и в пачку под номером idx —
+    одной транзакцией и сразу, в обход отложенной очереди: ссылка уже есть в Telegram.
     """
-    global _conn
-    if _conn is None:
-        _conn = await aiosqlite.connect(DB_PATH)
-        _conn.row_factory = aiosqlite.Row   # удобное преобразование в dict
-        await _conn.execute("PRAGMA journal_mode=WAL;")
-        await _conn.execute("PRAGMA synchronous=NORMAL;")
-    return _conn
+    now = int(time.time())
+    params = _invite_params(exported, chat_id, owner_tg_id, now)
+    if params is None:
+        return
+    conn = await connect()
+    async with _lock:
+        await _write_behind.flush_locked(conn)
+        await conn.execute(_UPSERT_INVITE_SQL, params)
+        await conn.execute(
+            """
+            INSERT INTO link_batch_items (batch_key, idx, link) VALUES (?, ?, ?)
+            ON CONFLICT(batch_key, idx) DO UPDATE SET link = excluded.link
+            """,
+            (batch_key, idx, params[0]),
+        )
+        await conn.execute("UPDATE link_batches SET updated_at = ? WHERE batch_key = ?", (now, batch_key))
+        await conn.commit()
+    _owner_cache.invalidate_owners([owner_tg_id])
+    _owner_cache.invalidate_links([params[0]])
 
 
-async def close_db() -> None:
-    """Закрыть соединение (опционально вызывать при завершении приложения)."""
-    global _conn
-    if _conn is not None:
-        await _conn.close()
-        _conn = None
+@_backend_api
+async def get_link_batch(batch_key: str) -> Optional[dict]:
+    """
+    Незаконченная пачка: {"owner_tg_id", "chat_id", "titles", "created_at", "updated_at", "links"} или None.
+    links — idx -> строка уже созданной ссылки
+    {"link", "title", "date_created", "expire_date", "usage_limit", "request_needed", "usage", "approved_request_count"}.
+    """
+    async with _reader() as conn:
+        cur = await conn.execute(
+            "SELECT owner_tg_id, chat_id, titles, created_at, updated_at FROM link_batches WHERE batch_key = ?",
+            (batch_key,),
+        )
+        row = await cur.fetchone()
+        if row is None:
+            return None
+        cur = await conn.execute(
+            """
+            SELECT b.idx, i.link, i.title, i.date_created, i.expire_date, i.usage_limit, i.request_needed,
+                   i.usage, i.approved_request_count
+            FROM link_batch_items b
+            JOIN invites i ON i.link = b.link
+            WHERE b.batch_key = ?
+            ORDER BY b.idx
+            """,
+            (batch_key,),
+        )
+        items = await cur.fetchall()
+    batch = dict(row)
+    batch["titles"] = json.loads(batch["titles"])
+    batch["links"] = {r["idx"]: {k: r[k] for k in r.keys() if k != "idx"} for r in items}
+    return batch
 
 
-async def init_db() -> None:
+@_backend_api
+async def finish_link_batch(batch_key: str) -> None:
+    """Пачка выдана целиком: забыть её (ссылки остаются в invites у владельца)."""
     conn = await connect()
     async with _lock:
-        # включим внешние ключи на всякий случай
-        await conn.execute("PRAGMA foreign_keys=ON;")
-
-        # users
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                tg_id      INTEGER PRIMARY KEY,
-                username   TEXT,
-                first_name TEXT
-            )
-        """)
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
-
-        # invites (как у тебя)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS invites (
-                link TEXT PRIMARY KEY,
-                chat_id TEXT NOT NULL,
-                owner_tg_id INTEGER,
-                title TEXT,
-                date_created INTEGER,
-                expire_date INTEGER,
-                usage_limit INTEGER,
-                request_needed INTEGER,
-                usage INTEGER DEFAULT 0,
-                approved_request_count INTEGER DEFAULT 0,
-                revoked INTEGER DEFAULT 0,
-                last_synced_at INTEGER
-            )
-        """)
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_invites_owner    ON invites(owner_tg_id)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_invites_chat     ON invites(chat_id)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_invites_created  ON invites(date_created)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_invites_synced   ON invites(last_synced_at)")
+        await conn.execute("DELETE FROM link_batch_items WHERE batch_key = ?", (batch_key,))
+        await conn.execute("DELETE FROM link_batches WHERE batch_key = ?", (batch_key,))
         await conn.commit()
 
 
+# --------------------------- Link jobs ---------------------------
 
-# --------------------------- Helpers ---------------------------
+@_backend_api
+async def add_link_job(
+    owner_tg_id: int,
+    chat_id: int | str,
+    kind: str,
+    params: dict,
+    batch_key: str,
+    message_id: Optional[int] = None,
+) -> int:
+    """Поставить задание на создание ссылок в очередь. Возвращает id задания."""
+    conn = await connect()
+    async with _lock:
+        cur = await conn.execute(
+            """
+            INSERT INTO link_jobs (owner_tg_id, chat_id, kind, params, batch_key, message_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (owner_tg_id, str(chat_id), kind, json.dumps(params, ensure_ascii=False), batch_key, message_id,
+             int(time.time())),
+        )
+        job_id = cur.lastrowid
+        await conn.commit()
+    return job_id
 
-def _ts(dt_obj) -> Optional[int]:
-    """Безопасно конвертировать datetime -> int (unix)."""
-    if not dt_obj:
-        return None
-    try:
-        return int(dt_obj.timestamp())
-    except Exception:
-        return None
 
+@_backend_api
+async def start_link_job(job_id: int) -> None:
+    """Задание взято воркером."""
+    conn = await connect()
+    async with _lock:
+        await conn.execute(
+            "UPDATE link_jobs SET status = 'running', started_at = ? WHERE id = ?", (int(time.time()), job_id),
+        )
+        await conn.commit()
 
-def _rows_to_dicts(rows: list[aiosqlite.Row]) -> list[dict]:
-    return [dict(r) for r in rows]
 
+@_backend_api
+async def finish_link_job(job_id: int) -> None:
+    """Задание выполнено, упало или отменено оператором — из очереди его убираем."""
+    conn = await connect()
+    async with _lock:
+        await conn.execute("DELETE FROM link_jobs WHERE id = ?", (job_id,))
+        await conn.commit()
 
-# --------------------------- Insert / Upsert ---------------------------
 
-async def insert_invite_from_exported(
-    exported: types.ChatInviteExported,   # или types.ExportedChatInvite в другой версии
-    chat_id: int | str,
-    owner_tg_id: int,
-) -> None:
+@_backend_api
+async def list_link_jobs() -> list[dict]:
     """
-    Сохранить ссылку напрямую из ChatInviteExported.
-    last_synced_at обновляется КАЖДЫЙ раз.
-    ON CONFLICT(link) — обновляем ключевые поля и счётчики.
+    Незаконченные задания в порядке постановки:
+    [{"id", "owner_tg_id", "chat_id", "kind", "params", "batch_key", "message_id", "status", "created_at", "started_at"}].
     """
-    link = getattr(exported, "link", None)
-    if not link:
-        return
+    async with _reader() as conn:
+        cur = await conn.execute(
+            """
+            SELECT id, owner_tg_id, chat_id, kind, params, batch_key, message_id, status, created_at, started_at
+            FROM link_jobs
+            ORDER BY id
+            """
+        )
+        rows = _rows_to_dicts(await cur.fetchall())
+    for r in rows:
+        r["params"] = json.loads(r["params"])
+    return rows
 
-    now = int(time.time())
 
-    title = getattr(exported, "title", None)
-    date_created = _ts(getattr(exported, "date", None)) or now
-    expire_date = _ts(getattr(exported, "expire_date", None))
-    usage_limit = getattr(exported, "usage_limit", None)
-    request_needed = 1 if getattr(exported, "request_needed", False) else 0
-    revoked = 1 if getattr(exported, "revoked", False) else 0
-    usage = getattr(exported, "usage", 0) or 0
-    approved = getattr(exported, "approved_request_count", 0) or 0
+# --------------------------- Dialog state ---------------------------
 
+@_backend_api
+async def save_dialog_state(user_id: int, data: dict, expires_at: int) -> None:
+    """Сохранить шаг диалога пользователя (перезаписывает прежний)."""
     conn = await connect()
     async with _lock:
         await conn.execute(
             """
-            INSERT INTO invites (
-              link, chat_id, owner_tg_id, title, date_created, expire_date,
-              usage_limit, request_needed, usage, approved_request_count, revoked, last_synced_at
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(link) DO UPDATE SET
-              title                   = COALESCE(excluded.title, title),
-              expire_date             = COALESCE(excluded.expire_date, expire_date),
-              usage_limit             = COALESCE(excluded.usage_limit, usage_limit),
-              request_needed          = excluded.request_needed,
-              usage                   = MAX(usage, excluded.usage),
-              approved_request_count  = MAX(approved_request_count, excluded.approved_request_count),
-              revoked                 = excluded.revoked,
-              last_synced_at          = excluded.last_synced_at   -- всегда обновляем штамп синхронизации
+            INSERT INTO dialog_state (user_id, data, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
             """,
-            (
-                link,
-                str(chat_id),
-                owner_tg_id,
-                title,
-                date_created,
-                expire_date,
-                usage_limit,
-                request_needed,
-                usage,
-                approved,
-                revoked,
-                now,
-            ),
+            (user_id, json.dumps(data, ensure_ascii=False), expires_at),
         )
         await conn.commit()
 
 
-async def insert_many_from_exported(
-    exported_list: Iterable[types.ChatInviteExported],
-    chat_id: int | str,
-    owner_tg_id: int,
-) -> None:
+@_backend_api
+async def delete_dialog_state(user_id: int) -> None:
+    conn = await connect()
+    async with _lock:
+        await conn.execute("DELETE FROM dialog_state WHERE user_id = ?", (user_id,))
+        await conn.commit()
+
+
+@_backend_api
+async def load_dialog_states(now: int) -> list[dict]:
+    """Неистёкшие шаги диалогов, раньше истекающие первыми: [{"user_id", "data", "expires_at"}]."""
+    async with _reader() as conn:
+        cur = await conn.execute(
+            "SELECT user_id, data, expires_at FROM dialog_state WHERE expires_at > ? ORDER BY expires_at",
+            (now,),
+        )
+        rows = _rows_to_dicts(await cur.fetchall())
+    for r in rows:
+        r["data"] = json.loads(r["data"])
+    return rows
+
+
+@_backend_api
+async def purge_dialog_states(now: int) -> int:
+    """Удалить истёкшие шаги диалогов. Возвращает, сколько удалено."""
+    conn = await connect()
+    async with _lock:
+        cur = await conn.execute("DELETE FROM dialog_state WHERE expires_at <= ?", (now,))
+        await conn.commit()
+    return cur.rowcount
+
+
+# --------------------------- Stats history ---------------------------
+
+_ADD_HISTORY_SQL = """
+    INSERT INTO invite_stats_history (link, ts, granularity, d_usage, d_approved)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(link, ts, granularity) DO UPDATE SET
+        d_usage    = d_usage    + excluded.d_usage,
+        d_approved = d_approved + excluded.d_approved
+"""
+
+HOUR = 3600
+DAY = 86400
+
+
+@_backend_api
+async def compact_stats_history(now: Optional[int] = None) -> dict:
     """
-    Пакетная вставка ссылок (одной транзакцией) для одного пользователя.
-    last_synced_at обновляется у каждой строки.
+    Прореживание истории:
+    - сырые точки старше settings.history_raw_hours  -> часовые корзины,
+    - часовые старше settings.history_hourly_days     -> суточные,
+    - суточные старше settings.history_daily_days     -> удаляются (0 — хранить всегда).
+    Всё одной транзакцией. Возвращает, сколько строк свёрнуто/удалено на каждом шаге.
     """
-    now = int(time.time())
-    params: list[tuple] = []
-
-    for e in exported_list:
-        link = getattr(e, "link", None)
-        if not link:
-            continue
-
-        title = getattr(e, "title", None)
-        date_created = _ts(getattr(e, "date", None)) or now
-        expire_date = _ts(getattr(e, "expire_date", None))
-        usage_limit = getattr(e, "usage_limit", None)
-        request_needed = 1 if getattr(e, "request_needed", False) else 0
-        revoked = 1 if getattr(e, "revoked", False) else 0
-        usage = getattr(e, "usage", 0) or 0
-        approved = getattr(e, "approved_request_count", 0) or 0
-
-        params.append((
-            link,
-            str(chat_id),
-            owner_tg_id,
-            title,
-            date_created,
-            expire_date,
-            usage_limit,
-            request_needed,
-            usage,
-            approved,
-            revoked,
-            now,   # last_synced_at
-        ))
+    now = now or int(time.time())
+    raw_border = now - settings.history_raw_hours * HOUR
+    hourly_border = now - settings.history_hourly_days * DAY
+    stats = {"raw_to_hourly": 0, "hourly_to_daily": 0, "daily_deleted": 0}
 
-    if not params:
-        return
+    async def _roll_up(from_gran: int, to_gran: int, border: int) -> int:
+        await conn.execute(
+            """
+            INSERT INTO invite_stats_history (link, ts, granularity, d_usage, d_approved)
+            SELECT link, (ts / ?) * ?, ?, SUM(d_usage), SUM(d_approved)
+            FROM invite_stats_history
+            WHERE granularity = ? AND ts < ?
+            GROUP BY link, ts / ?
+            ON CONFLICT(link, ts, granularity) DO UPDATE SET
+                d_usage    = d_usage    + excluded.d_usage,
+                d_approved = d_approved + excluded.d_approved
+            """,
+            (to_gran, to_gran, to_gran, from_gran, border, to_gran),
+        )
+        cur = await conn.execute(
+            "DELETE FROM invite_stats_history WHERE granularity = ? AND ts < ?",
+            (from_gran, border),
+        )
+        return cur.rowcount
 
     conn = await connect()
     async with _lock:
-        await conn.executemany(
-            """
-            INSERT INTO invites (
-              link, chat_id, owner_tg_id, title, date_created, expire_date,
-              usage_limit, request_needed, usage, approved_request_count, revoked, last_synced_at
+        stats["raw_to_hourly"] = await _roll_up(0, HOUR, raw_border)
+        stats["hourly_to_daily"] = await _roll_up(HOUR, DAY, hourly_border)
+        if settings.history_daily_days > 0:
+            cur = await conn.execute(
+                "DELETE FROM invite_stats_history WHERE granularity = ? AND ts < ?",
+                (DAY, now - settings.history_daily_days * DAY),
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(link) DO UPDATE SET
-              title                   = COALESCE(excluded.title, title),
-              expire_date             = COALESCE(excluded.expire_date, expire_date),
-              usage_limit             = COALESCE(excluded.usage_limit, usage_limit),
-              request_needed          = excluded.request_needed,
-              usage                   = MAX(usage, excluded.usage),
-              approved_request_count  = MAX(approved_request_count, excluded.approved_request_count),
-              revoked                 = excluded.revoked,
-              last_synced_at          = excluded.last_synced_at
+            stats["daily_deleted"] = cur.rowcount
+        await conn.commit()
+    return stats
+
+
+@_backend_api
+async def get_link_growth(link: str, since: int, until: Optional[int] = None) -> dict:
+    """
+    Прирост по одной ссылке за окно [since, until): {"d_usage": .., "d_approved": ..}.
+    Точность окна — размер корзины, в которой лежат старые данные (час / сутки).
+    """
+    async with _reader() as conn:
+        cur = await conn.execute(
+            """
+            SELECT COALESCE(SUM(d_usage), 0) AS d_usage,
+                   COALESCE(SUM(d_approved), 0) AS d_approved
+            FROM invite_stats_history
+            WHERE link = ? AND ts >= ? AND ts < ?
             """,
-            params,
+            (link, since, until or int(time.time()) + 1),
+        )
+        row = await cur.fetchone()
+    return dict(row)
+
+
+@_backend_api
+async def get_link_growth_series(
+    link: str,
+    since: int,
+    until: Optional[int] = None,
+    bucket_sec: int = HOUR,
+) -> list[dict]:
+    """Прирост по ссылке за окно, разбитый на корзины по bucket_sec: [{"ts", "d_usage", "d_approved"}]."""
+    async with _reader() as conn:
+        cur = await conn.execute(
+            """
+            SELECT (ts / ?) * ?     AS ts,
+                   SUM(d_usage)     AS d_usage,
+                   SUM(d_approved)  AS d_approved
+            FROM invite_stats_history
+            WHERE link = ? AND ts >= ? AND ts < ?
+            GROUP BY ts / ?
+            ORDER BY 1
+            """,
+            (bucket_sec, bucket_sec, link, since, until or int(time.time()) + 1, bucket_sec),
+        )
+        rows = await cur.fetchall()
+    return _rows_to_dicts(rows)
+
+
+@_backend_api
+async def get_owner_growth(owner_tg_id: int, since: int, until: Optional[int] = None) -> list[dict]:
+    """
+    Прирост по всем ссылкам владельца за окно [since, until), по убыванию прироста:
+    [{"link", "title", "d_usage", "d_approved"}]. Ссылки без прироста не попадают.
+    """
+    async with _reader() as conn:
+        cur = await conn.execute(
+            """
+            SELECT i.link,
+                   i.title,
+                   SUM(h.d_usage)    AS d_usage,
+                   SUM(h.d_approved) AS d_approved
+            FROM invites i
+            CROSS JOIN invite_stats_history h      -- CROSS JOIN фиксирует порядок: сначала ссылки владельца
+                ON h.link = i.link AND h.ts >= ? AND h.ts < ?
+            WHERE i.owner_tg_id = ?
+            GROUP BY i.link
+            ORDER BY SUM(h.d_usage) + SUM(h.d_approved) DESC
+            """,
+            (since, until or int(time.time()) + 1, owner_tg_id),
+        )
+        rows = await cur.fetchall()
+    return _rows_to_dicts(rows)
+
+
+@_backend_api
+async def get_top_growing_links(chat_id: int | str, since: int, limit: int = 50) -> list[dict]:
+    """
+    Самые быстрорастущие ссылки чата с момента since (по invite_stats_history):
+    [{"link", "growth"}] по убыванию прироста (usage + approved).
+    """
+    async with _reader() as conn:
+        cur = await conn.execute(
+            """
+            SELECT h.link,
+                   SUM(h.d_usage + h.d_approved) AS growth
+            FROM invite_stats_history h INDEXED BY idx_history_gran_ts   -- окно по времени, а не проход по PK
+            JOIN invites i
+                ON i.link = h.link
+            WHERE h.granularity IN (0, 3600, 86400)
+              AND h.ts >= ? AND i.chat_id = ?
+            GROUP BY h.link
+            ORDER BY growth DESC
+            LIMIT ?
+            """,
+            (since, str(chat_id), limit),
+        )
+        rows = await cur.fetchall()
+    return _rows_to_dicts(rows)
+
+
+# --------------------------- Owner stats ---------------------------
+
+# сводка по владельцу, посчитанная напрямую по invites (для сверки и пересборки)
+_OWNER_STATS_FROM_INVITES = """
+    SELECT
+        owner_tg_id,
+        COUNT(*)                                     AS links,
+        COALESCE(SUM(usage), 0)                      AS usage,
+        COALESCE(SUM(approved_request_count), 0)     AS approved,
+        COALESCE(SUM(revoked), 0)                    AS revoked,
+        MAX(COALESCE(last_synced_at, date_created))  AS last_activity
+    FROM invites
+    WHERE owner_tg_id IS NOT NULL
+"""
+
+
+@_backend_api
+async def get_owner_stats(owner_tg_id: int) -> Optional[dict]:
+    """
+    Быстрая сводка по владельцу из owner_stats (без перечитывания ссылок):
+    links, usage, approved, revoked, last_activity.
+    """
+    async with _reader() as conn:
+        cur = await conn.execute("SELECT * FROM owner_stats WHERE owner_tg_id = ?", (owner_tg_id,))
+        row = await cur.fetchone()
+    return dict(row) if row else None
+
+
+@_backend_api
+async def check_owner_stats() -> list[dict]:
+    """
+    Сверить owner_stats с invites. Возвращает расхождения
+    [{"owner_tg_id", "stored": {...} | None, "actual": {...} | None}]; пустой список — всё сходится.
+    last_activity не сверяется (в owner_stats это момент изменения, а не синхронизации).
+    """
+    keys = ("links", "usage", "approved", "revoked")
+    async with _reader() as conn:
+        # обе выборки — в одной читающей транзакции, из одного снимка WAL:
+        # запись, закоммиченная между ними, дала бы ложное расхождение
+        await conn.execute("BEGIN")
+        try:
+            cur = await conn.execute(_OWNER_STATS_FROM_INVITES + " GROUP BY owner_tg_id")
+            actual = {r["owner_tg_id"]: dict(r) for r in await cur.fetchall()}
+            cur = await conn.execute("SELECT * FROM owner_stats")
+            stored = {r["owner_tg_id"]: dict(r) for r in await cur.fetchall()}
+        finally:
+            await conn.execute("COMMIT")
+
+    diff: list[dict] = []
+    for owner_tg_id in actual.keys() | stored.keys():
+        a, s = actual.get(owner_tg_id), stored.get(owner_tg_id)
+        if a is None and s is not None and not any(s[k] for k in keys):
+            continue   # владелец без ссылок — допустимая пустая строка
+        if a is None or s is None or any(a[k] != s[k] for k in keys):
+            diff.append({"owner_tg_id": owner_tg_id, "stored": s, "actual": a})
+    return diff
+
+
+@_backend_api
+async def rebuild_owner_stats() -> int:
+    """Пересобрать owner_stats с нуля по invites. Возвращает число владельцев."""
+    conn = await connect()
+    async with _lock:
+        await conn.execute("DELETE FROM owner_stats")
+        cur = await conn.execute(
+            "INSERT INTO owner_stats (owner_tg_id, links, usage, approved, revoked, last_activity) "
+            + _OWNER_STATS_FROM_INVITES + " GROUP BY owner_tg_id"
         )
         await conn.commit()
+    return cur.rowcount
 
 
 # --------------------------- Update counters ---------------------------
 
+@_backend_api
 async def update_invite_counters(
     link: str,
     usage: int,
@@ -242,26 +1727,54 @@ async def update_invite_counters(
     """
     Обновить счётчики по одной ссылке.
     last_synced_at обновляется всегда.
+    Запись отложенная, повторы по одной ссылке склеиваются.
     """
-    now = int(time.time())
-    conn = await connect()
-    async with _lock:
-        await conn.execute(
-            """
-            UPDATE invites
-            SET usage                  = MAX(usage, ?),
-                approved_request_count = MAX(approved_request_count, ?),
-                revoked                = ?,
-                last_synced_at         = ?
-            WHERE link = ?
-            """,
-            (usage, approved_request_count, int(revoked), now, link),
-        )
-        await conn.commit()
+    _write_behind.put_counters(link, usage, approved_request_count, int(revoked), int(time.time()))
+
+
+@_backend_api
+async def add_invite_joins(link: str, d_usage: int = 0, d_approved: int = 0) -> None:
+    """
+    Прибавить вступления по ссылке (из апдейтов юзербота, см. services/join_tracker.py)
+    и записать их в invite_stats_history. Неизвестные ссылки игнорируются.
+    Запись отложенная, приросты по одной ссылке суммируются.
+    """
+    if d_usage or d_approved:
+        _write_behind.put_joins(link, d_usage, d_approved, int(time.time()))
 
 
 # --------------------------- Queries ---------------------------
 
+# Общая выборка ссылок + владелец. last_synced_at — свежайший из штампа строки
+# и штампа последней синхронизации чата (дельта-синк не трогает неизменившиеся строки;
+# отозванные ссылки синк по умолчанию не запрашивает, им штамп чата не раздаём).
+_INVITES_SELECT = """
+    SELECT
+        i.link,
+        i.chat_id,
+        i.owner_tg_id,
+        i.title,
+        i.date_created,
+        i.expire_date,
+        i.usage_limit,
+        i.request_needed,
+        i.usage,
+        i.approved_request_count,
+        i.revoked,
+        NULLIF(MAX(
+            COALESCE(i.last_synced_at, 0),
+            CASE WHEN i.revoked = 0 THEN COALESCE(s.last_synced_at, 0) ELSE 0 END
+        ), 0)         AS last_synced_at,
+        u.username    AS owner_username,
+        u.first_name  AS owner_first_name
+    FROM invites i
+    LEFT JOIN users u
+        ON u.tg_id = i.owner_tg_id
+    LEFT JOIN chat_sync s
+        ON s.chat_id = i.chat_id
+"""
+
+@_backend_api
 async def get_invites_by_owner(owner_tg_id: int) -> list[dict]:
     """
     Получить ссылки, созданные конкретным пользователем + его username и имя.
@@ -280,28 +1793,30 @@ async def get_invites_by_owner(owner_tg_id: int) -> list[dict]:
     owner_username
     owner_first_name
 
+    Результат кэшируется (см. _OwnerCache); возвращается новый список,
+    сами словари общие с кэшем — не менять.
     """
-    conn = await connect()
-    async with _lock:
+    cached = _owner_cache.get(owner_tg_id)
+    if cached is not None:
+        return list(cached)
+
+    epoch = _owner_cache.epoch
+    async with _reader() as conn:
         cur = await conn.execute(
-            """
-            SELECT
-                i.*,
-                u.username    AS owner_username,
-                u.first_name  AS owner_first_name
-            FROM invites i
-            LEFT JOIN users u
-                ON u.tg_id = i.owner_tg_id
+            _INVITES_SELECT + """
             WHERE i.owner_tg_id = ?
             ORDER BY i.date_created DESC
             """,
             (owner_tg_id, )
         )
         rows = await cur.fetchall()
-    return _rows_to_dicts(rows)
+    data = _rows_to_dicts(rows)
+    _owner_cache.put(owner_tg_id, data, epoch)
+    return list(data)
 
 
 
+@_backend_api
 async def get_all_invites() -> list[dict]:
     """
     Получить все ссылки + данные владельца (username, first_name).
@@ -320,17 +1835,9 @@ async def get_all_invites() -> list[dict]:
     owner_username
     owner_first_name
     """
-    conn = await connect()
-    async with _lock:
+    async with _reader() as conn:
         cur = await conn.execute(
-            """
-            SELECT
-                i.*,
-                u.username    AS owner_username,
-                u.first_name  AS owner_first_name
-            FROM invites i
-            LEFT JOIN users u
-                ON u.tg_id = i.owner_tg_id
+            _INVITES_SELECT + """
             ORDER BY i.date_created DESC
             """
         )
@@ -338,50 +1845,127 @@ async def get_all_invites() -> list[dict]:
     return _rows_to_dicts(rows)
 
 
+async def _iter_invites(
+    where: str,
+    params: tuple,
+    chunk_size: int,
+) -> AsyncIterator[list[dict]]:
+    """
+    Постраничное чтение invites + владелец с keyset-курсором по (date_created, link).
+    Соединение из пула берётся на одну страницу, между страницами отдаётся обратно.
+    Строки без date_created в сравнении кортежей выпадают (NULL), поэтому идут отдельным
+    проходом в конце — по link, как если бы дата была самой старой; оба прохода идут по индексу.
+    """
+    for dated in (True, False):
+        cursor: Optional[str | tuple[int, str]] = None
+        while True:
+            conds = [where] if where else []
+            args = list(params)
+            if dated:
+                conds.append("i.date_created IS NOT NULL")
+                if cursor is not None:
+                    conds.append("(i.date_created, i.link) < (?, ?)")
+                    args.extend(cursor)
+                order = "i.date_created DESC, i.link DESC"
+            else:
+                conds.append("i.date_created IS NULL")
+                if cursor is not None:
+                    conds.append("i.link < ?")
+                    args.append(cursor)
+                order = "i.link DESC"
+            sql = _INVITES_SELECT + f"""
+                WHERE {" AND ".join(conds)}
+                ORDER BY {order}
+                LIMIT ?
+            """
+            args.append(chunk_size)
+            async with _reader() as conn:
+                cur = await conn.execute(sql, args)
+                rows = await cur.fetchall()
+            if not rows:
+                break
+            chunk = _rows_to_dicts(rows)
+            yield chunk
+            if len(rows) < chunk_size:
+                break
+            last = chunk[-1]
+            cursor = (last["date_created"], last["link"]) if dated else last["link"]
+
+
+@_backend_api
+async def iter_invites_by_owner(owner_tg_id: int | None, chunk_size: int = 500) -> AsyncIterator[list[dict]]:
+    """
+    То же, что get_invites_by_owner, но отдаёт строки пачками по chunk_size
+    (новые сверху) — в памяти одновременно только одна пачка.
+    """
+    async for chunk in _iter_invites("i.owner_tg_id IS ?", (owner_tg_id,), chunk_size):
+        yield chunk
+
+
+@_backend_api
+async def iter_all_invites(chunk_size: int = 500, *, group_by_owner: bool = False) -> AsyncIterator[list[dict]]:
+    """
+    То же, что get_all_invites, но пачками по chunk_size.
+    group_by_owner=True — сначала по владельцам (по возрастанию tg_id, ссылки без владельца в конце),
+    внутри владельца новые сверху.
+    """
+    if not group_by_owner:
+        async for chunk in _iter_invites("", (), chunk_size):
+            yield chunk
+        return
+
+    async with _reader() as conn:
+        cur = await conn.execute("SELECT DISTINCT owner_tg_id FROM invites ORDER BY owner_tg_id")
+        owners = [r[0] for r in await cur.fetchall()]
+    # в SQLite NULL сортируется первым; ссылки без владельца — в конец
+    if owners and owners[0] is None:
+        owners = owners[1:] + [None]
+    for owner_tg_id in owners:
+        async for chunk in iter_invites_by_owner(owner_tg_id, chunk_size):
+            yield chunk
+
+
+@_backend_api
 async def get_link(link: str) -> Optional[dict]:
-    conn = await connect()
-    async with _lock:
+    async with _reader() as conn:
         cur = await conn.execute("SELECT * FROM invites WHERE link = ?", (link,))
         row = await cur.fetchone()
     return dict(row) if row else None
 
 
+@_backend_api
 async def delete_invite(link: str) -> None:
+    _write_behind.drop_invite(link)
     conn = await connect()
     async with _lock:
+        await _write_behind.flush_locked(conn)
         await conn.execute("DELETE FROM invites WHERE link = ?", (link,))
         await conn.commit()
+    _owner_cache.invalidate_links([link])
 
 
 # --------------------------- Users ---------------------------
 
+@_backend_api
 async def upsert_user_basic(user: User) -> None:
     """
     Создаёт пользователя или обновляет username/first_name по tg_id.
+    Запись отложенная: повторные /start одного пользователя склеиваются в одну строку.
     """
-    conn = await connect()
-    async with _lock:
-        await conn.execute("""
-            INSERT INTO users (tg_id, username, first_name)
-            VALUES (?, ?, ?)
-            ON CONFLICT(tg_id) DO UPDATE SET
-                username   = excluded.username,
-                first_name = excluded.first_name
-        """, (user.id, user.username, user.first_name))
-        await conn.commit()
+    _write_behind.put_user((user.id, user.username, user.first_name))
 
 
+@_backend_api
 async def get_user(tg_id: int) -> Optional[dict]:
-    conn = await connect()
-    async with _lock:
+    async with _reader() as conn:
         cur = await conn.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,))
         row = await cur.fetchone()
     return dict(row) if row else None
 
 
+@_backend_api
 async def list_users(limit: int = 100, offset: int = 0) -> list[dict]:
-    conn = await connect()
-    async with _lock:
+    async with _reader() as conn:
         cur = await conn.execute(
             "SELECT * FROM users ORDER BY tg_id LIMIT ? OFFSET ?",
             (limit, offset)
@@ -390,8 +1974,11 @@ async def list_users(limit: int = 100, offset: int = 0) -> list[dict]:
     return _rows_to_dicts(rows)
 
 
+@_backend_api
 async def delete_user(tg_id: int) -> None:
+    _write_behind.drop_user(tg_id)
     conn = await connect()
     async with _lock:
         await conn.execute("DELETE FROM users WHERE tg_id = ?", (tg_id,))
         await conn.commit()
+    _owner_cache.invalidate_owners([tg_id])
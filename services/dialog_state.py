@@ -0,0 +1,112 @@
+# services/dialog_state.py
+"""
+Шаги диалогов оператора с ботом (какой режим, на каком шаге, какое сообщение с
+вопросом потом удалить).
+
+Храним только идентификаторы: сообщение — по id (чат — личка оператора), а не
+объект Telethon Message со всем, что к нему прицеплено. Брошенный диалог
+забывается через settings.dialog_state_ttl_sec после последнего шага. Все шаги
+живут одинаковый срок, поэтому словарь упорядочен по сроку, и истёкшие
+снимаются с его начала за O(1) на шаг. С settings.dialog_state_persist шаги
+пишутся в таблицу dialog_state и переживают рестарт. Без неё они только в памяти.
+
+    dialogs = get_dialogs()
+    await dialogs.set(user_id, Dialog("mask", "ask_mask", prompt_id=msg_id))
+    st = dialogs.get(user_id)
+    await dialogs.pop(user_id)
+
+Занимаемую память на 100k операторов меряет scripts/check_state_store_memory.py.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional
+
+from config import settings
+from services.db import delete_dialog_state, load_dialog_states, purge_dialog_states, save_dialog_state
+
+log = logging.getLogger("app")
+
+
+class Dialog(NamedTuple):
+    mode: str
+    step: str
+    prompt_id: Optional[int] = None     # сообщение бота с вопросом: удаляется на следующем шаге
+    mask: Optional[str] = None          # режим «по маске»: маска до вопроса о количестве
+    expires_at: int = 0                 # unix-время; ставит DialogStore.set
+
+    def data(self) -> dict:
+        """Всё, кроме срока, — для сохранения в базе."""
+        return {k: v for k, v in self._asdict().items() if k != "expires_at" and v is not None}
+
+
+class DialogStore:
+    def __init__(
+        self,
+        ttl: Optional[float] = None,
+        *,
+        persist: Optional[bool] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.ttl = settings.dialog_state_ttl_sec if ttl is None else ttl
+        self.persist = settings.dialog_state_persist if persist is None else persist
+        self._clock = clock
+        self._items: OrderedDict[int, Dialog] = OrderedDict()     # по возрастанию expires_at
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    async def load(self) -> None:
+        """Поднять неистёкшие шаги из базы (только с persist)."""
+        if not self.persist:
+            return
+        now = int(self._clock())
+        purged = await purge_dialog_states(now)
+        for row in await load_dialog_states(now):
+            self._items[row["user_id"]] = Dialog(**row["data"], expires_at=row["expires_at"])
+        log.info(f"[dialogs] восстановлено диалогов: {len(self._items)}, истёкших удалено: {purged}")
+
+    def get(self, user_id: int) -> Optional[Dialog]:
+        dialog = self._items.get(user_id)
+        if dialog is not None and dialog.expires_at <= self._clock():
+            del self._items[user_id]
+            return None
+        return dialog
+
+    async def set(self, user_id: int, dialog: Dialog) -> Dialog:
+        """Новый шаг диалога; срок отсчитывается заново."""
+        now = self._clock()
+        self._evict(now)
+        dialog = dialog._replace(expires_at=int(now + self.ttl))
+        self._items[user_id] = dialog
+        self._items.move_to_end(user_id)
+        if self.persist:
+            await save_dialog_state(user_id, dialog.data(), dialog.expires_at)
+        return dialog
+
+    async def pop(self, user_id: int) -> Optional[Dialog]:
+        dialog = self._items.pop(user_id, None)
+        if dialog is not None and self.persist:
+            await delete_dialog_state(user_id)
+        return dialog
+
+    def _evict(self, now: float) -> None:
+        # в базе истёкшие строки остаются до следующего load(): там их чистит purge_dialog_states
+        while self._items:
+            user_id, dialog = next(iter(self._items.items()))
+            if dialog.expires_at > now:
+                break
+            del self._items[user_id]
+
+
+_dialogs: Optional[DialogStore] = None
+
+
+def get_dialogs() -> DialogStore:
+    """Общее хранилище шагов диалогов бота."""
+    global _dialogs
+    if _dialogs is None:
+        _dialogs = DialogStore()
+    return _dialogs
@@ -0,0 +1,207 @@
+# services/invite_pool.py
+"""
+Запас заранее созданных пригласительных ссылок для мгновенной выдачи.
+
+ExportChatInviteRequest — самая долгая часть выдачи ссылок оператору. Фоновая
+задача invite_pool_job держит в таблице invite_pool до settings.invite_pool_size
+готовых ссылок target_chat_id. Выдача (take_links_*) забирает ссылки из запаса:
+без названия — отдаёт как есть, с названиями — переименовывает через
+EditExportedChatInviteRequest; чего в запасе не хватило, создаётся как раньше
+(user_service.create_many). Каждая готовая ссылка сразу отдаётся в on_link — через него
+services/link_batches.py пишет её в базу с владельцем. После выдачи запас пополняется в фоне через общий лимитер
+с фоновым приоритетом, то есть не мешая операторам.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import datetime as dt
+import logging
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+from telethon.errors import RPCError
+from telethon.tl import types
+
+from config import settings
+from services import user_service
+from services.accounts import AccountPool
+from services.db import add_pool_invites, claim_pool_invites, count_pool_invites
+from services.rate_limiter import get_limiter
+
+log = logging.getLogger("app")
+
+# выставляется после выдачи из запаса: invite_pool_job пополняет его, не дожидаясь периодической проверки
+_refill = asyncio.Event()
+
+
+def invite_from_row(row: dict) -> types.ChatInviteExported:
+    """ChatInviteExported из строки запаса или invites (для выдачи оператору)."""
+    def _dt(ts: Optional[int]) -> Optional[dt.datetime]:
+        return dt.datetime.fromtimestamp(ts, tz=dt.timezone.utc) if ts else None
+
+    return types.ChatInviteExported(
+        link=row["link"],
+        admin_id=row.get("admin_id") or 0,
+        date=_dt(row["date_created"]),
+        expire_date=_dt(row["expire_date"]),
+        usage_limit=row["usage_limit"],
+        request_needed=bool(row["request_needed"]),
+        title=row["title"],
+        usage=row.get("usage") or 0,
+    )
+
+
+OnLink = Callable[[int, types.ChatInviteExported], Awaitable[None]]
+
+
+async def take_links(
+    client: user_service.Client,
+    chat_id: int | str,
+    titles: List[Optional[str]],
+    *,
+    rename: bool,
+    window: Optional[int] = None,
+    on_link: Optional[OnLink] = None,
+) -> List[types.ChatInviteExported]:
+    """
+    По ссылке на каждый title, в порядке titles: сначала из запаса (rename — переименовать
+    под title), остальные — новыми. Ссылка из запаса, которую не удалось переименовать
+    (например, её успели отозвать), заменяется новой.
+    on_link(i, invite) ждётся, как только готова ссылка для titles[i] — до конца всей пачки.
+    Ссылки запаса, которые так и не были выданы (нет аккаунта-создателя, сбой, отмена),
+    возвращаются в запас.
+    """
+    rows = await claim_pool_invites(chat_id, len(titles)) if settings.invite_pool_size > 0 else []
+    out: List[Optional[types.ChatInviteExported]] = [None] * len(titles)
+    missing = list(range(len(rows), len(titles)))
+    sem = asyncio.Semaphore(max(1, window or settings.create_window))
+    pooled = [invite_from_row(r) for r in rows]    # ссылки запаса как есть сейчас (после переименования — новые)
+    spent: set[int] = set()                         # выданы или отвергнуты Telegram — в запас не возвращать
+
+    async def _ready(i: int, inv: types.ChatInviteExported) -> None:
+        out[i] = inv
+        if on_link is not None:
+            await on_link(i, inv)
+
+    async def _rename(i: int, inv: types.ChatInviteExported) -> None:
+        if not rename or titles[i] == inv.title:
+            await _ready(i, inv)
+            spent.add(i)
+            return
+        editor = client
+        if isinstance(client, AccountPool):
+            # чужую ссылку админ не переименует — только создавший её аккаунт
+            account = client.by_user_id(inv.admin_id)
+            if account is None or account.disabled is not None:
+                missing.append(i)
+                return
+            editor = client.only(account)
+        async with sem:
+            try:
+                renamed = await user_service.edit_invite_title(editor, chat_id, inv.link, titles[i])
+            except RPCError as e:
+                # Telegram ссылку не принял (например, её отозвали) — в запас она не вернётся
+                log.warning(f"[pool] {inv.link}: не удалось переименовать ({e!r}) — создаём новую")
+                spent.add(i)
+                missing.append(i)
+                return
+        pooled[i] = renamed
+        await _ready(i, renamed)
+        spent.add(i)
+
+    tasks = [asyncio.create_task(_rename(i, inv)) for i, inv in enumerate(pooled)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        # запас из базы уже удалён: невыданные ссылки кладём обратно, иначе они потеряны насовсем
+        unused = [inv for i, inv in enumerate(pooled) if i not in spent]
+        if unused:
+            returned = await add_pool_invites(unused, chat_id)
+            log.info(f"[pool] {chat_id}: не выдано из запаса {len(unused)}, возвращено {returned}")
+        if rows:
+            _refill.set()
+
+    if missing:
+        missing.sort()
+        created = await user_service.create_many(
+            client, chat_id, [titles[i] for i in missing], window=window,
+            on_created=(lambda j, inv: on_link(missing[j], inv)) if on_link is not None else None,
+        )
+        for i, inv in zip(missing, created):
+            out[i] = inv
+    log.info(f"[pool] {chat_id}: выдано {len(titles)} ссылок, из запаса {len(rows)}")
+    return [inv for inv in out if inv is not None]
+
+
+async def take_links_no_title(
+    client: user_service.Client, chat_id: int | str, count: int, *, window: Optional[int] = None,
+    on_link: Optional[OnLink] = None,
+) -> List[types.ChatInviteExported]:
+    return await take_links(
+        client, chat_id, user_service.no_title_titles(count), rename=False, window=window, on_link=on_link,
+    )
+
+
+async def take_links_with_titles(
+    client: user_service.Client, chat_id: int | str, titles: Iterable[str], *, window: Optional[int] = None,
+    on_link: Optional[OnLink] = None,
+) -> List[types.ChatInviteExported]:
+    return await take_links(
+        client, chat_id, user_service.prepare_titles(titles), rename=True, window=window, on_link=on_link,
+    )
+
+
+async def take_links_with_mask(
+    client: user_service.Client, chat_id: int | str, mask: str, count: int, *, window: Optional[int] = None,
+    on_link: Optional[OnLink] = None,
+) -> List[types.ChatInviteExported]:
+    return await take_links(
+        client, chat_id, user_service.mask_titles(mask, count), rename=True, window=window, on_link=on_link,
+    )
+
+
+async def invite_pool_job(
+    user_client: user_service.Client,
+    chat_id: int | str,
+    stop_event: Optional[asyncio.Event] = None,
+    size: Optional[int] = None,
+) -> None:
+    """
+    Держит в запасе чата size (по умолчанию settings.invite_pool_size) ссылок.
+    Пополняет сразу после выдачи из запаса и раз в settings.invite_pool_check_sec.
+    """
+    size = settings.invite_pool_size if size is None else size
+    if size <= 0:
+        return
+    log.info(f"[pool] {chat_id}: запас {size} ссылок")
+    while not (stop_event and stop_event.is_set()):
+        _refill.clear()
+        try:
+            need = size - await count_pool_invites(chat_id)
+            if need > 0:
+                # создание запаса — фоновое: выдача операторам и их запросы идут первыми
+                with get_limiter().background():
+                    created = await user_service.create_links_no_title(user_client, chat_id, need)
+                added = await add_pool_invites(created, chat_id)
+                log.info(f"[pool] {chat_id}: пополнено на {added}, в запасе {size - need + added}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(f"[pool] {chat_id}: ошибка пополнения: {e}")
+
+        waits = [asyncio.ensure_future(_refill.wait())]
+        if stop_event is not None:
+            waits.append(asyncio.ensure_future(stop_event.wait()))
+        try:
+            await asyncio.wait(waits, timeout=settings.invite_pool_check_sec, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for w in waits:
+                w.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await asyncio.gather(*waits, return_exceptions=True)
+    log.info(f"[pool] {chat_id}: завершено")
@@ -0,0 +1,93 @@
+# services/join_tracker.py
+"""
+Вступления по пригласительным ссылкам в реальном времени — из апдейтов юзербота.
+
+Telegram присылает админу канала UpdateChannelParticipant (в обычных группах —
+UpdateChatParticipant) с полем invite — ссылкой, по которой человек вошёл.
+Каждое такое вступление сразу прибавляется к счётчикам ссылки (db.add_invite_joins);
+по ссылкам с заявками (request_needed) вступление — это одобренная заявка.
+Периодический полный проход планировщика при этом становится сверкой: он
+досчитывает пропущенные апдейты (счётчики только растут, поэтому берётся максимум
+из базы и API, а в историю идёт только недостающее).
+"""
+from __future__ import annotations
+
+import logging
+from collections import OrderedDict
+from typing import Iterable
+
+from telethon import TelegramClient, events
+from telethon.tl import types
+
+from services.db import add_invite_joins
+
+log = logging.getLogger("app")
+
+_PARTICIPANT_UPDATES = (types.UpdateChannelParticipant, types.UpdateChatParticipant)
+# «не участник»: вышел или забанен
+_GONE = (types.ChannelParticipantLeft, types.ChannelParticipantBanned)
+
+
+def _is_join(update) -> bool:
+    new, prev = update.new_participant, update.prev_participant
+    if new is None or isinstance(new, _GONE):
+        return False
+    return prev is None or isinstance(prev, _GONE)
+
+
+class _RecentKeys:
+    """Ограниченное множество недавно обработанных апдейтов (после переподключения Telegram шлёт их повторно)."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._keys: OrderedDict[tuple, None] = OrderedDict()
+
+    def add(self, key: tuple) -> bool:
+        """True — ключ новый."""
+        if key in self._keys:
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+        return True
+
+
+_stats = {"joins": 0, "approved": 0, "duplicates": 0, "ignored": 0}
+
+
+def get_join_stats() -> dict:
+    """Счётчики с момента старта: joins, approved, duplicates, ignored."""
+    return dict(_stats)
+
+
+def setup_join_tracking(user_client: TelegramClient | Iterable[TelegramClient], max_recent: int = 10000) -> None:
+    """
+    Регистрирует на юзерботе (или на каждом аккаунте пула) обработчик вступлений.
+    Аккаунт должен быть админом каналов, иначе Telegram не пришлёт invite в апдейте.
+    Одно вступление, пришедшее нескольким аккаунтам, учитывается один раз.
+    """
+    clients = [user_client] if isinstance(user_client, TelegramClient) else list(user_client)
+    recent = _RecentKeys(max_recent)
+
+    async def on_participant(update) -> None:
+        invite = getattr(update, "invite", None)
+        if not isinstance(invite, types.ChatInviteExported) or not _is_join(update):
+            _stats["ignored"] += 1
+            return
+        peer = getattr(update, "channel_id", None) or getattr(update, "chat_id", None)
+        if not recent.add((peer, update.user_id, invite.link, update.date)):
+            _stats["duplicates"] += 1
+            return
+        try:
+            if invite.request_needed:
+                _stats["approved"] += 1
+                await add_invite_joins(invite.link, d_approved=1)
+            else:
+                _stats["joins"] += 1
+                await add_invite_joins(invite.link, d_usage=1)
+        except Exception as e:
+            log.exception(f"[joins] не удалось учесть вступление по {invite.link}: {e}")
+
+    for client in clients:
+        client.add_event_handler(on_participant, events.Raw(types=list(_PARTICIPANT_UPDATES)))
+    log.info(f"[joins] отслеживание вступлений по апдейтам включено ({len(clients)} акк.)")
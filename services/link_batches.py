@@ -0,0 +1,95 @@
+# services/link_batches.py
+"""
+Пачки ссылок оператору как возобновляемые задания.
+
+Пачка заводится в link_batches под ключом идемпотентности (batch_key: оператор, чат
+и параметры запроса), каждая ссылка пишется в invites с владельцем сразу, как только
+готова (add_link_batch_item) — а не одним insert в конце, когда сбой на 37-й из 50
+терял 36 уже созданных. Повтор того же запроса в пределах settings.link_batch_resume_sec
+продолжает пачку: готовые ссылки берутся из базы, создаются только недостающие.
+Одинаковые запросы, идущие одновременно, получают разные ключи (см. LinkJobQueue.busy)
+и одну пачку не делят.
+Выданная целиком пачка забывается.
+
+    key = batch_key(user_id, chat_id, "mask", mask, n)
+    links = await take_batch(user_client, user_id, chat_id, key, user_service.mask_titles(mask, n), rename=True)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import time
+from typing import Callable, List, Optional
+
+from telethon.tl import types
+
+from config import settings
+from services import invite_pool, user_service
+from services.db import add_link_batch_item, finish_link_batch, get_link_batch, start_link_batch
+
+log = logging.getLogger("app")
+
+
+class LinkBatchError(RuntimeError):
+    """Пачка прервалась: done из total ссылок уже созданы и сохранены, повтор запроса продолжит её."""
+
+    def __init__(self, done: int, total: int, cause: BaseException) -> None:
+        super().__init__(f"{type(cause).__name__}: {cause}")
+        self.done = done
+        self.total = total
+
+
+def batch_key(owner_tg_id: int, chat_id: int | str, mode: str, *params: object) -> str:
+    """Ключ идемпотентности пачки: тот же оператор, чат и запрос — та же пачка."""
+    raw = json.dumps([owner_tg_id, str(chat_id), mode, *params], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+async def take_batch(
+    client: user_service.Client,
+    owner_tg_id: int,
+    chat_id: int | str,
+    key: str,
+    titles: List[Optional[str]],
+    *,
+    rename: bool,
+    window: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> List[types.ChatInviteExported]:
+    """
+    Ссылки пачки key в порядке titles (см. invite_pool.take_links), каждая пишется в базу
+    с владельцем owner_tg_id сразу после создания. Незаконченная пачка с тем же ключом
+    продолжается — с её исходными titles. Сбой — LinkBatchError (готовые ссылки уже в базе).
+    progress(done, total) зовётся на старте и после каждой сохранённой ссылки.
+    """
+    batch = await get_link_batch(key)
+    if batch is not None and time.time() - batch["updated_at"] <= settings.link_batch_resume_sec:
+        titles = batch["titles"]
+        done = {idx: invite_pool.invite_from_row(row) for idx, row in batch["links"].items()}
+        log.info(f"[batch] {key[:8]}: продолжаем пачку, готово {len(done)} из {len(titles)}")
+    else:
+        await start_link_batch(key, owner_tg_id, chat_id, titles)
+        done = {}
+
+    todo = [i for i in range(len(titles)) if i not in done]
+    if progress is not None:
+        progress(len(done), len(titles))
+
+    async def _save(j: int, inv: types.ChatInviteExported) -> None:
+        await add_link_batch_item(key, todo[j], inv, chat_id, owner_tg_id)
+        done[todo[j]] = inv
+        if progress is not None:
+            progress(len(done), len(titles))
+
+    if todo:
+        try:
+            await invite_pool.take_links(
+                client, chat_id, [titles[i] for i in todo], rename=rename, window=window, on_link=_save,
+            )
+        except Exception as e:
+            log.warning(f"[batch] {key[:8]}: прервана на {len(done)} из {len(titles)}: {e!r}")
+            raise LinkBatchError(len(done), len(titles), e) from e
+
+    await finish_link_batch(key)
+    return [done[i] for i in range(len(titles)) if i in done]
@@ -0,0 +1,194 @@
+# services/link_jobs.py
+"""
+Очередь заданий на создание ссылок.
+
+Хендлер бота только ставит задание (таблица link_jobs) и сразу отвечает оператору —
+сотня ссылок с FloodWait больше не держит его обработчик минутами. Задания выполняет
+пул из settings.link_jobs_workers воркеров; операторы обслуживаются по кругу, у одного
+оператора одновременно идёт не больше settings.link_jobs_per_user заданий, так что
+чужая длинная пачка не задерживает короткую. Задание, которое ещё ждёт, отменяется
+сразу; выполняющееся — через отмену его задачи. Очередь живёт в базе: после рестарта
+незаконченные задания ставятся заново, а их пачки (services/link_batches.py)
+продолжаются с того места, где остановились.
+
+    jobs = LinkJobQueue(runner)        # runner(job) — выполнить одно задание
+    await jobs.start()
+    job_id = await jobs.submit(user_id, chat_id, "mask", {"mask": mask, "n": n}, key, message_id)
+    ...
+    await jobs.stop()
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import Counter, OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+from config import settings
+from services.db import add_link_job, finish_link_job, list_link_jobs, start_link_job
+
+log = logging.getLogger("app")
+
+Runner = Callable[[dict], Awaitable[None]]
+
+
+class LinkJobQueue:
+    def __init__(self, runner: Runner, *, workers: Optional[int] = None, per_user: Optional[int] = None) -> None:
+        self._runner = runner
+        self.workers = max(1, workers or settings.link_jobs_workers)
+        self.per_user = max(1, per_user or settings.link_jobs_per_user)
+        self._pending: OrderedDict[int, deque[dict]] = OrderedDict()     # оператор -> его задания по порядку
+        self._running: dict[int, tuple[dict, asyncio.Task]] = {}           # id задания -> (задание, задача)
+        self._busy: Counter[int] = Counter()                               # оператор -> выполняющихся заданий
+        self._keys: Counter[str] = Counter()                               # ключ пачки -> заданий в очереди и в работе
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.stopping = False
+
+    async def start(self) -> None:
+        """Поднять незаконченные задания из базы и запустить раздачу воркерам."""
+        # задания, поставленные до start(), уже в памяти
+        queued = {j["id"] for q in self._pending.values() for j in q}
+        restored = [j for j in await list_link_jobs() if j["id"] not in queued]
+        for job in restored:
+            self._keys[job["batch_key"]] += 1
+            self._push(job)
+        if restored:
+            log.info(f"[jobs] восстановлено заданий после рестарта: {len(restored)}")
+        self._dispatcher = asyncio.create_task(self._dispatch(), name="link_jobs")
+
+    async def stop(self) -> None:
+        """Остановить воркеры. Прерванные задания остаются в базе и продолжатся при следующем start()."""
+        self.stopping = True
+        tasks = [t for _, t in self._running.values()]
+        if self._dispatcher is not None:
+            tasks.append(self._dispatcher)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def submit(
+        self,
+        owner_tg_id: int,
+        chat_id: int | str,
+        kind: str,
+        params: dict,
+        batch_key: str,
+        message_id: Optional[int] = None,
+    ) -> int:
+        """Поставить задание в очередь. Возвращает id задания."""
+        # ключ занимается до первого await: busy() сразу видит задание
+        self._keys[batch_key] += 1
+        try:
+            job_id = await add_link_job(owner_tg_id, chat_id, kind, params, batch_key, message_id)
+        except BaseException:
+            self._release(batch_key)
+            raise
+        self._push({
+            "id": job_id, "owner_tg_id": owner_tg_id, "chat_id": str(chat_id), "kind": kind, "params": params,
+            "batch_key": batch_key, "message_id": message_id, "status": "queued",
+        })
+        return job_id
+
+    async def cancel(self, owner_tg_id: int, message_id: int) -> Optional[str]:
+        """
+        Отменить задание оператора по его статусному сообщению. Возвращает, в каком
+        состоянии его застала отмена: "queued" (снято из очереди) или "running" (задача
+        отменена — итог в статус пишет сам runner); None — такого задания уже нет.
+        """
+        queue = self._pending.get(owner_tg_id)
+        job = next((j for j in queue or () if j["message_id"] == message_id), None)
+        if job is not None:
+            queue.remove(job)
+            if not queue:
+                del self._pending[owner_tg_id]
+            self._release(job["batch_key"])
+            await finish_link_job(job["id"])
+            log.info(f"[jobs] #{job['id']}: отменено до запуска")
+            return "queued"
+        for job, task in self._running.values():
+            if job["owner_tg_id"] == owner_tg_id and job["message_id"] == message_id:
+                task.cancel()
+                return "running"
+        return None
+
+    def busy(self, batch_key: str) -> bool:
+        """Есть ли в очереди или в работе задание с этим ключом пачки."""
+        return self._keys[batch_key] > 0
+
+    def ahead(self) -> int:
+        """Сколько заданий сейчас ждёт в очереди — оценка для ответа оператору."""
+        return sum(len(q) for q in self._pending.values())
+
+    def snapshot(self) -> dict:
+        """Состояние очереди: workers, per_user, running ({оператор: заданий}), pending ({оператор: заданий})."""
+        return {
+            "workers": self.workers,
+            "per_user": self.per_user,
+            "running": dict(self._busy),
+            "pending": {owner: len(q) for owner, q in self._pending.items()},
+        }
+
+    def _release(self, batch_key: str) -> None:
+        self._keys[batch_key] -= 1
+        if self._keys[batch_key] <= 0:
+            del self._keys[batch_key]
+
+    def _push(self, job: dict) -> None:
+        self._pending.setdefault(job["owner_tg_id"], deque()).append(job)
+        self._wakeup.set()
+
+    def _next(self) -> Optional[dict]:
+        """Следующее задание по кругу между операторами, не превышая лимиты."""
+        if len(self._running) >= self.workers:
+            return None
+        for owner, queue in self._pending.items():
+            if self._busy[owner] >= self.per_user:
+                continue
+            job = queue.popleft()
+            if queue:
+                self._pending.move_to_end(owner)
+            else:
+                del self._pending[owner]
+            return job
+        return None
+
+    async def _dispatch(self) -> None:
+        while True:
+            job = self._next()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            self._busy[job["owner_tg_id"]] += 1
+            task = asyncio.create_task(self._run(job), name=f"link_job_{job['id']}")
+            self._running[job["id"]] = (job, task)
+
+    async def _run(self, job: dict) -> None:
+        job_id, owner = job["id"], job["owner_tg_id"]
+        done = False
+        try:
+            await start_link_job(job_id)
+            log.info(f"[jobs] #{job_id}: старт ({job['kind']}, оператор {owner})")
+            await self._runner(job)
+            done = True
+        except asyncio.CancelledError:
+            # отмена оператором — задание снимается; остановка бота — остаётся в базе до рестарта
+            done = not self.stopping
+            if done:
+                log.info(f"[jobs] #{job_id}: отменено оператором")
+        except Exception as e:
+            done = True
+            log.exception(f"[jobs] #{job_id}: ошибка: {e}")
+        finally:
+            self._running.pop(job_id, None)
+            self._release(job["batch_key"])
+            self._busy[owner] -= 1
+            if self._busy[owner] <= 0:
+                del self._busy[owner]
+            self._wakeup.set()
+        if done:
+            try:
+                await finish_link_job(job_id)
+            except Exception as e:
+                log.error(f"[jobs] #{job_id}: не удалось снять задание из очереди: {e!r}")
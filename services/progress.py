@@ -0,0 +1,101 @@
+# services/progress.py
+"""
+Живой прогресс долгих заданий в статусном сообщении бота.
+
+Редактировать статус после каждой ссылки — тратить на это лимит Bot API. Поэтому
+цикл создания или выгрузка только сообщает счётчики (update(done, total)). Раз в
+settings.progress_interval_sec сообщение правится последним состоянием: сделано,
+оценка оставшегося времени и текущий FloodWait юзербота. Если текст не изменился,
+правки нет. Если бот сам словил FloodWait на правке, правки пропускаются, пока он
+не истечёт.
+
+    async with ProgressReporter(edit, render, flood=lambda: pool.parked_for("create")) as progress:
+        links = await take_batch(..., progress=progress.update)
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from telethon.errors import FloodWaitError
+
+from config import settings
+
+log = logging.getLogger("app")
+
+# render(done, total, eta_sec, flood_sec) -> текст статуса; total и eta_sec могут быть неизвестны (None)
+Render = Callable[[int, Optional[int], Optional[float], float], str]
+
+
+class ProgressReporter:
+    def __init__(
+        self,
+        edit: Callable[[str], Awaitable[None]],
+        render: Render,
+        *,
+        interval: Optional[float] = None,
+        flood: Optional[Callable[[], float]] = None,
+    ) -> None:
+        self._edit = edit
+        self._render = render
+        self.interval = settings.progress_interval_sec if interval is None else interval
+        self._flood = flood
+        self.done = 0
+        self.total: Optional[int] = None
+        self._base: Optional[tuple[float, int]] = None     # (время, done) первого update — для скорости
+        self._shown: Optional[str] = None
+        self._not_before = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, done: int, total: Optional[int] = None) -> None:
+        """Новое состояние счётчиков; на экран попадёт при следующей правке."""
+        if self._base is None:
+            self._base = (time.monotonic(), done)
+        self.done = done
+        if total is not None:
+            self.total = total
+
+    def eta(self) -> Optional[float]:
+        """Секунд до конца по средней скорости с начала отчёта (готовое до старта не в счёт)."""
+        if self._base is None or self.total is None:
+            return None
+        started, base = self._base
+        made = self.done - base
+        if made <= 0:
+            return None
+        return max(0.0, (self.total - self.done) * (time.monotonic() - started) / made)
+
+    async def flush(self) -> None:
+        """Показать текущее состояние, если оно изменилось и бот не стоит на FloodWait."""
+        if time.monotonic() < self._not_before:
+            return
+        text = self._render(self.done, self.total, self.eta(), self._flood() if self._flood else 0.0)
+        if text == self._shown:
+            return
+        try:
+            await self._edit(text)
+            self._shown = text
+        except FloodWaitError as e:
+            self._not_before = time.monotonic() + e.seconds
+            log.info(f"[progress] правка статуса отложена на {e.seconds} сек (FloodWait бота)")
+        except Exception as e:
+            log.debug(f"[progress] не удалось обновить статус: {e!r}")
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def __aenter__(self) -> "ProgressReporter":
+        self._task = asyncio.create_task(self._loop(), name="progress")
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        # последнее состояние не дорисовываем: после задания статус заменяется итогом
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
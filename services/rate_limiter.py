@@ -0,0 +1,271 @@
+# services/rate_limiter.py
+"""
+Общий на процесс ограничитель запросов юзербота.
+
+По token bucket на класс методов (create / list / get / other): запрос ждёт токен,
+токены пополняются со скоростью rate. Скорость подстраивается по AIMD:
+каждый успешный запрос прибавляет к ней немного (additive increase), FloodWait
+делит её пополам (multiplicative decrease) и «паркует» класс на время, указанное
+Telegram. Так мы держимся у реального лимита, а не у угаданной константы.
+
+    limiter = get_limiter()
+    await limiter.acquire("create")
+    ... запрос ...
+    limiter.on_success("create")   # или limiter.on_flood("create", e.seconds)
+
+Приоритеты: запросы из `async with limiter.interactive():` (действия оператора в боте)
+обслуживаются раньше фоновых (`with limiter.background():` — синк). Внутри класса
+очередь идёт по (приоритет, порядок прихода); пока есть активные интерактивные задачи,
+фоновые запросы всех классов ждут (не дольше background_max_yield_sec), то есть синк
+уступает между страницами. FloodWait паркует только свой класс.
+
+С пулом аккаунтов (services/accounts.py) у каждого аккаунта свой ограничитель —
+FloodWait одного аккаунта не тормозит остальные; приоритеты при этом общие на процесс.
+eta(kind) — сколько ждать следующего запроса, по ней пул выбирает наименее занятый аккаунт.
+
+Состояние — limiter.snapshot().
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterator, Optional
+
+from config import settings
+
+# стартовые скорости (запросов/сек) по классам; переопределяются USERBOT_RATES="create=0.5,list=2"
+DEFAULT_RATES: dict[str, float] = {"create": 1.0, "list": 2.0, "get": 3.0, "other": 5.0}
+
+# класс запроса по имени TL-метода
+_KINDS: dict[str, str] = {
+    "ExportChatInviteRequest": "create",
+    "EditExportedChatInviteRequest": "create",
+    "GetExportedChatInvitesRequest": "list",
+    "GetAdminsWithInvitesRequest": "list",
+    "GetExportedChatInviteRequest": "get",
+}
+
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("userbot_priority", default=INTERACTIVE)
+
+
+class _Interactive:
+    """Активные интерактивные задачи — общие для всех ограничителей процесса."""
+
+    def __init__(self) -> None:
+        self.active = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+
+_interactive = _Interactive()
+
+
+def request_kind(request: object) -> str:
+    """Класс лимита для TL-запроса (по умолчанию other)."""
+    return _KINDS.get(type(request).__name__, "other")
+
+
+@dataclass
+class _Bucket:
+    rate: float                 # текущая скорость, токенов/сек
+    min_rate: float
+    max_rate: float
+    burst: float                # ёмкость ведра
+    tokens: float = 0.0
+    updated: float = field(default_factory=time.monotonic)
+    parked_until: float = 0.0   # до этого момента класс стоит (FloodWait)
+    queue: list = field(default_factory=list)              # heap: (приоритет, порядок прихода)
+    changed: asyncio.Condition = field(default_factory=asyncio.Condition)
+    successes: int = 0
+    floods: int = 0
+    waited_sec: float = 0.0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """
+    Token bucket на класс методов с AIMD-подстройкой скорости.
+    increase — на сколько запросов/сек растёт скорость за успешный запрос,
+    decrease — во сколько раз падает после FloodWait.
+    """
+
+    def __init__(
+        self,
+        rates: Optional[dict[str, float]] = None,
+        *,
+        increase: float = 0.02,
+        decrease: float = 0.5,
+        min_factor: float = 0.05,
+        max_factor: float = 3.0,
+        background_max_yield_sec: float = 30.0,
+    ) -> None:
+        self.increase = increase
+        self.decrease = decrease
+        # дольше этого фоновый запрос интерактивным не уступает (чтобы синк не голодал совсем)
+        self.background_max_yield_sec = background_max_yield_sec
+        self._seq = itertools.count()
+        self._buckets: dict[str, _Bucket] = {}
+        for kind, rate in {**DEFAULT_RATES, **(rates or {})}.items():
+            self._buckets[kind] = self._new_bucket(rate, min_factor, max_factor)
+        self._min_factor, self._max_factor = min_factor, max_factor
+
+    @staticmethod
+    def _new_bucket(rate: float, min_factor: float, max_factor: float) -> _Bucket:
+        rate = max(rate, 0.01)
+        burst = max(1.0, rate)
+        # стартуем с полным ведром: первые запросы после запуска не ждут
+        return _Bucket(rate=rate, min_rate=rate * min_factor, max_rate=rate * max_factor,
+                       burst=burst, tokens=burst)
+
+    def _bucket(self, kind: str) -> _Bucket:
+        bucket = self._buckets.get(kind)
+        if bucket is None:
+            bucket = self._buckets[kind] = self._new_bucket(
+                self._buckets["other"].rate if "other" in self._buckets else 1.0,
+                self._min_factor, self._max_factor,
+            )
+        return bucket
+
+    # ---- приоритеты ----
+
+    @contextlib.contextmanager
+    def background(self) -> Iterator[None]:
+        """Запросы внутри (и в задачах, созданных внутри) — фоновые."""
+        token = _priority.set(BACKGROUND)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    @contextlib.asynccontextmanager
+    async def interactive(self) -> AsyncIterator[None]:
+        """Интерактивная задача: пока она идёт, фоновые запросы уступают."""
+        token = _priority.set(INTERACTIVE)
+        _interactive.active += 1
+        _interactive.idle.clear()
+        try:
+            yield
+        finally:
+            _interactive.active -= 1
+            if not _interactive.active:
+                _interactive.idle.set()
+            _priority.reset(token)
+
+    # ---- токены ----
+
+    async def acquire(self, kind: str = "other") -> None:
+        """
+        Дождаться разрешения на один запрос класса kind.
+        Очередь класса — по (приоритет, порядок прихода); фоновые ещё и уступают интерактивным задачам.
+        """
+        bucket = self._bucket(kind)
+        started = time.monotonic()
+        priority = _priority.get()
+        if priority == BACKGROUND and _interactive.active:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(_interactive.idle.wait(), timeout=self.background_max_yield_sec)
+
+        ticket = (priority, next(self._seq))
+        heapq.heappush(bucket.queue, ticket)
+        try:
+            async with bucket.changed:
+                bucket.changed.notify_all()     # пусть текущая голова очереди перепроверит, не мы ли срочнее
+                while True:
+                    delay = None
+                    if bucket.queue[0] == ticket:
+                        now = time.monotonic()
+                        if now < bucket.parked_until:
+                            delay = bucket.parked_until - now
+                        else:
+                            bucket.refill(now)
+                            if bucket.tokens >= 1.0:
+                                bucket.tokens -= 1.0
+                                break
+                            delay = (1.0 - bucket.tokens) / bucket.rate
+                    # ждём своей очереди или токена; новый, более срочный запрос будит и перехватывает голову
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(bucket.changed.wait(), timeout=delay)
+        finally:
+            bucket.queue.remove(ticket)
+            heapq.heapify(bucket.queue)
+            async with bucket.changed:
+                bucket.changed.notify_all()
+        bucket.waited_sec += time.monotonic() - started
+
+    def eta(self, kind: str = "other") -> float:
+        """Оценка ожидания (сек) нового запроса класса kind: стоянка + нехватка токенов + очередь."""
+        bucket = self._bucket(kind)
+        now = time.monotonic()
+        start = max(now, bucket.parked_until, bucket.updated)
+        tokens = min(bucket.burst, bucket.tokens + max(0.0, now - bucket.updated) * bucket.rate)
+        deficit = len(bucket.queue) + 1 - tokens
+        return (start - now) + max(0.0, deficit) / bucket.rate
+
+    def parked_for(self, kind: str = "other") -> float:
+        """Сколько ещё секунд класс kind стоит на FloodWait (0 — не стоит)."""
+        return max(0.0, self._bucket(kind).parked_until - time.monotonic())
+
+    def on_success(self, kind: str = "other") -> None:
+        bucket = self._bucket(kind)
+        bucket.successes += 1
+        bucket.rate = min(bucket.max_rate, bucket.rate + self.increase)
+        bucket.burst = max(1.0, bucket.rate)
+
+    def on_flood(self, kind: str, seconds: float) -> None:
+        """FloodWait на классе kind: скорость вниз, класс стоит seconds секунд, ведро пустое."""
+        bucket = self._bucket(kind)
+        now = time.monotonic()
+        bucket.floods += 1
+        # несколько запросов в полёте ловят один и тот же FloodWait — снижаем скорость один раз
+        if now >= bucket.parked_until:
+            bucket.rate = max(bucket.min_rate, bucket.rate * self.decrease)
+            bucket.burst = max(1.0, bucket.rate)
+        bucket.parked_until = max(bucket.parked_until, now + max(0.0, seconds))
+        bucket.tokens = 0.0
+        bucket.updated = bucket.parked_until
+
+    def snapshot(self) -> dict[str, dict]:
+        """
+        Состояние по классам: rate, tokens, parked_for, successes, floods, waited_sec,
+        waiting (сколько запросов в очереди: interactive / background).
+        """
+        now = time.monotonic()
+        out = {}
+        for kind, b in self._buckets.items():
+            tokens = min(b.burst, b.tokens + max(0.0, now - b.updated) * b.rate)
+            out[kind] = {
+                "rate": round(b.rate, 3),
+                "tokens": round(tokens, 2),
+                "parked_for": round(max(0.0, b.parked_until - now), 1),
+                "successes": b.successes,
+                "floods": b.floods,
+                "waited_sec": round(b.waited_sec, 1),
+                "waiting": {
+                    "interactive": sum(1 for p, _ in b.queue if p == INTERACTIVE),
+                    "background": sum(1 for p, _ in b.queue if p == BACKGROUND),
+                },
+            }
+        return out
+
+
+_limiter: Optional[RateLimiter] = None
+
+
+def get_limiter() -> RateLimiter:
+    """Общий ограничитель процесса (создаётся при первом обращении)."""
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter(settings.userbot_rates)
+    return _limiter
@@ -1,26 +1,174 @@
 # services/scheduler.py
 from __future__ import annotations
 import asyncio
+import heapq
 import logging
-from typing import Optional
-from telethon import TelegramClient
+import contextlib
+import datetime as dt
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Iterable, Optional
+
+from telethon.errors import RPCError
 
 from services import user_service
-from services.db import insert_many_from_exported  # если у тебя другой апдейтер — замени здесь
+from services.rate_limiter import get_limiter
+from config import settings
+from services.db import (
+    get_invite_fingerprints, invite_fingerprint, save_sync_delta, compact_stats_history,
+    check_owner_stats, rebuild_owner_stats, bump_chat_version, optimize_db, get_top_growing_links,
+    list_sync_chats, record_sync_run, flush_writes, get_sync_cursor,
+)
+
+
+def _cursor_to_db(cursor: user_service.PageCursor) -> tuple[bool, Optional[int], Optional[str], Optional[int]]:
+    revoked, offset_date, offset_link, admin_id = cursor
+    return revoked, int(offset_date.timestamp()) if offset_date else None, offset_link, admin_id
+
+
+def _cursor_from_db(row: dict) -> user_service.PageCursor:
+    ts = row["offset_date"]
+    return (
+        bool(row["revoked"]),
+        dt.datetime.fromtimestamp(ts, tz=dt.timezone.utc) if ts else None,
+        row["offset_link"],
+        row.get("admin_id"),
+    )
+
+
+class _LinkHeat:
+    """
+    «Температура» ссылок: экспоненциально затухающая сумма приростов (usage + approved).
+    Полураспад half_life_sec; rate() — оценка скорости в вступлениях/час.
+    """
+
+    def __init__(self, half_life_sec: float) -> None:
+        self._half_life = max(1.0, float(half_life_sec))
+        self._score: dict[str, tuple[float, float]] = {}   # link -> (score, monotonic-время)
+
+    def _decayed(self, link: str, now: float) -> float:
+        score, ts = self._score.get(link, (0.0, now))
+        return score * 0.5 ** ((now - ts) / self._half_life)
+
+    def add(self, link: str, delta: float, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        self._score[link] = (self._decayed(link, now) + delta, now)
+
+    def discard(self, links: Iterable[str]) -> None:
+        for link in links:
+            self._score.pop(link, None)
+
+    def rate(self, link: str, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        # установившийся score при скорости r (в сек) равен r * half_life / ln2
+        return self._decayed(link, now) * math.log(2) / self._half_life * 3600
+
+    def top(self, k: int, min_rate: float) -> list[str]:
+        now = time.monotonic()
+        rated = ((self.rate(link, now), link) for link in self._score)
+        return [link for r, link in heapq.nlargest(k, rated) if r >= min_rate]
+
+    def prune(self, min_rate: float) -> None:
+        """Забыть совсем остывшие ссылки, чтобы словарь не рос бесконечно."""
+        now = time.monotonic()
+        for link in [l for l in self._score if self.rate(l, now) < min_rate / 100]:
+            del self._score[link]
+
+
+class _FairPager:
+    """
+    Общий бюджет запросов к API на все чаты: не больше rate запросов в секунду,
+    очередной запрос отдаётся по кругу следующему ждущему чату. Темп самого юзербота
+    держит services/rate_limiter.py, здесь — только справедливость между чатами. Большой канал
+    получает свою долю, но не может занять всю полосу и задержать маленькие.
+    rate <= 0 — без ограничения.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._waiters: "OrderedDict[str, deque[asyncio.Future]]" = OrderedDict()
+        self._next_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def acquire(self, key: int | str) -> None:
+        if not self._interval:
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(str(key), deque()).append(fut)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch(), name="sync_fair_pager")
+        await fut
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            delay = self._next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # первый в очереди чат получает запрос и уходит в конец круга
+            key, queue = next(iter(self._waiters.items()))
+            fut = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            if fut.done():      # ожидавший отменён — слот не тратим
+                continue
+            fut.set_result(None)
+            self._next_at = time.monotonic() + self._interval
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+
+async def _maintenance(log: logging.Logger) -> None:
+    """Прореживание истории, сверка owner_stats и статистика планировщика SQLite."""
+    stats = await compact_stats_history()
+    log.info(f"[scheduler] история свёрнута: {stats}")
+    # заодно сверяем сводку по владельцам
+    diff = await check_owner_stats()
+    if diff:
+        log.warning(f"[scheduler] owner_stats разошлась с invites у {len(diff)} владельцев — пересобираем")
+        await rebuild_owner_stats()
+    await optimize_db()
+
 
 async def sync_invites_job(
-    user_client: TelegramClient,
+    user_client: user_service.Client,
     chat_id: int | str,
-    interval_sec: int = 300,            # период опроса (сек)
+    interval_sec: int = 300,            # период полного прохода (сек)
     stop_event: Optional[asyncio.Event] = None,
     include_revoked: bool = False,      # нужно ли подтягивать отозванные
+    *,
+    slots: Optional[asyncio.Semaphore] = None,   # общий лимит одновременно синкаемых чатов
+    pager: Optional[_FairPager] = None,          # общий бюджет запросов к API
+    maintenance: bool = True,                    # обслуживание БД (в мультичатовом режиме — у sync_chats_job)
+    realtime: bool = False,                      # вступления приходят апдейтами (services/join_tracker.py)
 ) -> None:
     """
     Периодически обновляет в БД статистику по пригласительным ссылкам канала.
+    Полный проход по всем ссылкам — раз в interval_sec (он же находит новые ссылки);
+    между ними раз в settings.sync_hot_interval_sec точечно перечитываются «горячие»
+    ссылки — самые быстрорастущие за последнее время (см. _LinkHeat).
+    realtime=True — счётчики ведёт services/join_tracker.py, а полный проход только сверяет
+    их с API: горячих обновлений нет, отпечатки перед каждым проходом читаются из базы.
+    С settings.sync_all_admins полный проход листает ссылки всех админов чата
+    (GetAdminsWithInvites, до settings.sync_admin_concurrency админов одновременно), пропуская
+    тех, у кого с прошлого листания не изменилось число ссылок (но не дольше
+    settings.sync_admin_recheck_sec); ссылки чужих админов записываются на них как на владельцев.
+    Пишутся только ссылки, у которых изменился отпечаток (usage, approved, revoked, expire);
+    штамп синхронизации чата ставится только полным проходом, итог прохода
+    (длительность, страницы, ошибки) — в реестр sync_chats.
     Завершается, когда stop_event установлен или задача отменена.
     """
     log = logging.getLogger("app")
-    log.info(f"[scheduler] старт: interval={interval_sec}s, chat_id={chat_id}, include_revoked={include_revoked}")
+    # в режиме realtime между сверками делать нечего — просыпаемся только к полному проходу
+    hot_interval = interval_sec if realtime else max(1, min(settings.sync_hot_interval_sec, interval_sec))
+    log.info(
+        f"[scheduler] старт: interval={interval_sec}s, hot_interval={hot_interval}s, "
+        f"chat_id={chat_id}, include_revoked={include_revoked}, realtime={realtime}"
+    )
 
     # локальная обёртка ожидания, чтобы можно было выйти раньше, если пришёл stop_event
     async def _sleep_or_stop(seconds: float) -> bool:
@@ -33,38 +181,263 @@ async def sync_invites_job(
         except asyncio.TimeoutError:
             return False
 
+    # link -> отпечаток последней записанной версии; при первом цикле берём из БД,
+    # чтобы после рестарта не переписывать всю таблицу
+    fingerprints: Optional[dict[str, tuple]] = None
+    heat = _LinkHeat(settings.sync_hot_half_life_sec)
+    last_compact = 0.0
+    next_full = 0.0
+    # админ -> (активных ссылок, отозванных, monotonic-время) на момент последнего листания его ссылок
+    admin_counts: dict[int, tuple[int, int, float]] = {}
+    all_admins = settings.sync_all_admins      # гаснет, если аккаунту не видны чужие ссылки
+    own_ids: set[int] = set()                  # свои аккаунты: их ссылки владельца получают при выдаче
+
+    async def _save(links: list, *, full: bool, cursor: Optional[user_service.PageCursor] = None) -> int:
+        # Сохраняем в БД только изменившиеся ссылки (приросты для invite_stats_history
+        # save_sync_delta считает сам — от строки в базе) и греем выросшие
+        changed = []
+        owners: dict[str, int] = {}
+        fresh: dict[str, tuple] = {}
+        for inv in links:
+            fp = invite_fingerprint(inv)
+            old = fingerprints.get(inv.link)
+            if old != fp:
+                changed.append(inv)
+                fresh[inv.link] = fp
+                # ссылку создал чужой админ руками — она его
+                admin_id = getattr(inv, "admin_id", None)
+                if admin_id and admin_id not in own_ids:
+                    owners[inv.link] = admin_id
+                # первое появление ссылки — не рост, а накопленное за всё время
+                if old is None:
+                    continue
+                growth = max(fp[0] - old[0], 0) + max(fp[1] - old[1], 0)
+                if growth:
+                    heat.add(inv.link, growth)
+        if not changed and not full and cursor is None:
+            return 0
+        written = await save_sync_delta(
+            changed, chat_id, owner_tg_id=None, chat_synced=full,
+            cursor=_cursor_to_db(cursor) if cursor is not None else None, owners=owners,
+        )
+        fingerprints.update(fresh)
+        # кэш выборок чата сбрасываем, только если данные правда сменились: записаны ссылки
+        # или полный проход сдвинул штамп чата (last_synced_at); пустой чекпоинт страницы — нет
+        if written or full:
+            bump_chat_version(chat_id)
+        return written
+
+    requests = 0     # запросов к API в текущем цикле (для полного прохода — страниц)
+
+    async def _before_request() -> None:
+        nonlocal requests
+        requests += 1
+        if pager is not None:
+            await pager.acquire(chat_id)
+
+    async def _admins_to_list(
+        resume_admin: Optional[int],
+    ) -> tuple[Optional[dict[int, tuple[int, int]]], Optional[user_service.Client]]:
+        """
+        Админы для полного прохода с их счётчиками ссылок и клиент, которому видны чужие ссылки
+        (None, None — листать только свои ссылки).
+        Админ, у которого с прошлого листания не изменилось число ссылок, пропускается,
+        пока не пройдёт settings.sync_admin_recheck_sec.
+        """
+        nonlocal all_admins
+        if not all_admins:
+            return None, None
+        await _before_request()
+        try:
+            counts, lister = await user_service.get_admins_with_invites(user_client, chat_id)
+        except RPCError as e:
+            log.warning(f"[scheduler] {chat_id}: список админов недоступен ({e}) — листаем только свои ссылки")
+            all_admins = False
+            return None, None
+        now = time.monotonic()
+        todo = {
+            admin_id: c for admin_id, c in counts.items()
+            if (resume_admin is None or admin_id >= resume_admin)
+            and (admin_id not in admin_counts or admin_counts[admin_id][:2] != c
+                 or now - admin_counts[admin_id][2] >= settings.sync_admin_recheck_sec)
+        }
+        if len(todo) < len(counts):
+            log.info(f"[scheduler] {chat_id}: админов со ссылками {len(counts)}, листаем {len(todo)}")
+        return todo, lister
+
+    async def _cycle() -> None:
+        nonlocal fingerprints, next_full, own_ids
+        if fingerprints is None:
+            own_ids = await user_service.own_user_ids(user_client)
+            fingerprints = await get_invite_fingerprints(chat_id)
+            if not realtime:
+                # прогрев: что росло за последний полураспад, то и горячее
+                since = int(time.time()) - settings.sync_hot_half_life_sec
+                for row in await get_top_growing_links(chat_id, since, limit=settings.sync_hot_links * 2):
+                    heat.add(row["link"], row["growth"])
+
+        if time.monotonic() >= next_full:
+            started = time.monotonic()
+            if realtime:
+                # база ушла вперёд за счёт апдейтов: сравниваем с ней, а не с прошлым проходом,
+                # чтобы не переписывать ссылки, которые апдейты уже довели до значений API
+                await flush_writes()
+                fingerprints = await get_invite_fingerprints(chat_id)
+            # каждая страница пишется сразу вместе с позицией следующей;
+            # после сбоя, отмены или рестарта проход продолжается с неё
+            saved = await get_sync_cursor(chat_id)
+            if saved:
+                log.info(f"[scheduler] {chat_id}: продолжаем проход с сохранённой позиции ({saved['pages']} стр.)")
+            admins, lister = await _admins_to_list(saved.get("admin_id") if saved else None)
+            count = written = 0
+            # конвейер: пока страница N пишется в БД, страница N+1 уже запрашивается
+            pages = user_service.prefetch(user_service.iter_links_pages(
+                user_client,
+                chat_id,
+                include_revoked=include_revoked,
+                before_request=_before_request,
+                start=_cursor_from_db(saved) if saved else None,
+                admins=admins,
+                lister=lister,
+                concurrency=settings.sync_admin_concurrency,
+            ))
+            async for page, next_cursor in pages:
+                count += len(page)
+                written += await _save(page, full=False, cursor=next_cursor)
+            if admins:
+                listed_at = time.monotonic()
+                admin_counts.update({a: (*c, listed_at) for a, c in admins.items()})
+            next_full = time.monotonic() + interval_sec
+            log.info(f"[scheduler] {chat_id}: получено ссылок: {count}")
+            # проход закончен: штамп чата, позиция удаляется
+            await _save([], full=True)
+            heat.prune(settings.sync_hot_min_rate)
+            await record_sync_run(
+                chat_id, duration_ms=int((time.monotonic() - started) * 1000),
+                pages=requests, links=count, changed=written,
+            )
+            log.info(f"[scheduler] {chat_id}: сохранение в БД завершено: изменилось {written} из {count}")
+            return
+
+        hot = [] if realtime else heat.top(settings.sync_hot_links, settings.sync_hot_min_rate)
+        if hot:
+            links = await user_service.get_invites_by_links(
+                user_client, chat_id, hot, before_request=_before_request,
+            )
+            # не вернулись — удалены или недоступны; полный проход разберётся
+            heat.discard(set(hot) - {inv.link for inv in links})
+            if not include_revoked:
+                links = [inv for inv in links if not getattr(inv, "revoked", False)]
+            written = await _save(links, full=False)
+            log.info(f"[scheduler] {chat_id}: горячие ссылки: запрошено {len(hot)}, изменилось {written}")
+
     while True:
         # выход по сигналу остановки
         if stop_event and stop_event.is_set():
             log.info("[scheduler] stop_event set — выходим")
             break
 
+        started = time.monotonic()
+        requests = 0
         try:
-            links = await user_service.get_all_links(
-                user_client,
-                chat_id,
-                include_revoked=include_revoked,
-                delay_sec=0.6,   # мягкий рейтлимит между страницами
-                jitter_sec=0.3,
-            )
-            count = len(links)
-            log.info(f"[scheduler] получено ссылок: {count}")
+            async with (slots if slots is not None else contextlib.nullcontext()):
+                await _cycle()
 
-            # Сохраняем/обновляем в БД
-            # insert_many_from_exported — твоя функция; предполагаем, что она делает upsert.
-            await insert_many_from_exported(links, chat_id, owner_tg_id=None)
-            log.info("[scheduler] сохранение в БД завершено")
+            # прореживание истории — не чаще history_compact_sec
+            if maintenance and time.monotonic() - last_compact >= settings.history_compact_sec:
+                await _maintenance(log)
+                last_compact = time.monotonic()
 
         except asyncio.CancelledError:
-            log.info("[scheduler] задача отменена")
+            log.info(f"[scheduler] {chat_id}: задача отменена")
             break
         except Exception as e:
-            log.exception(f"[scheduler] ошибка при синхронизации: {e}")
+            log.exception(f"[scheduler] {chat_id}: ошибка при синхронизации: {e}")
+            # после ошибки полного прохода не долбим API сразу же
+            next_full = max(next_full, time.monotonic() + hot_interval)
+            with contextlib.suppress(Exception):
+                await record_sync_run(
+                    chat_id, duration_ms=int((time.monotonic() - started) * 1000),
+                    pages=requests, links=0, changed=0, error=f"{type(e).__name__}: {e}"[:500],
+                )
 
-        # ждём следующий цикл или выходим, если пришёл сигнал
-        should_stop = await _sleep_or_stop(interval_sec)
+        # ждём следующий цикл (горячий или полный) или выходим, если пришёл сигнал
+        wait = min(hot_interval, max(0.0, next_full - time.monotonic()))
+        should_stop = await _sleep_or_stop(max(wait, 1.0))
         if should_stop:
-            log.info("[scheduler] остановлено во время ожидания")
+            log.info(f"[scheduler] {chat_id}: остановлено во время ожидания")
             break
 
-    log.info("[scheduler] завершено")
+    log.info(f"[scheduler] {chat_id}: завершено")
+
+
+async def sync_chats_job(
+    user_client: user_service.Client,
+    interval_sec: int = 300,
+    stop_event: Optional[asyncio.Event] = None,
+    realtime: bool = False,
+) -> None:
+    """
+    Синхронизация всех включённых чатов из реестра sync_chats.
+    По задаче sync_invites_job на чат; одновременно синкается не больше
+    settings.sync_max_concurrent чатов, запросы к API делятся между ними поровну
+    (settings.sync_pages_per_sec, см. _FairPager). Реестр перечитывается раз в
+    settings.sync_registry_refresh_sec: новые чаты подхватываются, выключенные — останавливаются.
+    Обслуживание БД (история, owner_stats, optimize) — здесь, один раз на все чаты.
+    user_client — юзербот или пул аккаунтов (services/accounts.py): с пулом проход по чату
+    листает ссылки каждого аккаунта (или всех админов, см. sync_invites_job), а запросы
+    уходят наименее занятым аккаунтам.
+    realtime — см. sync_invites_job. Запросы синка идут с фоновым приоритетом
+    (services/rate_limiter.py): действия операторов в боте их опережают.
+    """
+    log = logging.getLogger("app")
+    slots = asyncio.Semaphore(max(1, settings.sync_max_concurrent))
+    pager = _FairPager(settings.sync_pages_per_sec)
+    tasks: dict[str, asyncio.Task] = {}
+    last_compact = time.monotonic()   # первый проход по чатам важнее обслуживания
+    log.info(
+        f"[scheduler] мультичат: concurrent={settings.sync_max_concurrent}, "
+        f"pages_per_sec={settings.sync_pages_per_sec}, realtime={realtime}"
+    )
+
+    try:
+        while not (stop_event and stop_event.is_set()):
+            try:
+                chats = {c["chat_id"]: c for c in await list_sync_chats(enabled_only=True)}
+                for chat_id in [c for c in tasks if c not in chats]:
+                    log.info(f"[scheduler] {chat_id}: выключен — останавливаем")
+                    tasks.pop(chat_id).cancel()
+                for chat_id, chat in chats.items():
+                    task = tasks.get(chat_id)
+                    if task is not None and not task.done():
+                        continue
+                    # задача наследует контекст: все её запросы к юзерботу — фоновые
+                    with get_limiter().background():
+                        tasks[chat_id] = asyncio.create_task(
+                            sync_invites_job(
+                                user_client, int(chat_id), interval_sec, stop_event,
+                                include_revoked=bool(chat["include_revoked"]),
+                                slots=slots, pager=pager, maintenance=False, realtime=realtime,
+                            ),
+                            name=f"sync_invites_job:{chat_id}",
+                        )
+
+                if time.monotonic() - last_compact >= settings.history_compact_sec:
+                    await _maintenance(log)
+                    last_compact = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception(f"[scheduler] ошибка реестра чатов: {e}")
+
+            if stop_event is None:
+                await asyncio.sleep(settings.sync_registry_refresh_sec)
+                continue
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop_event.wait(), timeout=settings.sync_registry_refresh_sec)
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        pager.close()
+        log.info("[scheduler] мультичат: завершено")
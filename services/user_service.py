@@ -1,16 +1,78 @@
 # services/user_service.py
 from __future__ import annotations
-import asyncio, random, logging
+import asyncio, contextlib, random, logging, weakref
 import datetime as dt
-from typing import Optional, Iterable, List, Callable, TypeVar
+from typing import Optional, Iterable, List, Callable, Awaitable, AsyncIterator, TypeVar, Union
 from telethon import TelegramClient
 from telethon.tl import functions, types
-from telethon.errors import FloodWaitError, RpcCallFailError
+from telethon.errors import (
+    FloodWaitError, RpcCallFailError, RPCError, ServerError, TimedOutError,
+    PeerIdInvalidError, ChannelInvalidError, ChatIdInvalidError, UserIdInvalidError,
+)
+
+from config import settings
+from services.accounts import AccountPool, NoAccountsError, SESSION_ERRORS, CONNECTION_ERRORS
+from services.rate_limiter import get_limiter
 
 T = TypeVar("T")
+# один юзербот или пул аккаунтов (services/accounts.py)
+Client = Union[TelegramClient, AccountPool]
 # Логгер общий для всего приложения
 log = logging.getLogger("app")
 
+# --------- Кэш резолва: InputPeer чатов, InputUser свой и админов ---------
+
+# Telegram не узнал peer/user из запроса — закэшированный access_hash устарел
+_PEER_ERRORS = (PeerIdInvalidError, ChannelInvalidError, ChatIdInvalidError, UserIdInvalidError)
+
+
+class _PeerCache:
+    """
+    Резолв по клиенту (access_hash у каждого аккаунта свой): InputPeer целевых чатов,
+    свой InputUser и InputUser других админов (из users в ответах Telegram).
+    Без кэша Telethon резолвит int-id через сессию на каждом запросе, а get_me — лишний RPC.
+    Сбрасывается только когда Telegram ответил peer-invalid ошибкой (_PEER_ERRORS).
+    """
+
+    def __init__(self) -> None:
+        self._peers: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()   # client -> {chat: InputPeer}
+        self._users: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()   # client -> {user_id: InputUser}
+        self._me: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()      # client -> InputUser
+        self.resolves = 0       # сколько раз резолвили по-настоящему
+
+    async def peer(self, client: TelegramClient, chat: int | str) -> types.TypeInputPeer:
+        peers = self._peers.setdefault(client, {})
+        peer = peers.get(chat)
+        if peer is None:
+            peer = peers[chat] = await client.get_input_entity(chat)
+            self.resolves += 1
+        return peer
+
+    async def me(self, client: TelegramClient) -> types.InputUser:
+        me = self._me.get(client)
+        if me is None:
+            p = await client.get_me(input_peer=True)
+            me = self._me[client] = types.InputUser(p.user_id, p.access_hash)
+            self.resolves += 1
+        return me
+
+    def remember_users(self, client: TelegramClient, users: Iterable[types.TypeUser]) -> None:
+        cache = self._users.setdefault(client, {})
+        for u in users:
+            if isinstance(u, types.User) and u.access_hash is not None:
+                cache[u.id] = types.InputUser(u.id, u.access_hash)
+
+    def user(self, client: TelegramClient, user_id: int) -> Optional[types.InputUser]:
+        return self._users.get(client, {}).get(user_id)
+
+    def invalidate(self, client: TelegramClient) -> None:
+        for cache in (self._peers, self._users, self._me):
+            cache.pop(client, None)
+
+
+_peers = _PeerCache()
+
+
 # --------- Общие helpers: задержка и повтор при FLOOD ---------
 
 async def _sleep_delay(base: float, jitter: float) -> None:
@@ -20,29 +82,42 @@ async def _sleep_delay(base: float, jitter: float) -> None:
         await asyncio.sleep(delay)
 
 async def _with_flood_retry(
-    coro_factory: Callable[[], "asyncio.Future[T]"],
+    client: Client,
+    coro_factory: Callable[[TelegramClient], Awaitable[T]],
     *,
+    kind: str = "other",
     max_retries: int = 5,
     flood_extra_sec: int = 1,
     on_retry: Callable[[int, Exception], None] | None = None,
 ) -> T:
     """
-    Безопасно выполняет Telethon-запрос:
-    - ловит FloodWaitError и ждёт e.seconds + flood_extra_sec
-    - повторяет до max_retries (для FloodWaitError — без ограничения)
+    Безопасно выполняет Telethon-запрос coro_factory(c) через лимитер аккаунта (services/rate_limiter.py):
+    - client — один клиент или пул аккаунтов (services/accounts.py); из пула каждая попытка
+      берёт аккаунт, который обслужит запрос раньше всех
+    - перед каждой попыткой ждёт токен класса kind (create / list / get / other)
+    - FloodWaitError: аккаунт снижает скорость и стоит e.seconds + flood_extra_sec,
+      повтор — на другом аккаунте пула, если он свободнее (без ограничения числа повторов)
+    - RpcCallFailError: повтор с backoff до max_retries
+    - мёртвая сессия / сбой соединения в пуле: аккаунт выводится из ротации, повтор на другом
+    - peer-invalid ошибка: кэш резолва клиента сбрасывается, один повтор с новым резолвом
     - логирует все ожидания
     """
     attempt = 0
+    peers_refreshed = False
     while True:
+        account = client.pick(kind) if isinstance(client, AccountPool) else None
+        limiter = account.limiter if account is not None else get_limiter()
+        await limiter.acquire(kind)
         try:
-            return await coro_factory()
+            result = await coro_factory(account.client if account is not None else client)
         except FloodWaitError as e:
             attempt += 1
             wait_time = e.seconds + flood_extra_sec
-            log.warning(f"[FloodWait] Попытка #{attempt}: ждём {wait_time} сек перед повтором")
+            limiter.on_flood(kind, wait_time)
+            who = f"{account.name}: " if account is not None else ""
+            log.warning(f"[FloodWait] {who}{kind}, попытка #{attempt}: класс стоит {wait_time} сек")
             if on_retry:
                 on_retry(attempt, e)
-            await asyncio.sleep(wait_time)
             continue
         except RpcCallFailError as e:
             attempt += 1
@@ -55,12 +130,31 @@ async def _with_flood_retry(
                 on_retry(attempt, e)
             await asyncio.sleep(backoff)
             continue
+        except _PEER_ERRORS as e:
+            if peers_refreshed:
+                raise
+            peers_refreshed = True
+            c = account.client if account is not None else client
+            log.warning(f"[peers] {e.__class__.__name__}: сбрасываем кэш резолва и повторяем")
+            _peers.invalidate(c)
+            continue
+        except (*SESSION_ERRORS, *CONNECTION_ERRORS) as e:
+            if account is None or not client.report_error(account, e):
+                raise
+            attempt += 1
+            if on_retry:
+                on_retry(attempt, e)
+            continue
+        limiter.on_success(kind)
+        if account is not None:
+            client.report_ok(account)
+        return result
 
 
 # --------- Создание одной ссылки ---------
 
 async def create_invite_link(
-    client: TelegramClient,
+    client: Client,
     target_chat: int | str,
     *,
     title: Optional[str] = None,
@@ -78,115 +172,461 @@ async def create_invite_link(
     if usage_limit is not None and usage_limit <= 0:
         usage_limit = None
 
-    def _do():
-        return client(functions.messages.ExportChatInviteRequest(
-            peer=target_chat,
+    async def _do(c: TelegramClient):
+        return await c(functions.messages.ExportChatInviteRequest(
+            peer=await _peers.peer(c, target_chat),
             title=(title[:32] if title else None),
             expire_date=expire_date,
             usage_limit=usage_limit,
             request_needed=request_needed,
         ))
 
-    return await _with_flood_retry(_do)
+    return await _with_flood_retry(client, _do, kind="create")
+
+
+async def edit_invite_title(
+    client: Client,
+    target_chat: int | str,
+    link: str,
+    title: Optional[str],
+) -> types.ChatInviteExported:
+    """
+    Переименовать существующую ссылку (EditExportedChatInviteRequest), вернуть её новую версию.
+    Чужие ссылки админ править не может — из пула передавайте pool.only(создатель ссылки).
+    """
+    async def _do(c: TelegramClient):
+        return await c(functions.messages.EditExportedChatInviteRequest(
+            peer=await _peers.peer(c, target_chat), link=link, title=(title[:32] if title else ""),
+        ))
+
+    res = await _with_flood_retry(client, _do, kind="create")
+    return res.invite
+
+# --------- Названия для пачек ---------
+
+def no_title_titles(count: int) -> List[Optional[str]]:
+    count = max(1, min(100, count))
+    ts = dt.datetime.now().strftime("%m%d%H%M")
+    return [f"Link {ts}-{i}" for i in range(1, count + 1)]
+
+def prepare_titles(titles: Iterable[str]) -> List[Optional[str]]:
+    prepared: List[Optional[str]] = []
+    for raw in titles:
+        t = (raw or "").strip()
+        prepared.append(t[:32] if t else None)
+    return prepared
+
+def mask_titles(mask: str, count: int) -> List[Optional[str]]:
+    count = max(1, min(100, count))
+    mask = (mask or "").strip()
+    titles: List[Optional[str]] = []
+    for i in range(1, count + 1):
+        title = mask.replace("{n}", str(i)) if "{n}" in mask else f"{mask} {i}".strip()
+        titles.append(title[:32] if title else None)
+    return titles
+
+# --------- Батчи: ограниченное окно параллельных запросов ---------
+
+# временные сбои, на которых один элемент батча стоит повторить целиком
+_TRANSIENT_ERRORS = (ServerError, TimedOutError, ConnectionError, asyncio.TimeoutError)
+
+
+async def create_many(
+            client: Client,
+            target_chat: int | str,
+            titles: List[Optional[str]],
+            *,
+            window: Optional[int] = None,
+            delay_sec: float = 0.0,
+            jitter_sec: float = 0.0,
+            item_retries: int = 2,
+            on_created: Optional[Callable[[int, types.ChatInviteExported], Awaitable[None]]] = None,
+        ) -> List[types.ChatInviteExported]:
+    """
+    Создать по ссылке на каждый title: до window запросов одновременно
+    (темп по-прежнему держит общий лимитер), результат — в порядке titles.
+    Временный сбой повторяется для своего элемента до item_retries раз;
+    любая другая ошибка отменяет ещё не созданные ссылки и пробрасывается.
+    on_created(i, invite) ждётся сразу после создания ссылки для titles[i]: то, что успело
+    создаться до ошибки, так не теряется.
+    """
+    window = max(1, window or settings.create_window)
+    sem = asyncio.Semaphore(window)
+    out: List[Optional[types.ChatInviteExported]] = [None] * len(titles)
+
+    async def _one(i: int, title: Optional[str]) -> None:
+        async with sem:
+            attempt = 0
+            while True:
+                try:
+                    out[i] = await create_invite_link(client, target_chat, title=title)
+                    break
+                except _TRANSIENT_ERRORS as e:
+                    attempt += 1
+                    if attempt > item_retries:
+                        raise
+                    log.warning(f"[create] ссылка #{i + 1}: повтор {attempt}/{item_retries} после {e!r}")
+                    await asyncio.sleep(min(2 ** attempt, 8))
+            if on_created is not None:
+                await on_created(i, out[i])
+            # пауза сверх лимитера — только если её явно попросили
+            await _sleep_delay(delay_sec, jitter_sec)
+
+    tasks = [asyncio.create_task(_one(i, t)) for i, t in enumerate(titles)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return [inv for inv in out if inv is not None]
 
-# --------- Батчи с равномерной задержкой между успешными запросами ---------
 
 async def create_links_no_title(
-            client: TelegramClient,
+            client: Client,
             target_chat: int | str,
             count: int,
             *,
-            delay_sec: float = 0.3,
-            jitter_sec: float = 0.2,
+            delay_sec: float = 0.0,     # темп задаёт общий лимитер; пауза — только если нужна сверх него
+            jitter_sec: float = 0.0,
+            window: Optional[int] = None,
         ) -> List[types.ChatInviteExported]:
-    count = max(1, min(100, count))
-    out: List[types.ChatInviteExported] = []
-    ts = dt.datetime.now().strftime("%m%d%H%M")
-    for i in range(1, count + 1):
-        title = f"Link {ts}-{i}"
-        inv = await create_invite_link(client, target_chat, title=title)
-        out.append(inv)
-        # задержка только ПОСЛЕ успешного запроса (межстраничный рейтлимит)
-        await _sleep_delay(delay_sec, jitter_sec)
-    return out
+    return await create_many(client, target_chat, no_title_titles(count),
+                             window=window, delay_sec=delay_sec, jitter_sec=jitter_sec)
 
 async def create_links_with_titles(
-            client: TelegramClient,
+            client: Client,
             target_chat: int | str,
             titles: Iterable[str],
             *,
-            delay_sec: float = 0.3,
-            jitter_sec: float = 0.2,
+            delay_sec: float = 0.0,     # темп задаёт общий лимитер; пауза — только если нужна сверх него
+            jitter_sec: float = 0.0,
+            window: Optional[int] = None,
         ) -> List[types.ChatInviteExported]:
-    out: List[types.ChatInviteExported] = []
-    for raw in titles:
-        t = (raw or "").strip()
-        inv = await create_invite_link(client, target_chat, title=(t[:32] if t else None))
-        out.append(inv)
-        await _sleep_delay(delay_sec, jitter_sec)
-    return out
+    return await create_many(client, target_chat, prepare_titles(titles),
+                             window=window, delay_sec=delay_sec, jitter_sec=jitter_sec)
 
 async def create_links_with_mask(
-            client: TelegramClient,
+            client: Client,
             target_chat: int | str,
             mask: str,
             count: int,
             *,
-            delay_sec: float = 0.3,
-            jitter_sec: float = 0.2,
+            delay_sec: float = 0.0,     # темп задаёт общий лимитер; пауза — только если нужна сверх него
+            jitter_sec: float = 0.0,
+            window: Optional[int] = None,
         ) -> List[types.ChatInviteExported]:
-    count = max(1, min(100, count))
-    mask = (mask or "").strip()
-    out: List[types.ChatInviteExported] = []
-    for i in range(1, count + 1):
-        title = mask.replace("{n}", str(i)) if "{n}" in mask else f"{mask} {i}".strip()
-        inv = await create_invite_link(client, target_chat, title=(title[:32] if title else None))
-        out.append(inv)
-        await _sleep_delay(delay_sec, jitter_sec)
-    return out
+    return await create_many(client, target_chat, mask_titles(mask, count),
+                             window=window, delay_sec=delay_sec, jitter_sec=jitter_sec)
+
+
+# позиция в списке ссылок: (revoked, offset_date, offset_link, admin_id) — какой список
+# листаем, с чего и чей (admin_id — user id аккаунта пула; None — единственный юзербот)
+PageCursor = tuple[bool, Optional[dt.datetime], Optional[str], Optional[int]]
+
+
+async def _iter_admin_pages(
+            client: Client,
+            target_chat: int | str,
+            admin_id: Optional[int],
+            *,
+            include_revoked: bool,
+            delay_sec: float,
+            jitter_sec: float,
+            page_limit: int,
+            before_request: Optional[Callable[[], Awaitable[None]]],
+            start: Optional[PageCursor],
+        ) -> AsyncIterator[tuple[List[types.ChatInviteExported], Optional[PageCursor]]]:
+    """
+    Ссылки админа admin_id (None — самого аккаунта client) страницами (см. iter_links_pages);
+    admin_id попадает и в курсор.
+    """
+
+    async def _fetch_page(offset_date: Optional[dt.datetime], offset_link: Optional[str], revoked: bool):
+        if before_request is not None:
+            await before_request()
+
+        async def _do(c: TelegramClient):
+            res = await c(functions.messages.GetExportedChatInvitesRequest(
+                peer=await _peers.peer(c, target_chat),
+                admin_id=await _admin_input(c, target_chat, admin_id),
+                limit=page_limit,
+                offset_date=offset_date,
+                offset_link=offset_link,
+                revoked=revoked,
+            ))
+            _peers.remember_users(c, getattr(res, "users", ()))
+            return res
+
+        return await _with_flood_retry(client, _do, kind="list")
+
+    revoked, offset_date, offset_link = start[:3] if start else (False, None, None)
+    if revoked and not include_revoked:
+        return
+    while True:
+        res: types.messages.ExportedChatInvites = await _fetch_page(offset_date, offset_link, revoked)
+        last = res.invites[-1] if res.invites else None
+        next_date = getattr(last, "date", None)
+        next_link = getattr(last, "link", None)
+        if next_date and next_link and len(res.invites) >= page_limit:
+            yield res.invites, (revoked, next_date, next_link, admin_id)
+            offset_date, offset_link = next_date, next_link
+            await _sleep_delay(delay_sec, jitter_sec)
+        elif include_revoked and not revoked:
+            # активные кончились — дальше отозванные
+            yield res.invites, (True, None, None, admin_id)
+            revoked, offset_date, offset_link = True, None, None
+            await _sleep_delay(delay_sec, jitter_sec)
+        else:
+            yield res.invites, None
+            return
+
+
+async def _fan_out(
+            positions: List[PageCursor],
+            streams: List[AsyncIterator[tuple[List[types.ChatInviteExported], Optional[PageCursor]]]],
+            concurrency: int,
+        ) -> AsyncIterator[tuple[List[types.ChatInviteExported], Optional[PageCursor]]]:
+    """
+    Листать streams (по одному на админа, в порядке user id; positions — их стартовые курсоры)
+    не больше concurrency одновременно, страницы отдавать по мере готовности.
+    Курсор страницы — позиция первого по порядку недолистанного админа: при продолжении
+    с него админы до него уже не листаются, а после него — листаются заново.
+    """
+    cursors: List[Optional[PageCursor]] = list(positions)      # None — админ долистан
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, concurrency))
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _run(i: int) -> None:
+        async with sem:
+            try:
+                async for page, cursor in streams[i]:
+                    await queue.put((i, page, cursor, None))
+            except Exception as e:
+                await queue.put((i, None, None, e))
+            else:
+                await queue.put((i, None, None, None))
+
+    # задачи стартуют по порядку, семафор пропускает их в том же порядке
+    tasks = [asyncio.create_task(_run(i), name=f"links_admin:{i}") for i in range(len(streams))]
+    try:
+        left = len(streams)
+        while left:
+            i, page, cursor, error = await queue.get()
+            if error is not None:
+                raise error
+            if page is None:
+                cursors[i] = None
+                left -= 1
+                continue
+            cursors[i] = cursor
+            yield page, next((c for c in cursors if c is not None), None)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for stream in streams:
+            with contextlib.suppress(Exception):
+                await stream.aclose()
+
+
+async def iter_links_pages(
+            client: Client,
+            target_chat: int | str,
+            *,
+            include_revoked: bool = False,
+            delay_sec: float = 0.0,     # темп задаёт общий лимитер; пауза — только если нужна сверх него
+            jitter_sec: float = 0.0,
+            page_limit: int = 100,
+            before_request: Optional[Callable[[], Awaitable[None]]] = None,
+            start: Optional[PageCursor] = None,
+            admins: Optional[Iterable[int]] = None,
+            lister: Optional[Client] = None,
+            concurrency: int = 1,
+        ) -> AsyncIterator[tuple[List[types.ChatInviteExported], Optional[PageCursor]]]:
+    """
+    Ссылки чата страницами по мере получения: (page, next_cursor), где next_cursor —
+    позиция следующей страницы (None — страниц больше нет).
+    admins — user id админов, чьи ссылки листать (см. get_admins_with_invites); по умолчанию —
+    только свои: аккаунта или каждого аккаунта пула. Админы идут в порядке user id,
+    до concurrency одновременно. Свои ссылки аккаунт пула листает сам, чужие — lister
+    (клиент с правом видеть ссылки других админов, см. get_admins_with_invites; по умолчанию client).
+    before_request ждётся перед каждой страницей — через него планировщик
+    делит общий бюджет запросов между чатами.
+    start — продолжить с сохранённой позиции (вместо первой страницы активных ссылок).
+    """
+    opts = dict(include_revoked=include_revoked, delay_sec=delay_sec, jitter_sec=jitter_sec,
+                page_limit=page_limit, before_request=before_request)
+    resume_admin = start[3] if start else None
+    if admins is None:
+        if not isinstance(client, AccountPool):
+            own_start = start if resume_admin is None else None     # позиция в чужом списке нам не подходит
+            async for item in _iter_admin_pages(client, target_chat, None, start=own_start, **opts):
+                yield item
+            return
+        admins = [a.user_id for a in client.accounts if a.disabled is None and a.user_id is not None]
+        if not admins:
+            raise NoAccountsError("нет аккаунтов для чтения ссылок")
+
+    def _lister(admin_id: int) -> Client:
+        account = client.by_user_id(admin_id) if isinstance(client, AccountPool) else None
+        if account is not None and account.disabled is None:
+            return client.only(account)
+        return lister if lister is not None else client
+
+    order = sorted(a for a in set(admins) if resume_admin is None or a >= resume_admin)
+    positions = [start if a == resume_admin else (False, None, None, a) for a in order]
+    streams = [
+        _iter_admin_pages(_lister(a), target_chat, a, start=p if a == resume_admin else None, **opts)
+        for a, p in zip(order, positions)
+    ]
+    async for item in _fan_out(positions, streams, concurrency):
+        yield item
 
 
 async def get_all_links(
-            client: TelegramClient,
+            client: Client,
             target_chat: int | str,
             *,
             include_revoked: bool = False,
-            delay_sec: float = 0.3,
-            jitter_sec: float = 0.2,
+            delay_sec: float = 0.0,     # темп задаёт общий лимитер; пауза — только если нужна сверх него
+            jitter_sec: float = 0.0,
             page_limit: int = 100,
+            before_request: Optional[Callable[[], Awaitable[None]]] = None,
+            start: Optional[PageCursor] = None,
         ) -> List[types.ChatInviteExported]:
-    me = await client.get_me()
+    """
+    Все ссылки чата одним списком (см. iter_links_pages — то же постранично,
+    без накопления всего списка в памяти).
+    """
     invites: List[types.ChatInviteExported] = []
+    async for page, _ in iter_links_pages(
+        client, target_chat,
+        include_revoked=include_revoked, delay_sec=delay_sec, jitter_sec=jitter_sec,
+        page_limit=page_limit, before_request=before_request, start=start,
+    ):
+        invites.extend(page)
+    return invites
 
-    async def _fetch_page(offset_date: Optional[dt.datetime], offset_link: Optional[str], revoked: bool):
-        return await _with_flood_retry(lambda: client(functions.messages.GetExportedChatInvitesRequest(
-            peer=target_chat,
-            admin_id=me,
-            limit=page_limit,
-            offset_date=offset_date,
-            offset_link=offset_link,
-            revoked=revoked,
-        )))
-
-    async def collect(revoked: bool):
-        offset_date: Optional[dt.datetime] = None
-        offset_link: Optional[str] = None
+
+async def prefetch(agen: AsyncIterator[T], depth: int = 1) -> AsyncIterator[T]:
+    """
+    Читать agen на depth элементов вперёд в отдельной задаче: пока потребитель
+    обрабатывает страницу N (пишет в БД), следующая уже качается из сети.
+    Ошибка источника поднимается у потребителя; при выходе из цикла источник закрывается.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, depth))
+    end = object()
+
+    async def _produce() -> None:
+        try:
+            async for item in agen:
+                await queue.put((item, None))
+        except Exception as e:
+            await queue.put((end, e))
+        else:
+            await queue.put((end, None))
+
+    task = asyncio.create_task(_produce(), name="prefetch")
+    try:
         while True:
-            res: types.messages.ExportedChatInvites = await _fetch_page(offset_date, offset_link, revoked)
-            if not res.invites:
-                break
-            invites.extend(res.invites)
-            last = res.invites[-1]
-            next_date = getattr(last, "date", None)
-            next_link = getattr(last, "link", None)
-            if not next_date or not next_link:
-                break
-            offset_date, offset_link = next_date, next_link
-            if len(res.invites) < page_limit:
-                break
-            await _sleep_delay(delay_sec, jitter_sec)
+            item, error = await queue.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        task.cancel()
+        with contextlib.suppress(BaseException):
+            await task
+        with contextlib.suppress(Exception):
+            await agen.aclose()
 
-    await collect(False)
-    if include_revoked:
-        await collect(True)
-    return invites
+
+async def _get_admins(c: TelegramClient, target_chat: int | str) -> types.messages.ChatAdminsWithInvites:
+    res = await c(functions.messages.GetAdminsWithInvitesRequest(peer=await _peers.peer(c, target_chat)))
+    _peers.remember_users(c, res.users)
+    return res
+
+
+async def _admin_input(c: TelegramClient, target_chat: int | str, admin_id: Optional[int]) -> types.InputUser:
+    """InputUser админа admin_id для запроса от имени c (None или сам c — свой)."""
+    me = await _peers.me(c)
+    if admin_id is None or admin_id == me.user_id:
+        return me
+    user = _peers.user(c, admin_id)
+    if user is None:
+        # access_hash админа клиент получает в users списка админов — этот клиент его ещё не видел
+        await _get_admins(c, target_chat)
+        user = _peers.user(c, admin_id)
+    if user is None:
+        raise ValueError(f"админ {admin_id} не найден среди админов чата {target_chat}")
+    return user
+
+
+async def get_admins_with_invites(
+            client: Client, target_chat: int | str,
+        ) -> tuple[dict[int, tuple[int, int]], Client]:
+    """
+    Админы чата, у которых есть ссылки: (user id -> (активных, отозванных), клиент, которому
+    видны ссылки других админов — его передают в iter_links_pages как lister).
+    Видеть чужие ссылки может не каждый админ: из пула берётся первый по порядку аккаунт,
+    которому Telegram отдал список; если ни одному — RPCError.
+    """
+    if isinstance(client, AccountPool):
+        candidates: List[Client] = [client.only(a) for a in client.accounts if a.disabled is None]
+        if not candidates:
+            raise NoAccountsError("нет аккаунтов для чтения списка админов")
+    else:
+        candidates = [client]
+    for i, c in enumerate(candidates):
+        try:
+            res = await _with_flood_retry(c, lambda cl: _get_admins(cl, target_chat), kind="list")
+        except RPCError:
+            if i + 1 == len(candidates):
+                raise
+            continue
+        return {a.admin_id: (a.invites_count, a.revoked_invites_count) for a in res.admins}, c
+    raise AssertionError("candidates не пуст")
+
+
+async def own_user_ids(client: Client) -> set[int]:
+    """user id своих аккаунтов: юзербота или всех аккаунтов пула."""
+    if isinstance(client, AccountPool):
+        return {a.user_id for a in client.accounts if a.user_id is not None}
+    return {(await _peers.me(client)).user_id}
+
+
+async def _get_invite(c: TelegramClient, target_chat: int | str, link: str):
+    return await c(functions.messages.GetExportedChatInviteRequest(peer=await _peers.peer(c, target_chat), link=link))
+
+
+async def get_invites_by_links(
+            client: Client,
+            target_chat: int | str,
+            links: Iterable[str],
+            *,
+            delay_sec: float = 0.0,     # темп задаёт общий лимитер; пауза — только если нужна сверх него
+            jitter_sec: float = 0.0,
+            before_request: Optional[Callable[[], Awaitable[None]]] = None,
+        ) -> List[types.ChatInviteExported]:
+    """
+    Точечно обновить конкретные ссылки (GetExportedChatInviteRequest на каждую) —
+    для «горячих» ссылок, которые дешевле перечитать по одной, чем листать весь список.
+    Ссылки, которые Telegram не отдал (удалены, чужие, невалидны), пропускаются.
+    """
+    out: List[types.ChatInviteExported] = []
+    for link in links:
+        if before_request is not None:
+            await before_request()
+        try:
+            res = await _with_flood_retry(client, lambda c: _get_invite(c, target_chat, link), kind="get")
+        except RPCError as e:
+            log.warning(f"[hot] ссылка {link} недоступна: {e}")
+            continue
+        # ExportedChatInviteReplaced: ссылку перевыпустили — нам интересна именно старая
+        out.append(res.invite)
+        await _sleep_delay(delay_sec, jitter_sec)
+    return out
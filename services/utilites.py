@@ -1,11 +1,51 @@
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
 from io import BytesIO
 import datetime as dt
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterable, Callable, Optional
 from telethon.tl import types
 
 
+_STAT_HEADERS = [
+    "Ссылка",
+    "Название",
+    "Использовано",
+    "Одобрено заявок",
+    "Всего посещений",
+    "Дата создания",
+    "Последняя проверка",
+]
+_OWNER_HEADERS = ["Создал (tg_id)", "Username", "Имя"]
+
+
+def _fmt_ts(ts: Optional[int], tz: dt.tzinfo) -> str:
+    return (
+        dt.datetime.fromtimestamp(ts, tz=dt.timezone.utc).astimezone(tz).strftime("%Y-%m-%d %H:%M:%S")
+        if ts else ""
+    )
+
+
+def _stat_row(row: Dict[str, Any], owners: bool, local_tz: dt.tzinfo) -> list:
+    """
+    Строка выгрузки статистики по ссылке (общая для create_excel и create_excel_stream).
+    Если owners=True — первыми идут колонки владельца (_OWNER_HEADERS).
+    """
+    base_cells = [
+        row.get("link", ""),
+        row.get("title", ""),
+        row.get("usage", 0),
+        row.get("approved_request_count", 0),
+        row.get("visits_total", 0),
+        _fmt_ts(row.get("date_created"), local_tz),
+        _fmt_ts(row.get("last_synced_at"), local_tz),
+    ]
+    if owners:
+        return [row.get("owner_tg_id", ""), row.get("owner_username", ""), row.get("owner_first_name", "")] + base_cells
+    return base_cells
+
+
 async def create_excel(data: List[Dict[str, Any]], owners: bool = False, include: list[str]= None) -> BytesIO:
     """
     Создаёт Excel-файл в памяти и возвращает BytesIO с установленным именем.
@@ -28,19 +68,7 @@ async def create_excel(data: List[Dict[str, Any]], owners: bool = False, include
     ws = wb.active
     ws.title = "Links Stat"
 
-    base_headers = [
-        "Ссылка",
-        "Название",
-        "Использовано",
-        "Одобрено заявок",
-        "Всего посещений",
-        "Дата создания",
-        "Последняя проверка",
-    ]
-    if owners:
-        headers = ["Создал (tg_id)", "Username", "Имя"] + base_headers
-    else:
-        headers = base_headers
+    headers = _OWNER_HEADERS + _STAT_HEADERS if owners else _STAT_HEADERS
 
     ws.append(headers)
 
@@ -55,38 +83,7 @@ async def create_excel(data: List[Dict[str, Any]], owners: bool = False, include
     total = len(data)
     # Заполнение строк
     for row in data:
-        date_created = (
-            dt.datetime.fromtimestamp(row["date_created"], tz=dt.timezone.utc)
-            .astimezone(local_tz)
-            .strftime("%Y-%m-%d %H:%M:%S")
-            if row.get("date_created") else ""
-        )
-        last_synced = (
-            dt.datetime.fromtimestamp(row["last_synced_at"], tz=dt.timezone.utc)
-            .astimezone(local_tz)
-            .strftime("%Y-%m-%d %H:%M:%S")
-            if row.get("last_synced_at") else ""
-        )
-
-        base_cells = [
-            row.get("link", ""),
-            row.get("title", ""),
-            row.get("usage", 0),
-            row.get("approved_request_count", 0),
-            row.get("visits_total", 0),
-            date_created,
-            last_synced,
-        ]
-
-        if owners:
-            owner_id = row.get("owner_tg_id", "")
-            owner_username = row.get("owner_username", "")
-            owner_first_name = row.get("owner_first_name", "")
-            out_row = [owner_id, owner_username, owner_first_name] + base_cells
-        else:
-            out_row = base_cells
-
-        ws.append(out_row)
+        ws.append(_stat_row(row, owners, local_tz))
 
     # Автоширина колонок
     for col in ws.columns:
@@ -109,6 +106,63 @@ async def create_excel(data: List[Dict[str, Any]], owners: bool = False, include
     return buf
 
 
+async def create_excel_stream(
+    chunks: AsyncIterable[List[Dict[str, Any]]],
+    owners: bool = False,
+    include: list[str] = None,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> Optional[BytesIO]:
+    """
+    Как create_excel, но принимает пачки строк (iter_invites_by_owner / iter_all_invites)
+    и пишет их в write-only книгу по мере поступления — вся выборка в памяти не держится.
+    Группировку по владельцу здесь не делаем: нужный порядок задаёт источник
+    (iter_all_invites(group_by_owner=True)). Ширина колонок фиксированная.
+    progress(rows, None) зовётся после каждой пачки (services/progress.py).
+    Возвращает None, если не записано ни одной строки.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Links Stat")
+
+    base_widths = [40, 34, 14, 18, 17, 21, 21]
+    if owners:
+        headers = _OWNER_HEADERS + _STAT_HEADERS
+        widths = [16, 24, 24] + base_widths
+    else:
+        headers = _STAT_HEADERS
+        widths = base_widths
+
+    for i, width in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    header_cells = []
+    for h in headers:
+        cell = WriteOnlyCell(ws, value=h)
+        cell.font = Font(bold=True)
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    local_tz = dt.datetime.now().astimezone().tzinfo
+    include_set = set(include) if include else None
+    total = 0
+    async for chunk in chunks:
+        for row in chunk:
+            if include_set is not None and row.get("link") not in include_set:
+                continue
+            ws.append(_stat_row(row, owners, local_tz))
+            total += 1
+        if progress is not None:
+            progress(total, None)
+
+    # write-only книгу сохраняем в любом случае, иначе она не закроет временный файл
+    buf = BytesIO()
+    wb.save(buf)
+    if not total:
+        return None
+    buf.seek(0)
+    buf.name = f"Total_links_stat({total}).xlsx" if owners else f"links_stat_({total}).xlsx"
+    return buf
+
+
 async def create_excel_from_(data: List[types.ChatInviteExported]) -> BytesIO:
     """
     Создаёт Excel-файл в памяти и возвращает BytesIO с установленным именем.